@@ -0,0 +1,79 @@
+# activity.py
+"""Product page views and add-to-cart clicks per day, for the trending ranking
+
+These are counted on the hottest paths (a product page served from the
+page cache doesn't touch the database at all), so record() only bumps a
+counter in the process. A process's counters are written, with one
+INSERT ... ON CONFLICT DO UPDATE statement that adds them to the stored
+counts, by the first request that finds them FLUSH_INTERVAL old or
+FLUSH_SIZE strong. A process that dies loses at most its
+unwritten counts, which a trend can afford.
+"""
+import threading
+import time
+
+from django.db import connection
+from django.utils import timezone
+
+from .models import Product, ProductActivity
+
+# Seconds between writes
+FLUSH_INTERVAL = 30
+
+# Distinct (day, product) counters that trigger a write sooner
+FLUSH_SIZE = 1000
+
+# Rows per upsert statement, well inside SQLite's bound parameter limit
+UPSERT_BATCH = 200
+
+_lock = threading.Lock()
+# (day, product id) -> [views, cart adds]
+_counts = {}
+_started = time.monotonic()
+
+
+def record(product_id, views=0, cart_adds=0):
+    global _started
+    key = (timezone.localdate(), product_id)
+    with _lock:
+        if not _counts:
+            _started = time.monotonic()
+        counts = _counts.setdefault(key, [0, 0])
+        counts[0] += views
+        counts[1] += cart_adds
+        due = len(_counts) >= FLUSH_SIZE or time.monotonic() - _started >= FLUSH_INTERVAL
+    if due:
+        flush()
+
+
+def record_view(product_id):
+    record(product_id, views=1)
+
+
+def record_cart_add(product_id):
+    record(product_id, cart_adds=1)
+
+
+def flush():
+    """Add this process's counts to ProductActivity; returns how many rows were written"""
+    global _counts
+    with _lock:
+        counts, _counts = _counts, {}
+    # A product deleted since it was viewed has nothing to count against
+    existing = set(Product.objects.filter(pk__in={product_id for _, product_id in counts}).values_list('pk', flat=True))
+    counts = {key: value for key, value in counts.items() if key[1] in existing}
+    if not counts:
+        return 0
+    table = connection.ops.quote_name(ProductActivity._meta.db_table)
+    rows = [(day, product_id, views, cart_adds) for (day, product_id), (views, cart_adds) in counts.items()]
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH):
+            batch = rows[start:start + UPSERT_BATCH]
+            cursor.execute(
+                f"INSERT INTO {table} (day, product_id, views, cart_adds) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s)'] * len(batch))} "
+                f"ON CONFLICT (day, product_id) DO UPDATE SET "
+                f"views = {table}.views + excluded.views, cart_adds = {table}.cart_adds + excluded.cart_adds",
+                [value for row in batch for value in row],
+            )
+    return len(counts)
@@ -2,21 +2,37 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
-from django.db.models import Avg, Count
-from .models import ( Category, Product, ProductImage, Review, Cart, CartItem, Wishlist, Order, OrderItem, NewsletterSubscriber, SiteSettings, User, Contact)
+from django.db.models import Avg, Count, DecimalField, F, Sum
+from .models import ( Category, Note, Product, ProductImage, ProductNote, Review, Cart, CartItem, Wishlist, Order, OrderItem, NewsletterSubscriber, SiteSettings, User, Contact, Job, Campaign, DailySales)
 from django.contrib.auth.admin import UserAdmin
+from django.http import StreamingHttpResponse
+from django.template.response import TemplateResponse
+from .exports import FORMATS, export_filename, export_lines
+from .images import derivative_url
+from .jobs import retry as retry_jobs
+from .newsletters import start_campaign
+from .sales_rollups import sales_dashboard
+
+def export_action(name, fmt, label):
+    """Admin action streaming the selected rows as an export_lines() download"""
+    @admin.action(description=f'Export selected {name} as {label}', permissions=['view'])
+    def export(modeladmin, request, queryset):
+        response = StreamingHttpResponse(export_lines(name, fmt, queryset), content_type=FORMATS[fmt][0])
+        response['Content-Disposition'] = f'attachment; filename="{export_filename(name, fmt)}"'
+        return response
+    export.__name__ = f'export_{fmt}'
+    return export
+
+def export_actions(name):
+    return [export_action(name, 'csv', 'CSV'), export_action(name, 'jsonl', 'JSON Lines')]
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ('name', 'slug', 'product_count', 'is_active', 'created_at')
+    list_display = ('name', 'slug', 'product_count', 'min_price', 'max_price', 'is_active', 'created_at')
     list_filter = ('is_active', 'created_at')
     search_fields = ('name', 'description')
     prepopulated_fields = {'slug': ('name',)}
-    readonly_fields = ('created_at', 'updated_at')
-
-    def product_count(self, obj):
-        return obj.products.count()
-    product_count.short_description = 'Product Count'
+    readonly_fields = ('product_count', 'min_price', 'max_price', 'newest_product_at', 'created_at', 'updated_at')
 
 class ProductImageInline(admin.TabularInline):
     model = ProductImage
@@ -25,7 +41,7 @@ class ProductImageInline(admin.TabularInline):
 
     def preview_image(self, obj):
         if obj.image:
-            return format_html('<img src="{}" width="100" height="100" style="object-fit: cover;" />', obj.image.url)
+            return format_html('<img src="{}" width="100" height="100" style="object-fit: cover;" />', derivative_url(obj.image, 'thumb'))
         return "-"
     preview_image.short_description = 'Preview'
 
@@ -38,23 +54,36 @@ class ReviewInline(admin.TabularInline):
     def has_add_permission(self, request, obj=None):
         return False
 
+class ProductNoteInline(admin.TabularInline):
+    """Notes parsed from fragrance_notes; edit that field to change them"""
+    model = ProductNote
+    extra = 0
+    readonly_fields = ('note', 'tier')
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = (
         'name', 'category', 'price', 'size', 'stock',
-        'is_active', 'is_featured', 'is_best_seller', 'average_rating'
+        'is_active', 'is_featured', 'is_best_seller', 'is_trending', 'average_rating'
     )
     list_filter = (
-        'category', 'is_active', 'is_featured', 'is_best_seller',
+        'category', 'is_active', 'is_featured', 'is_best_seller', 'is_trending',
         'gender', 'size', 'created_at'
     )
     search_fields = ('name', 'description', 'sku', 'fragrance_notes')
     prepopulated_fields = {'slug': ('name',)}
     readonly_fields = (
         'sku', 'created_at', 'updated_at', 'average_rating',
-        'review_count', 'discount_percentage', 'cost_per_ml'
+        'review_count', 'discount_percentage', 'cost_per_ml',
+        # Set by the update_rankings command
+        'is_best_seller', 'is_trending'
     )
-    inlines = [ProductImageInline, ReviewInline]
+    inlines = [ProductImageInline, ProductNoteInline, ReviewInline]
+    actions = export_actions('products')
     fieldsets = (
         ('Basic Information', {
             'fields': ('name', 'slug', 'category', 'description')
@@ -73,7 +102,7 @@ class ProductAdmin(admin.ModelAdmin):
         }),
         ('Flags', {
             'fields': (
-                'is_active', 'is_featured', 'is_best_seller',
+                'is_active', 'is_featured', 'is_best_seller', 'is_trending',
                 'is_new', 'discount_percentage'
             )
         }),
@@ -90,10 +119,21 @@ class ProductAdmin(admin.ModelAdmin):
     def average_rating(self, obj):
         return obj.average_rating()
     average_rating.short_description = 'Avg Rating'
+    average_rating.admin_order_field = 'avg_rating'
 
     def review_count(self, obj):
         return obj.review_count()
     review_count.short_description = 'Review Count'
+    review_count.admin_order_field = 'rating_count'
+
+@admin.register(Note)
+class NoteAdmin(admin.ModelAdmin):
+    list_display = ('name', 'slug', 'product_count')
+    search_fields = ('name',)
+    readonly_fields = ('name', 'slug', 'product_count')
+
+    def has_add_permission(self, request):
+        return False
 
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
@@ -102,18 +142,46 @@ class ReviewAdmin(admin.ModelAdmin):
     search_fields = ('product__name', 'user__username', 'title', 'comment')
     readonly_fields = ('created_at', 'updated_at')
     list_editable = ('is_active',)
+    actions = export_actions('reviews')
 
 class CartItemInline(admin.TabularInline):
     model = CartItem
     extra = 0
     readonly_fields = ('product', 'quantity', 'total_price')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
     list_display = ('user', 'total_items', 'subtotal', 'total')
+    list_select_related = ('user',)
     readonly_fields = ('user', 'total_items', 'subtotal', 'total')
     inlines = [CartItemInline]
 
+    def get_queryset(self, request):
+        # Totals for the whole changelist page in the same query as the carts
+        return super().get_queryset(request).annotate(
+            items_count=Sum('items__quantity'),
+            items_total=Sum(
+                F('items__quantity') * F('items__product__price'),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+
+    def total_items(self, obj):
+        return obj.items_count or 0
+    total_items.short_description = 'Total items'
+    total_items.admin_order_field = 'items_count'
+
+    def subtotal(self, obj):
+        return obj.items_total or 0
+    subtotal.admin_order_field = 'items_total'
+
+    def total(self, obj):
+        return obj.items_total or 0
+    total.admin_order_field = 'items_total'
+
     def has_add_permission(self, request):
         return False
 
@@ -147,6 +215,7 @@ class OrderAdmin(admin.ModelAdmin):
         'created_at', 'updated_at'
     )
     inlines = [OrderItemInline]
+    actions = export_actions('orders')
     fieldsets = (
         ('Order Information', {
             'fields': ('order_number', 'user', 'status')
@@ -193,6 +262,84 @@ class NewsletterSubscriberAdmin(admin.ModelAdmin):
     search_fields = ('email',)
     readonly_fields = ('token', 'created_at', 'updated_at')
 
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'priority', 'attempts', 'max_attempts', 'run_at', 'locked_by', 'updated_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'last_error')
+    readonly_fields = (
+        'name', 'kwargs', 'status', 'priority', 'run_at', 'attempts', 'max_attempts',
+        'locked_by', 'locked_at', 'last_error', 'created_at', 'updated_at'
+    )
+    actions = ['retry_failed']
+
+    @admin.action(description='Retry selected failed jobs')
+    def retry_failed(self, request, queryset):
+        self.message_user(request, f'{retry_jobs(queryset)} job(s) queued again.')
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(Campaign)
+class CampaignAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'status', 'recipient_count', 'sent_count', 'started_at', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('subject',)
+    readonly_fields = ('status', 'recipient_count', 'sent_count', 'started_at', 'finished_at', 'created_at', 'updated_at')
+    actions = ['send_campaigns']
+
+    def get_readonly_fields(self, request, obj=None):
+        # A campaign being sent keeps the content its batches are rendering
+        if obj and obj.status != Campaign.DRAFT:
+            return ('subject', 'body_text', 'body_html') + self.readonly_fields
+        return self.readonly_fields
+
+    @admin.action(description='Send selected draft campaigns')
+    def send_campaigns(self, request, queryset):
+        started = [start_campaign(campaign.pk) for campaign in queryset.filter(status=Campaign.DRAFT)]
+        recipients = sum(campaign.recipient_count for campaign in started)
+        self.message_user(request, f'{len(started)} campaign(s) queued for {recipients} subscriber(s).')
+
+@admin.register(DailySales)
+class SalesDashboardAdmin(admin.ModelAdmin):
+    """The daily sales rollups, shown as a dashboard rather than a change list"""
+    # days -> label of the ranges the dashboard offers
+    RANGES = {30: 'Last 30 days', 90: 'Last 90 days', 365: 'Last year', 730: 'Last 2 years'}
+    DEFAULT_RANGE = 730
+
+    def changelist_view(self, request, extra_context=None):
+        try:
+            days = int(request.GET.get('days', self.DEFAULT_RANGE))
+        except ValueError:
+            days = self.DEFAULT_RANGE
+        if days not in self.RANGES:
+            days = self.DEFAULT_RANGE
+        sales = sales_dashboard(days)
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Sales dashboard',
+            'opts': self.model._meta,
+            'days': days,
+            'ranges': self.RANGES.items(),
+            'tables': [
+                ('By category', sales['by_category']),
+                ('By payment method', sales['by_payment']),
+                ('Top products', sales['top_products']),
+            ],
+            **sales,
+            **(extra_context or {}),
+        }
+        return TemplateResponse(request, 'admin/perfume_app/sales_dashboard.html', context)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 @admin.register(SiteSettings)
 class SiteSettingsAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
@@ -0,0 +1,201 @@
+# also_bought.py
+"""What else customers bought, from order history
+
+CoPurchaseCount is a sparse, symmetric product x product matrix of how
+many orders contained both products; its diagonal counts the orders
+that contained each one. A product's recommendations are its TOP_N
+partners by cosine similarity, orders(a, b) / sqrt(orders(a) * orders(b)),
+so a best-seller doesn't top every list just for being everywhere. They
+are persisted in AlsoBoughtProduct.
+
+update_also_bought() (the update_also_bought command) only reads the
+orders placed since its last run, adds their pairs to the matrix and
+recomputes the lists whose scores that moved. Product and cart pages
+read the lists through a per-product cache.
+"""
+import heapq
+import math
+from collections import Counter
+from datetime import timedelta
+from itertools import combinations, groupby
+from operator import itemgetter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .models import AlsoBoughtProduct, Checkpoint, CoPurchaseCount, Order, OrderItem, Product
+from .page_cache import invalidate
+
+TOP_N = 8
+
+# Pairs seen in fewer orders than this are noise, not a pattern
+MIN_ORDERS_TOGETHER = 2
+
+# Baskets bigger than this (wholesale, gift sets) still count towards
+# their products' totals but add no pairs
+MAX_BASKET_SIZE = 50
+
+# Orders are read once they are this old, so that one whose transaction
+# commits after a higher-numbered order isn't skipped
+SETTLE_TIME = timedelta(minutes=5)
+
+CHECKPOINT = 'also_bought:orders'
+LIST_TIMEOUT = 60 * 60 * 24
+
+
+def _list_key(product_id):
+    return f'also_bought:{product_id}'
+
+
+def _count_pairs(items):
+    """Co-occurrence counts, {(a, b): orders} with a <= b, of (order_id, product_id) rows in order order"""
+    counts = Counter()
+    for _, rows in groupby(items, key=itemgetter(0)):
+        basket = sorted({product_id for _, product_id in rows})
+        counts.update((product_id, product_id) for product_id in basket)
+        if len(basket) <= MAX_BASKET_SIZE:
+            counts.update(combinations(basket, 2))
+    return counts
+
+
+def _add_counts(delta):
+    """Add pair counts to CoPurchaseCount with one read and one upsert; returns the products touched"""
+    touched = {product_id for pair in delta for product_id in pair}
+    stored = dict(
+        ((product_id, other), orders)
+        for product_id, other, orders in CoPurchaseCount.objects.filter(product_id__in=touched)
+        .values_list('product_id', 'other_id', 'orders')
+    )
+    rows = {}
+    for (a, b), orders in delta.items():
+        for pair in {(a, b), (b, a)}:
+            rows[pair] = stored.get(pair, 0) + orders
+    CoPurchaseCount.objects.bulk_create(
+        [CoPurchaseCount(product_id=a, other_id=b, orders=orders) for (a, b), orders in rows.items()],
+        update_conflicts=True,
+        unique_fields=['product', 'other'],
+        update_fields=['orders'],
+        batch_size=1000,
+    )
+    return touched
+
+
+def _recompute_lists(product_ids=None):
+    """Rewrite the AlsoBoughtProduct rows of the given products (default: all) from the matrix
+
+    Returns the products whose list was rewritten or dropped.
+    """
+    counts = CoPurchaseCount.objects.filter(orders__gte=MIN_ORDERS_TOGETHER).exclude(other=F('product'))
+    totals = CoPurchaseCount.objects.filter(other=F('product'))
+    if product_ids is not None:
+        counts = counts.filter(product_id__in=product_ids)
+    pairs = list(counts.order_by('product_id').values_list('product_id', 'other_id', 'orders'))
+    totals = dict(totals.values_list('product_id', 'orders'))
+
+    rows = []
+    for product_id, partners in groupby(pairs, key=itemgetter(0)):
+        scores = [
+            (other, orders / math.sqrt(totals[product_id] * totals[other]), orders)
+            for _, other, orders in partners
+        ]
+        # Equal scores go to the pair seen in more orders
+        best = heapq.nlargest(TOP_N, scores, key=itemgetter(1, 2))
+        rows += [
+            AlsoBoughtProduct(product_id=product_id, recommended_id=other, rank=rank, score=score)
+            for rank, (other, score, _) in enumerate(best, 1)
+        ]
+
+    stored = AlsoBoughtProduct.objects.all()
+    if product_ids is not None:
+        stored = stored.filter(product_id__in=product_ids)
+    updated = {row.product_id for row in rows}
+    updated.update(stored.values_list('product_id', flat=True).distinct())
+    stored.delete()
+    AlsoBoughtProduct.objects.bulk_create(rows, batch_size=1000)
+
+    transaction.on_commit(lambda: forget_also_bought(*updated))
+    return updated
+
+
+@transaction.atomic
+def update_also_bought(full=False):
+    """Fold the orders placed since the last run into the matrix and lists
+
+    full starts over from every order. Returns (orders read, lists
+    recomputed).
+    """
+    # Locking the checkpoint keeps two runs from counting the same orders
+    checkpoint, _ = Checkpoint.objects.select_for_update().get_or_create(name=CHECKPOINT)
+    orders = Order.objects.filter(created_at__lte=timezone.now() - SETTLE_TIME)
+    if not full:
+        orders = orders.filter(pk__gt=checkpoint.position)
+    last_order_id = orders.aggregate(last=Max('pk'))['last']
+    if last_order_id is None and not full:
+        return 0, 0
+    orders = orders.filter(pk__lte=last_order_id or 0)
+
+    items = (
+        OrderItem.objects.filter(order__in=orders)
+        .order_by('order_id')
+        .values_list('order_id', 'product_id')
+        .iterator(chunk_size=2000)
+    )
+    delta = _count_pairs(items)
+    order_count = orders.count()
+
+    if full:
+        CoPurchaseCount.objects.all().delete()
+        _add_counts(delta)
+        updated = _recompute_lists()
+    else:
+        touched = _add_counts(delta)
+        # A product's total is in the score of every pair it's in, so
+        # its partners' lists move too
+        partners = CoPurchaseCount.objects.filter(product_id__in=touched).values_list('other_id', flat=True)
+        updated = _recompute_lists(touched | set(partners))
+
+    checkpoint.position = last_order_id or 0
+    checkpoint.save(update_fields=['position', 'updated_at'])
+    return order_count, len(updated)
+
+
+def get_also_bought(product_ids):
+    """{product_id: [(recommended_id, score)]}, best first, from the cache when possible"""
+    keys = {product_id: _list_key(product_id) for product_id in product_ids}
+    cached = cache.get_many(keys.values())
+    lists = {product_id: cached[key] for product_id, key in keys.items() if key in cached}
+    missing = [product_id for product_id in keys if product_id not in lists]
+    if missing:
+        fetched = {product_id: [] for product_id in missing}
+        rows = AlsoBoughtProduct.objects.filter(product_id__in=missing).order_by('product_id', 'rank')
+        for product_id, recommended_id, score in rows.values_list('product_id', 'recommended_id', 'score'):
+            fetched[product_id].append((recommended_id, score))
+        cache.set_many({keys[product_id]: value for product_id, value in fetched.items()}, LIST_TIMEOUT)
+        lists.update(fetched)
+    return lists
+
+
+def also_bought_products(product_ids, limit=4):
+    """Active products most often bought with any of product_ids, excluding those
+
+    A product recommended for several of them ranks by its summed score.
+    """
+    product_ids = set(product_ids)
+    scores = Counter()
+    for recommendations in get_also_bought(product_ids).values():
+        for recommended_id, score in recommendations:
+            if recommended_id not in product_ids:
+                scores[recommended_id] += score
+    if not scores:
+        return []
+    ranked = [product_id for product_id, _ in scores.most_common()]
+    products = Product.objects.filter(pk__in=ranked, is_active=True).in_bulk()
+    return [products[product_id] for product_id in ranked if product_id in products][:limit]
+
+
+def forget_also_bought(*product_ids):
+    cache.delete_many([_list_key(product_id) for product_id in product_ids])
+    # The detail page shows the list
+    invalidate(*[f'product:{product_id}' for product_id in product_ids])
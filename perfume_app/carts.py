@@ -0,0 +1,273 @@
+# carts.py
+"""Per-cart summary cache
+
+The header badge and every cart JSON endpoint need the cart's item count
+and total. They are cached per cart, dropped whenever the cart's items
+change (or the price of a product in the cart does) and rebuilt with one
+aggregate query on the next read, so the common case costs no query at
+all. The user -> cart id mapping is cached too; it never changes while
+the cart exists.
+
+Anonymous visitors get a GuestCart kept in their session, with no
+database writes; it is merged into their Cart when they log in.
+"""
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Cart, CartItem, Product
+
+SUMMARY_TIMEOUT = 60 * 60 * 24
+EMPTY_SUMMARY = {'count': 0, 'total': Decimal('0.00')}
+
+
+def _cart_id_key(user_id):
+    return f'cart:id:{user_id}'
+
+
+def _summary_key(cart_id):
+    return f'cart:summary:{cart_id}'
+
+
+def get_cart_id(user_id):
+    """The user's cart id, or 0 if they don't have a cart yet"""
+    key = _cart_id_key(user_id)
+    cart_id = cache.get(key)
+    if cart_id is None:
+        cart_id = Cart.objects.filter(user_id=user_id).values_list('pk', flat=True).first() or 0
+        cache.set(key, cart_id, None)
+    return cart_id
+
+
+def remember_cart_id(user_id, cart_id):
+    cache.set(_cart_id_key(user_id), cart_id or 0, None)
+
+
+def get_cart_summary(user_id):
+    """{'count': ..., 'total': ...} for the user's cart, from the cache when possible"""
+    cart_id = get_cart_id(user_id)
+    if not cart_id:
+        return dict(EMPTY_SUMMARY)
+    key = _summary_key(cart_id)
+    summary = cache.get(key)
+    if summary is None:
+        summary = CartItem.objects.filter(cart_id=cart_id).totals()
+        cache.set(key, summary, SUMMARY_TIMEOUT)
+    return summary
+
+
+def forget_cart_summaries(*cart_ids):
+    cache.delete_many([_summary_key(cart_id) for cart_id in cart_ids])
+
+
+def cart_changed(*cart_ids):
+    """Drop the carts' summaries now and again when the transaction commits
+
+    The second drop covers a concurrent read that re-cached the old
+    totals while the change was still uncommitted.
+    """
+    forget_cart_summaries(*cart_ids)
+    transaction.on_commit(lambda: forget_cart_summaries(*cart_ids))
+
+
+class GuestCartItem:
+    """A line of a GuestCart, shaped like CartItem for the cart template
+
+    Its id is the product id, which is what the cart JSON endpoints take
+    as item_id for guests.
+    """
+
+    def __init__(self, product, quantity):
+        self.id = product.pk
+        self.product = product
+        self.quantity = quantity
+
+    @property
+    def total_price(self):
+        return self.product.price * self.quantity
+
+
+class GuestCart:
+    """Cart of an anonymous visitor, stored in the session as {product_id: quantity}"""
+
+    SESSION_KEY = 'cart'
+
+    def __init__(self, session):
+        self.session = session
+        self.lines = {int(product_id): quantity for product_id, quantity in session.get(self.SESSION_KEY, {}).items()}
+
+    def __contains__(self, product_id):
+        try:
+            return int(product_id) in self.lines
+        except (TypeError, ValueError):
+            return False
+
+    def _save(self):
+        if self.lines:
+            self.session[self.SESSION_KEY] = {str(product_id): quantity for product_id, quantity in self.lines.items()}
+        else:
+            self.session.pop(self.SESSION_KEY, None)
+
+    def add(self, product_id, quantity=1):
+        self.set(product_id, self.lines.get(int(product_id), 0) + quantity)
+
+    def set(self, product_id, quantity):
+        """Set a line's quantity; zero or less removes it"""
+        product_id = int(product_id)
+        if quantity > 0:
+            self.lines[product_id] = quantity
+        else:
+            self.lines.pop(product_id, None)
+        self._save()
+
+    def remove(self, product_id):
+        self.set(product_id, 0)
+
+    def clear(self):
+        self.lines = {}
+        self._save()
+
+    def apply(self, changes):
+        """Apply folded changes (see fold_operations) to the session cart"""
+        for product_id, (absolute, quantity) in changes.items():
+            self.lines[product_id] = quantity if absolute else self.lines.get(product_id, 0) + quantity
+            if self.lines[product_id] <= 0:
+                del self.lines[product_id]
+        self._save()
+        return {product_id: self.lines.get(product_id, 0) for product_id in changes}
+
+    def get_items(self):
+        products = Product.objects.filter(pk__in=self.lines, is_active=True).select_related('category')
+        return [GuestCartItem(product, self.lines[product.pk]) for product in products]
+
+    def get_items_count(self):
+        """Total quantity of the lines get_summary() counts"""
+        return self.get_summary()['count']
+
+    def get_summary(self):
+        if not self.lines:
+            return dict(EMPTY_SUMMARY)
+        # Count and total both skip lines whose product is gone or inactive
+        prices = Product.objects.filter(pk__in=self.lines, is_active=True).values_list('pk', 'price')
+        lines = [(self.lines[product_id], price) for product_id, price in prices]
+        total = sum((quantity * price for quantity, price in lines), Decimal('0'))
+        return {'count': sum(quantity for quantity, _ in lines), 'total': total.quantize(Decimal('0.01'))}
+
+    def get_total(self):
+        return self.get_summary()['total']
+
+    @property
+    def total(self):
+        return self.get_total()
+
+
+class CartOperationError(ValueError):
+    """A batch of cart operations is malformed"""
+
+
+MAX_BATCH_OPERATIONS = 100
+
+
+def fold_operations(operations):
+    """Collapse a list of cart operations into one change per product
+
+    Each operation is {'op': 'add' | 'set' | 'remove', 'product_id': ...,
+    'quantity': ...}. The result maps product ids to (absolute, quantity):
+    absolute changes replace the stored quantity, the others add to it.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise CartOperationError("Expected a non-empty list of operations.")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise CartOperationError(f"At most {MAX_BATCH_OPERATIONS} operations are allowed per batch.")
+
+    changes = {}
+    for operation in operations:
+        try:
+            op = operation['op']
+            product_id = int(operation['product_id'])
+            quantity = int(operation.get('quantity', 1))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise CartOperationError(f"Malformed operation: {operation!r}")
+        absolute, current = changes.get(product_id, (False, 0))
+        if op == 'add':
+            changes[product_id] = (absolute, current + quantity)
+        elif op == 'set':
+            changes[product_id] = (True, quantity)
+        elif op == 'remove':
+            changes[product_id] = (True, 0)
+        else:
+            raise CartOperationError(f"Unknown operation: {op!r}")
+    return changes
+
+
+def apply_cart_operations(user, changes):
+    """Apply folded changes to the user's Cart in one transaction
+
+    One read for the quantities being added to, one upsert for the lines
+    that remain and one DELETE for the ones that don't, whatever the
+    number of operations. Returns the final {product_id: quantity} of the
+    changed lines.
+    """
+    with transaction.atomic():
+        cart, created = Cart.objects.select_for_update().get_or_create(user=user)
+        relative = [product_id for product_id, (absolute, _) in changes.items() if not absolute]
+        existing = {} if created or not relative else dict(
+            CartItem.objects.filter(cart=cart, product_id__in=relative).values_list('product_id', 'quantity')
+        )
+        final = {
+            product_id: max(quantity if absolute else existing.get(product_id, 0) + quantity, 0)
+            for product_id, (absolute, quantity) in changes.items()
+        }
+
+        CartItem.objects.bulk_create(
+            [CartItem(cart=cart, product_id=product_id, quantity=quantity)
+             for product_id, quantity in final.items() if quantity > 0],
+            update_conflicts=True,
+            unique_fields=['cart', 'product'],
+            update_fields=['quantity', 'updated_at'],
+        )
+        removed = [product_id for product_id, quantity in final.items() if quantity <= 0]
+        if removed:
+            CartItem.objects.filter(cart=cart, product_id__in=removed).delete()
+        cart_changed(cart.pk)
+    return final
+
+
+def get_request_cart_summary(request):
+    """Cart summary for the request's user, or for the guest cart in its session"""
+    if request.user.is_authenticated:
+        return get_cart_summary(request.user.pk)
+    return GuestCart(request.session).get_summary()
+
+
+def merge_guest_cart(session, user):
+    """Move a guest cart into the user's Cart with a single upsert
+
+    Quantities of products already in the user's cart are added up;
+    products that are no longer available are dropped.
+    """
+    guest_cart = GuestCart(session)
+    if not guest_cart.lines:
+        return
+    product_ids = list(
+        Product.objects.filter(pk__in=guest_cart.lines, is_active=True).values_list('pk', flat=True)
+    )
+    with transaction.atomic():
+        cart, created = Cart.objects.get_or_create(user=user)
+        existing = {} if created else dict(
+            CartItem.objects.filter(cart=cart, product_id__in=product_ids).values_list('product_id', 'quantity')
+        )
+        CartItem.objects.bulk_create(
+            [
+                CartItem(cart=cart, product_id=product_id,
+                         quantity=existing.get(product_id, 0) + guest_cart.lines[product_id])
+                for product_id in product_ids
+            ],
+            update_conflicts=True,
+            unique_fields=['cart', 'product'],
+            update_fields=['quantity', 'updated_at'],
+        )
+        # bulk_create doesn't send post_save
+        cart_changed(cart.pk)
+    guest_cart.clear()
@@ -0,0 +1,332 @@
+# catalog_import.py
+"""Bulk catalog import from CSV or JSON Lines
+
+Rows are streamed from the file and written a chunk at a time with one
+upsert (INSERT ... ON CONFLICT (sku) DO UPDATE) instead of a
+Product.save() (and a category query) per row. Categories, SKUs and
+slugs already in use are read once up front. Slug, SKU (when the file has none) and cost per ml are derived
+the same way Product.save() derives them; a row whose derived SKU
+belongs to a different product is reported rather than merged into it.
+
+Every row needs name, category (name or slug) and price. The other
+columns are optional; products that already exist only have the columns
+present in the file overwritten, and keep their slug. The upsert sends
+no signals, so each chunk refreshes the search and note indexes and the
+cart totals it affects itself, and finish() the category statistics
+and cached pages. Similar products are left to rebuild_similar_products,
+which is an offline job in its own right.
+"""
+import csv
+import json
+import os
+from decimal import Decimal, InvalidOperation
+from functools import partial
+from itertools import groupby, islice
+
+from django.db import connection, transaction
+from django.db.models import DecimalField
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .carts import cart_changed
+from .category_stats import refresh_category_stats
+from .models import CartItem, Category, Product
+from .notes import index_product_notes
+from .page_cache import invalidate
+from .search import get_search_backend
+
+REQUIRED_COLUMNS = ('name', 'category', 'price')
+
+CENT = Decimal('0.01')
+
+BOOLEAN_VALUES = {
+    'true': True, 't': True, 'yes': True, 'y': True, '1': True,
+    'false': False, 'f': False, 'no': False, 'n': False, '0': False, '': False,
+}
+
+
+class ImportRowError(ValueError):
+    """A row can't be imported"""
+
+
+def _text(value):
+    return str(value).strip()
+
+
+def _decimal(value):
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ImportRowError(f"not a number: {value!r}")
+    if not number.is_finite() or number < 0:
+        raise ImportRowError(f"not a valid amount: {value!r}")
+    return number.quantize(CENT)
+
+
+def _optional_decimal(value):
+    return None if value in (None, '') else _decimal(value)
+
+
+def _integer(value):
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        raise ImportRowError(f"not a whole number: {value!r}")
+    if number < 0:
+        raise ImportRowError(f"can't be negative: {value!r}")
+    return number
+
+
+def _boolean(value):
+    if isinstance(value, bool):
+        return value
+    try:
+        return BOOLEAN_VALUES[str(value).strip().lower()]
+    except KeyError:
+        raise ImportRowError(f"not a yes/no value: {value!r}")
+
+
+def _level(value):
+    level = _integer(value)
+    if not 1 <= level <= 5:
+        raise ImportRowError(f"must be between 1 and 5: {value!r}")
+    return level
+
+
+def _choice(choices, parse=_text):
+    values = {value for value, _ in choices}
+
+    def parse_choice(value):
+        value = parse(value)
+        if value not in values:
+            raise ImportRowError(f"must be one of {', '.join(map(str, sorted(values)))}: {value!r}")
+        return value
+    return parse_choice
+
+
+# Optional columns: column -> parser; each is the Product field of the same name
+OPTIONAL_COLUMNS = {
+    'sku': _text,
+    'slug': _text,
+    'description': _text,
+    'compare_price': _optional_decimal,
+    'stock': _integer,
+    'low_stock_threshold': _integer,
+    'is_active': _boolean,
+    'is_featured': _boolean,
+    'is_best_seller': _boolean,
+    'is_new': _boolean,
+    'fragrance_notes': _text,
+    'intensity': _level,
+    'longevity': _level,
+    'size': _choice(Product.SIZE_CHOICES, _integer),
+    'gender': _choice(Product.GENDER_CHOICES, lambda value: _text(value).upper()),
+}
+
+
+def read_rows(path, fmt=None):
+    """(line number, {column: value}) for every row of a .csv or .jsonl file"""
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    with open(path, newline='', encoding='utf-8-sig') as source:
+        if fmt == 'csv':
+            reader = csv.DictReader(source)
+            for row in reader:
+                yield reader.line_num, {column.strip().lower(): value for column, value in row.items() if column}
+        elif fmt in ('jsonl', 'ndjson'):
+            for line_number, line in enumerate(source, 1):
+                if line.strip():
+                    try:
+                        row = json.loads(line)
+                    except ValueError as exc:
+                        row = exc
+                    yield line_number, row
+        else:
+            raise ValueError(f"Unsupported format {fmt!r}: expected csv or jsonl.")
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class CatalogImporter:
+    """Imports chunks of rows, keeping the state shared between chunks"""
+
+    def __init__(self, create_categories=False, dry_run=False):
+        self.create_categories = create_categories
+        self.dry_run = dry_run
+        self.categories = {}
+        for category in Category.objects.only('pk', 'name', 'slug'):
+            self.categories[category.name.lower()] = self.categories[category.slug] = category
+        self.slugs = {}
+        # sku -> (lowercased name, category id) of the product it belongs to
+        self.owners = {}
+        for sku, slug, name, category_id in Product.objects.values_list('sku', 'slug', 'name', 'category_id'):
+            self.slugs[sku] = slug
+            self.owners[sku] = (name.lower(), category_id)
+        self.skus = set(self.slugs)
+        self.taken_slugs = set(self.slugs.values())
+        self.product_ids = set()
+        self.created = self.updated = 0
+        self.errors = []
+
+        # Every column but the id with what a new product gets when the
+        # file leaves it out, and the backend's adapter for decimals
+        self.fields = [field for field in Product._meta.concrete_fields if not field.primary_key]
+        self.defaults = {field.attname: field.get_default() for field in self.fields}
+        self.adapters = {
+            field.attname: partial(
+                connection.ops.adapt_decimalfield_value,
+                max_digits=field.max_digits,
+                decimal_places=field.decimal_places,
+            )
+            for field in self.fields
+            if isinstance(field, DecimalField)
+        }
+
+    def _category(self, value):
+        key = _text(value)
+        category = self.categories.get(key.lower()) or self.categories.get(slugify(key))
+        if category is None:
+            if not key:
+                raise ImportRowError("category is empty")
+            if not self.create_categories:
+                raise ImportRowError(f"unknown category {key!r}")
+            category = Category(name=key, slug=slugify(key))
+            if not self.dry_run:
+                category.save()
+            self.categories[key.lower()] = self.categories[category.slug] = category
+        return category
+
+    def _unique_slug(self, slug):
+        candidate, suffix = slug, 2
+        while candidate in self.taken_slugs:
+            candidate = f"{slug}-{suffix}"
+            suffix += 1
+        self.taken_slugs.add(candidate)
+        return candidate
+
+    def build(self, row):
+        """({Product attname: value}, columns present) for a row, or ImportRowError"""
+        if isinstance(row, Exception):
+            raise ImportRowError(f"not valid JSON: {row}")
+        if not isinstance(row, dict):
+            raise ImportRowError("expected an object of column values")
+        row = {str(column).strip().lower(): value for column, value in row.items() if value is not None}
+        missing = [column for column in REQUIRED_COLUMNS if _text(row.get(column, '')) == '']
+        if missing:
+            raise ImportRowError(f"missing {', '.join(missing)}")
+
+        values = {}
+        for column, parse in OPTIONAL_COLUMNS.items():
+            if column in row:
+                try:
+                    values[column] = parse(row[column])
+                except ImportRowError as exc:
+                    raise ImportRowError(f"{column} {exc}")
+        try:
+            price = _decimal(row['price'])
+        except ImportRowError as exc:
+            raise ImportRowError(f"price {exc}")
+        name = _text(row['name'])[:200]
+        category = self._category(row['category'])
+        columns = frozenset(values) - {'sku', 'slug'}
+
+        # What Product.save() would derive
+        size = values.get('size', self.defaults['size'])
+        sku = values.get('sku')
+        owner = (name.lower(), category.pk)
+        if not sku:
+            # A derived SKU only has the first letters of the category and
+            # name, so "Rose Noir" and "Rosewood" get the same one: a row
+            # mustn't update another product through it
+            sku = Product.build_sku(category.name, name, size)
+            if self.owners.get(sku, owner) != owner:
+                raise ImportRowError(
+                    f"derived SKU {sku} already belongs to another product in this category; give the row a sku"
+                )
+        self.owners[sku] = owner
+        if sku in self.slugs:
+            slug = self.slugs[sku]
+        else:
+            slug = self._unique_slug(slugify(values.get('slug') or name)[:190] or 'product')
+            self.slugs[sku] = slug
+        values.update(
+            name=name,
+            category_id=category.pk,
+            price=price,
+            sku=sku,
+            slug=slug,
+            cost_per_ml=(price / size).quantize(CENT) if price and size else None,
+        )
+        return values, columns
+
+    def import_chunk(self, rows):
+        """Import (line number, row) pairs; returns (created, updated, errors) for the chunk"""
+        products = {}
+        errors = []
+        for line_number, row in rows:
+            try:
+                values, columns = self.build(row)
+            except ImportRowError as exc:
+                errors.append((line_number, str(exc)))
+                continue
+            # A later row for the same SKU wins
+            products[values['sku']] = (values, columns)
+        self.errors += errors
+
+        updated = sum(sku in self.skus for sku in products)
+        created = len(products) - updated
+        self.skus.update(products)
+        if not self.dry_run and products:
+            self._write(products)
+        self.created += created
+        self.updated += updated
+        return created, updated, len(errors)
+
+    def _write(self, products):
+        # Rows are handed to executemany as plain tuples: bulk_create runs
+        # every value through its field and splits the chunk into 999-
+        # parameter statements, which costs several times the insert
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        defaults = {**self.defaults, 'created_at': now, 'updated_at': now}
+        fields = self.fields
+        columns = [field.column for field in fields]
+        with transaction.atomic(), connection.cursor() as cursor:
+            # One upsert per set of columns, so a file without e.g. stock leaves stock alone
+            by_columns = sorted(products.values(), key=lambda item: sorted(item[1]))
+            for present, group in groupby(by_columns, key=lambda item: item[1]):
+                update_columns = ['name', 'category_id', 'price', 'cost_per_ml', 'updated_at', *sorted(present)]
+                sql = 'INSERT INTO {} ({}) VALUES ({}) {}'.format(
+                    connection.ops.quote_name(Product._meta.db_table),
+                    ', '.join(connection.ops.quote_name(column) for column in columns),
+                    ', '.join(['%s'] * len(columns)),
+                    connection.ops.on_conflict_suffix_sql(fields, OnConflict.UPDATE, update_columns, ['sku']),
+                )
+                rows = []
+                for values, _ in group:
+                    row = {**defaults, **values}
+                    for name, adapt in self.adapters.items():
+                        row[name] = adapt(row[name])
+                    rows.append(list(row.values()))
+                cursor.executemany(sql, rows)
+
+            product_ids = list(Product.objects.filter(sku__in=products).values_list('pk', flat=True))
+            self.product_ids.update(product_ids)
+
+            # What the post_save receivers would have done
+            get_search_backend().index_products(product_ids)
+            index_product_notes(product_ids)
+            cart_ids = set(CartItem.objects.filter(product_id__in=product_ids).values_list('cart_id', flat=True))
+            if cart_ids:
+                cart_changed(*cart_ids)
+
+    def finish(self):
+        """Refresh what depends on the whole import, once"""
+        if self.dry_run or not self.product_ids:
+            return
+        # A product may have moved out of a category it isn't in any more
+        refresh_category_stats()
+        invalidate('products', 'categories', 'facets', *[f'product:{product_id}' for product_id in self.product_ids])
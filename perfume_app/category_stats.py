@@ -0,0 +1,41 @@
+# category_stats.py
+"""Denormalized per-category catalog statistics
+
+Category.product_count, min_price, max_price and newest_product_at
+describe the category's active products. Listings show them for every
+category, so they are stored on the row rather than aggregated on each
+render. They are refreshed with one UPDATE whenever a product that
+affects them is saved or deleted (see signals.py).
+"""
+from django.db.models import Count, Max, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Category, Product
+
+
+def refresh_category_stats(queryset=None):
+    """Recompute the statistics for the given categories (default: all)"""
+    if queryset is None:
+        queryset = Category.objects.all()
+
+    active_products = Product.objects.filter(
+        category=OuterRef('pk'), is_active=True
+    ).order_by().values('category')
+    return queryset.update(
+        product_count=Coalesce(Subquery(active_products.annotate(total=Count('id')).values('total')), 0),
+        min_price=Subquery(active_products.annotate(value=Min('price')).values('value')),
+        max_price=Subquery(active_products.annotate(value=Max('price')).values('value')),
+        newest_product_at=Subquery(active_products.annotate(value=Max('created_at')).values('value')),
+    )
+
+
+def product_changed(old_state, new_state):
+    """Refresh the categories a product save or delete affects, if any
+
+    States are Product.category_stats_contribution() before and after
+    (None for a product that didn't / no longer exists).
+    """
+    if old_state == new_state:
+        return
+    category_ids = {state[0] for state in (old_state, new_state) if state is not None}
+    refresh_category_stats(Category.objects.filter(pk__in=category_ids))
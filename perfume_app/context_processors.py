@@ -0,0 +1,29 @@
+# context_processors.py
+from django.utils.functional import SimpleLazyObject
+
+from .carts import GuestCart, get_cart_summary
+from .wishlists import get_wishlisted_ids
+
+
+def header_counts(request):
+    """Cart and wishlist badge counts for the header, and the wishlisted product ids
+
+    All are lazy: the cache (or, on a miss, the database) is only
+    consulted if a template actually renders them. Guests' cart count
+    is read from their session, less any products no longer available.
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        session = getattr(request, 'session', None)
+        if session is None:
+            return {'cart_count': 0, 'wishlist_count': 0, 'wishlisted_ids': frozenset()}
+        return {
+            'cart_count': SimpleLazyObject(lambda: GuestCart(session).get_items_count()),
+            'wishlist_count': 0,
+            'wishlisted_ids': frozenset(),
+        }
+    return {
+        'cart_count': SimpleLazyObject(lambda: get_cart_summary(user.pk)['count']),
+        'wishlist_count': SimpleLazyObject(lambda: len(get_wishlisted_ids(user.pk))),
+        'wishlisted_ids': SimpleLazyObject(lambda: get_wishlisted_ids(user.pk)),
+    }
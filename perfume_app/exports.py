@@ -0,0 +1,209 @@
+# exports.py
+"""Streaming CSV / JSON Lines exports of products, orders and reviews
+
+Each export is one query: the columns, related ones included, are read
+with values_list() through joins rather than per-row lookups (the
+product's rating comes from its stored aggregates), and rows are pulled
+with iterator(), which uses a server-side cursor where the database has
+them, CHUNK_SIZE rows at a time. Lines are generated as rows arrive, so
+a download starts right away and memory stays flat however many rows
+there are. The admin actions (see admin.py) and the export_data
+command both stream export_lines().
+"""
+import csv
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import groupby
+
+from django.utils import timezone
+
+from .models import OrderItem, Product, Review
+
+CHUNK_SIZE = 2000
+
+# Lines are sent in blocks of about this many characters rather than one by one
+BLOCK_SIZE = 64 * 1024
+
+# format -> (content type, file extension)
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'jsonl'),
+}
+
+# (header, lookup) of each export's columns
+PRODUCT_COLUMNS = [
+    ('sku', 'sku'),
+    ('name', 'name'),
+    ('slug', 'slug'),
+    ('category', 'category__name'),
+    ('price', 'price'),
+    ('compare_price', 'compare_price'),
+    ('cost_per_ml', 'cost_per_ml'),
+    ('stock', 'stock'),
+    ('low_stock_threshold', 'low_stock_threshold'),
+    ('is_active', 'is_active'),
+    ('is_featured', 'is_featured'),
+    ('is_best_seller', 'is_best_seller'),
+    ('is_new', 'is_new'),
+    ('fragrance_notes', 'fragrance_notes'),
+    ('intensity', 'intensity'),
+    ('longevity', 'longevity'),
+    ('size', 'size'),
+    ('gender', 'gender'),
+    ('average_rating', 'avg_rating'),
+    ('review_count', 'rating_count'),
+    ('created_at', 'created_at'),
+    ('updated_at', 'updated_at'),
+]
+
+ORDER_COLUMNS = [
+    ('order_number', 'order_number'),
+    ('created_at', 'created_at'),
+    ('status', 'status'),
+    ('payment_status', 'payment_status'),
+    ('payment_method', 'payment_method'),
+    ('customer_email', 'email'),
+    ('first_name', 'first_name'),
+    ('last_name', 'last_name'),
+    ('phone', 'phone'),
+    ('address', 'address'),
+    ('city', 'city'),
+    ('state', 'state'),
+    ('zip_code', 'zip_code'),
+    ('country', 'country'),
+    ('subtotal', 'subtotal'),
+    ('tax_amount', 'tax_amount'),
+    ('shipping_cost', 'shipping_cost'),
+    ('discount_amount', 'discount_amount'),
+    ('total', 'total'),
+    ('tracking_number', 'tracking_number'),
+]
+
+ORDER_ITEM_COLUMNS = [
+    ('sku', 'product__sku'),
+    ('product', 'product__name'),
+    ('quantity', 'quantity'),
+    ('price', 'price'),
+]
+
+REVIEW_COLUMNS = [
+    ('product_sku', 'product__sku'),
+    ('product', 'product__name'),
+    ('user_email', 'user__email'),
+    ('rating', 'rating'),
+    ('title', 'title'),
+    ('comment', 'comment'),
+    ('is_active', 'is_active'),
+    ('verified_purchase', 'verified_purchase'),
+    ('created_at', 'created_at'),
+]
+
+
+def _value(value):
+    """A cell as written: decimals as exact strings, dates in ISO 8601"""
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _rows(queryset, columns):
+    return queryset.order_by('pk').values_list(*[lookup for _, lookup in columns]).iterator(chunk_size=CHUNK_SIZE)
+
+
+def product_records(products=None):
+    """(header, rows) of products (default: all)"""
+    products = Product.objects.all() if products is None else products
+    return [header for header, _ in PRODUCT_COLUMNS], _rows(products, PRODUCT_COLUMNS)
+
+
+def review_records(reviews=None):
+    """(header, rows) of reviews (default: all)"""
+    reviews = Review.objects.all() if reviews is None else reviews
+    return [header for header, _ in REVIEW_COLUMNS], _rows(reviews, REVIEW_COLUMNS)
+
+
+def order_records(orders=None, nested=False):
+    """(header, rows) of orders (default: all) with their items
+
+    Flat, an order takes one row per item, its own columns repeated.
+    Nested, it is one row whose last column, items, lists the items as
+    {column: value}. Either way items are read in the same query as
+    their order, so an order without items isn't listed.
+    """
+    items = OrderItem.objects.all()
+    if orders is not None:
+        items = items.filter(order__in=orders.values('pk'))
+    lookups = ['order_id'] + [f'order__{lookup}' for _, lookup in ORDER_COLUMNS] + [
+        lookup for _, lookup in ORDER_ITEM_COLUMNS
+    ]
+    rows = items.order_by('order_id', 'pk').values_list(*lookups).iterator(chunk_size=CHUNK_SIZE)
+    order_header = [header for header, _ in ORDER_COLUMNS]
+    item_header = [header for header, _ in ORDER_ITEM_COLUMNS]
+    if not nested:
+        return order_header + [f'item_{header}' for header in item_header], (row[1:] for row in rows)
+
+    def grouped():
+        split = 1 + len(ORDER_COLUMNS)
+        for _, order_rows in groupby(rows, key=lambda row: row[0]):
+            order_rows = list(order_rows)
+            items = [dict(zip(item_header, map(_value, row[split:]))) for row in order_rows]
+            yield order_rows[0][1:split] + (items,)
+    return order_header + ['items'], grouped()
+
+
+EXPORTS = {
+    'products': product_records,
+    'orders': order_records,
+    'reviews': review_records,
+}
+
+
+class _Echo:
+    """File-like object for csv.writer that hands each line back instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(header, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(map(_value, row))
+
+
+def _jsonl_lines(header, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(header, map(_value, row))), ensure_ascii=False) + '\n'
+
+
+def export_lines(name, fmt, queryset=None):
+    """The lines of an export, in blocks of about BLOCK_SIZE characters
+
+    queryset narrows it to some products, orders or reviews (default:
+    all of them).
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format {fmt!r}: expected {' or '.join(FORMATS)}.")
+    if name == 'orders':
+        header, rows = order_records(queryset, nested=fmt == 'jsonl')
+    else:
+        header, rows = EXPORTS[name](queryset)
+    lines = _csv_lines(header, rows) if fmt == 'csv' else _jsonl_lines(header, rows)
+
+    block, length = [], 0
+    for line in lines:
+        block.append(line)
+        length += len(line)
+        if length >= BLOCK_SIZE:
+            yield ''.join(block)
+            block, length = [], 0
+    if block:
+        yield ''.join(block)
+
+
+def export_filename(name, fmt):
+    return f"{name}-{timezone.localdate():%Y%m%d}.{FORMATS[fmt][1]}"
@@ -0,0 +1,255 @@
+# facets.py
+"""Faceted filtering for the catalog
+
+Every facet is a list of options, each a Q on Product. Options of the same
+facet are OR'ed together and facets are AND'ed, so ?gender=U&size=100
+&size=50&price=0-50 means "unisex, 50 or 100ml, under $50".
+
+Counts follow the usual faceted-search rule: an option's count applies
+every selected filter except the ones of its own facet, so the sidebar
+shows what picking another option would give. They are computed from a
+bitmap index of the catalog (FacetIndex) that is built with one query
+and cached until a product changes, rather than by a COUNT over the
+products table per request. Only changes to the fields the index holds
+(Product.facet_state(), plus reviews, which move avg_rating) purge it,
+so saving a product's stock or description doesn't.
+"""
+from array import array
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import BooleanField, ExpressionWrapper, Q
+
+from .models import Product
+from .page_cache import cached_value, invalidate
+
+# (value, label, lower bound, upper bound)
+PRICE_BANDS = [
+    ('0-50', 'Under $50', None, 50),
+    ('50-100', '$50 - $100', 50, 100),
+    ('100-200', '$100 - $200', 100, 200),
+    ('200-', 'Over $200', 200, None),
+]
+
+
+def _price_band(low, high):
+    condition = Q()
+    if low is not None:
+        condition &= Q(price__gte=low)
+    if high is not None:
+        condition &= Q(price__lt=high)
+    return condition
+
+
+class Facet:
+    def __init__(self, name, label, options):
+        self.name = name
+        self.label = label
+        # value -> (label, Q)
+        self.options = {value: (option_label, condition) for value, option_label, condition in options}
+
+
+FACETS = [
+    Facet('gender', 'Gender', [(code, label, Q(gender=code)) for code, label in Product.GENDER_CHOICES]),
+    Facet('size', 'Size', [(str(size), label, Q(size=size)) for size, label in Product.SIZE_CHOICES]),
+    Facet('intensity', 'Intensity', [(str(level), f'{level} / 5', Q(intensity=level)) for level in range(1, 6)]),
+    Facet('longevity', 'Longevity', [(str(level), f'{level} / 5', Q(longevity=level)) for level in range(1, 6)]),
+    Facet('price', 'Price Range', [(value, label, _price_band(low, high)) for value, label, low, high in PRICE_BANDS]),
+    Facet('rating', 'Rating', [('4', '⭐ 4+ Stars', Q(avg_rating__gte=4)), ('3', '⭐ 3+ Stars', Q(avg_rating__gte=3))]),
+    Facet('is_new', 'New Arrivals', [('1', 'New arrivals only', Q(is_new=True))]),
+]
+FACETS_BY_NAME = {facet.name: facet for facet in FACETS}
+
+
+def parse_facet_filters(query_dict):
+    """{facet name: [selected values]} for the known facets and values in query_dict
+
+    min_price / max_price, if given, end up under 'price_range' as a
+    (min, max) pair that applies to every count.
+    """
+    filters = {}
+    for facet in FACETS:
+        values = [value for value in dict.fromkeys(query_dict.getlist(facet.name)) if value in facet.options]
+        if values:
+            filters[facet.name] = values
+
+    bounds = []
+    for param in ('min_price', 'max_price'):
+        try:
+            bounds.append(Decimal(query_dict.get(param, '')))
+        except InvalidOperation:
+            bounds.append(None)
+    if bounds != [None, None]:
+        filters['price_range'] = tuple(bounds)
+    return filters
+
+
+def _facet_condition(name, values):
+    facet = FACETS_BY_NAME[name]
+    condition = Q()
+    for value in values:
+        condition |= facet.options[value][1]
+    return condition
+
+
+def _conditions(filters):
+    condition = Q()
+    for name, values in filters.items():
+        if name == 'price_range':
+            low, high = values
+            if low is not None:
+                condition &= Q(price__gte=low)
+            if high is not None:
+                condition &= Q(price__lte=high)
+        else:
+            condition &= _facet_condition(name, values)
+    return condition
+
+
+def apply_facet_filters(queryset, filters):
+    return queryset.filter(_conditions(filters)) if filters else queryset
+
+
+class FacetIndex:
+    """Bitmaps of the active catalog: bit i stands for the i-th product
+
+    Every facet option and every category gets an int whose set bits are
+    the products matching it, so a count is an AND of a few bitmaps and a
+    popcount, and doesn't depend on the size of the catalog the way a
+    COUNT query does.
+    """
+
+    def __init__(self, ids, prices, categories, options):
+        self.ids = ids
+        self.prices = prices
+        self.categories = categories
+        self.options = options
+        self.all = (1 << len(ids)) - 1
+
+    @classmethod
+    def build(cls):
+        """One query: every active product with a boolean column per facet option"""
+        flags = {
+            f'o{number}': ExpressionWrapper(condition, output_field=BooleanField())
+            for number, (_, _, condition) in enumerate(_all_options())
+        }
+        rows = (
+            Product.objects.filter(is_active=True)
+            .order_by('pk')
+            .annotate(**flags)
+            .values_list('pk', 'price', 'category_id', *flags)
+        )
+        columns = list(zip(*rows)) or [()] * (3 + len(flags))
+        index = cls(array('q', columns[0]), array('d', map(float, columns[1])), {}, {})
+
+        by_category = {}
+        for position, category_id in enumerate(columns[2]):
+            by_category.setdefault(category_id, []).append(position)
+        index.categories = {category_id: index.mask(positions) for category_id, positions in by_category.items()}
+        index.options = {
+            (facet_name, value): index.mask(position for position, match in enumerate(column) if match)
+            for (facet_name, value, _), column in zip(_all_options(), columns[3:])
+        }
+        return index
+
+    def mask(self, positions):
+        bits = bytearray((len(self.ids) + 7) // 8)
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+        return int.from_bytes(bits, 'little')
+
+    def products(self, product_ids):
+        """Bitmap of the given product ids (e.g. search results)"""
+        wanted = set(product_ids)
+        return self.mask(position for position, pk in enumerate(self.ids) if pk in wanted)
+
+    def price_range(self, low, high):
+        low = float('-inf') if low is None else float(low)
+        high = float('inf') if high is None else float(high)
+        return self.mask(position for position, price in enumerate(self.prices) if low <= price <= high)
+
+    def matching(self, filters, exclude=None):
+        """Bitmap of the products matching the facet filters, ignoring the facet named exclude"""
+        result = self.all
+        for name, values in filters.items():
+            if name in FACETS_BY_NAME and name != exclude:
+                selected = 0
+                for value in values:
+                    selected |= self.options[(name, value)]
+                result &= selected
+        return result
+
+
+def _all_options():
+    return [(facet.name, value, condition) for facet in FACETS for value, (_, condition) in facet.options.items()]
+
+
+def get_facet_index():
+    """The FacetIndex, rebuilt (by one worker) after a change to what it holds"""
+    return cached_value('facets:index', FacetIndex.build, tags=['facets'])
+
+
+def product_changed(old_state, new_state):
+    """Purge the facet index if a product save or delete changed what it holds
+
+    States are Product.facet_state() before and after (None for a product
+    that didn't / no longer exists).
+    """
+    if old_state != new_state:
+        invalidate('facets')
+
+
+def facet_counts(filters, category_id=None, product_ids=None):
+    """{'total': n, 'facets': {facet: {value: count}}} for the active catalog
+
+    category_id (an int) and product_ids (e.g. search results) narrow the
+    catalog before the facet filters apply.
+    """
+    index = get_facet_index()
+    scope = index.all
+    if category_id:
+        scope &= index.categories.get(category_id, 0)
+    if product_ids is not None:
+        scope &= index.products(product_ids)
+    if 'price_range' in filters:
+        scope &= index.price_range(*filters['price_range'])
+
+    counts = {}
+    for facet in FACETS:
+        others = scope & index.matching(filters, exclude=facet.name)
+        counts[facet.name] = {
+            value: (others & index.options[(facet.name, value)]).bit_count()
+            for value in facet.options
+        }
+    return {'total': (scope & index.matching(filters)).bit_count(), 'facets': counts}
+
+
+def facet_sidebar(request, counts, filters):
+    """Facets with their options' counts, selected state and toggle URLs, for templates"""
+    sidebar = []
+    for facet in FACETS:
+        selected = filters.get(facet.name, [])
+        options = []
+        for value, (label, _) in facet.options.items():
+            params = request.GET.copy()
+            for param in ('page', 'cursor'):
+                params.pop(param, None)
+            values = [other for other in selected if other != value]
+            if value not in selected:
+                values.append(value)
+            params.setlist(facet.name, values)
+            options.append({
+                'value': value,
+                'label': label,
+                'count': counts['facets'][facet.name][value],
+                'selected': value in selected,
+                'url': '?' + params.urlencode(),
+            })
+        sidebar.append({'name': facet.name, 'label': facet.label, 'options': options})
+    return sidebar
+
+
+def clear_facets_url(request):
+    params = request.GET.copy()
+    for param in ('page', 'cursor', 'min_price', 'max_price', 'note', *FACETS_BY_NAME):
+        params.pop(param, None)
+    return '?' + params.urlencode()
@@ -1,7 +1,9 @@
 from django import forms
 from .models import Review
 from django import forms
-from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
+from django.contrib.auth.forms import UserCreationForm, AuthenticationForm, PasswordResetForm
+from .jobs import enqueue
+from .tasks import send_password_reset
 
 from django import forms
 from .models import Contact
@@ -163,6 +165,31 @@ class CustomAuthenticationForm(AuthenticationForm):
     }))
 
 
+class QueuedPasswordResetForm(PasswordResetForm):
+    """Password reset form that queues the email instead of sending it during the request
+
+    The job gets the user's id, not the rendered email: a job is kept
+    (and shown in the admin) when it fails, and must not hold a working
+    reset link. The task makes the token and renders the email.
+    """
+
+    def send_mail(self, subject_template_name, email_template_name, context, from_email, to_email,
+                  html_email_template_name=None):
+        enqueue(
+            send_password_reset,
+            user_id=context['user'].pk,
+            domain=context['domain'],
+            site_name=context['site_name'],
+            protocol=context['protocol'],
+            subject_template_name=subject_template_name,
+            email_template_name=email_template_name,
+            html_email_template_name=html_email_template_name,
+            from_email=from_email,
+            # Ahead of routine mail: someone is waiting for this one
+            priority=10,
+        )
+
+
 class UserProfileForm(forms.ModelForm):
     class Meta:
         model = User
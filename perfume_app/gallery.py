@@ -0,0 +1,43 @@
+# gallery.py
+"""Product images: the denormalized primary image and the detail gallery
+
+Product.primary_image holds the path of the image listings show (the one
+marked primary, else the first in gallery order), so a grid of cards
+needs no query per product. It is refreshed with one UPDATE whenever a
+ProductImage is added, deleted or changes in a way that can affect it
+(see signals.py).
+"""
+from django.db.models import OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Product, ProductImage
+
+# Primary image first, then the admin's order, newest first on ties
+GALLERY_ORDER = ('-is_primary', 'order', '-created_at', 'id')
+
+
+def sync_primary_images(queryset=None):
+    """Recompute Product.primary_image for the given products (default: all)"""
+    if queryset is None:
+        queryset = Product.objects.all()
+    first_image = ProductImage.objects.filter(product=OuterRef('pk')).order_by(*GALLERY_ORDER).values('image')[:1]
+    return queryset.update(primary_image=Coalesce(Subquery(first_image), Value('')))
+
+
+def image_changed(old_state, new_state):
+    """Resync the products a ProductImage save or delete affects, if any
+
+    States are ProductImage.gallery_state() before and after (None for an
+    image that didn't / no longer exists).
+    """
+    if old_state == new_state:
+        return
+    product_ids = {state[0] for state in (old_state, new_state) if state is not None}
+    sync_primary_images(Product.objects.filter(pk__in=product_ids))
+
+
+def prefetch_gallery(queryset):
+    """Fetch every product's images, in gallery order, with one extra query"""
+    return queryset.prefetch_related(
+        Prefetch('images', queryset=ProductImage.objects.order_by(*GALLERY_ORDER), to_attr='gallery')
+    )
@@ -0,0 +1,163 @@
+# images.py
+"""Resized image derivatives for product and category photos
+
+Every uploaded image gets a fixed set of derivatives (thumb, card, detail,
+zoom), each in WebP and JPEG, stored next to the original under
+derivatives/<original name>/<size>.<ext>. Pages then serve an image sized
+for the slot it fills instead of the full-resolution upload.
+
+Derivatives are generated when an image is uploaded (see signals.py).
+Anything still missing, e.g. media uploaded before this existed, is
+generated on first use. The files in storage are the cache; a flag in the
+Django cache saves the existence check on later renders. The
+generate_image_derivatives command backfills existing media.
+"""
+import logging
+import os
+from io import BytesIO
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# name -> (width, height, crop). Cropped sizes fill the box exactly, the
+# others fit inside it; nothing is ever upscaled.
+SIZES = {
+    'thumb': (100, 100, True),
+    'card': (400, 300, True),
+    'detail': (800, 800, False),
+    'zoom': (1600, 1600, False),
+}
+
+# format -> (extension, Pillow format, save options)
+FORMATS = {
+    'webp': ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# What a slot rendered at a given size offers the browser: the size
+# itself plus a larger one for high-density screens, and the default
+# sizes attribute for the slot
+SRCSET_SIZES = {
+    'thumb': (('thumb', 'card'), '100px'),
+    'card': (('card', 'detail'), '(max-width: 600px) 100vw, 300px'),
+    'detail': (('detail', 'zoom'), '(max-width: 900px) 100vw, 50vw'),
+    'zoom': (('zoom',), '100vw'),
+}
+
+DERIVATIVE_DIR = 'derivatives'
+
+
+def derivative_name(name, size, fmt):
+    root, _ = os.path.splitext(name)
+    return f'{DERIVATIVE_DIR}/{root}/{size}.{FORMATS[fmt][0]}'
+
+
+def _flag_key(name):
+    return f'image:derivative:{name}'
+
+
+def _resize(image, size):
+    width, height, crop = SIZES[size]
+    if crop:
+        # Never upscale: crop to the box's aspect ratio at most at the original size
+        scale = min(1, image.width / width, image.height / height)
+        return ImageOps.fit(image, (max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+    resized = image.copy()
+    resized.thumbnail((width, height), Image.LANCZOS)
+    return resized
+
+
+def _encode(image, fmt):
+    _, pillow_format, options = FORMATS[fmt]
+    if pillow_format == 'JPEG' and image.mode != 'RGB':
+        # JPEG has no alpha channel: flatten onto white
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    buffer = BytesIO()
+    image.save(buffer, pillow_format, **options)
+    return buffer.getvalue()
+
+
+def _open(field_file):
+    with field_file.open('rb') as source:
+        image = Image.open(source)
+        image.load()
+    return ImageOps.exif_transpose(image)
+
+
+def generate_derivatives(field_file, sizes=None, formats=None, overwrite=False):
+    """Write the derivatives of an image file; returns how many were written
+
+    Existing derivatives are kept unless overwrite is set. An unreadable
+    source is logged and skipped.
+    """
+    storage = field_file.storage
+    wanted = [
+        (size, fmt) for size in (sizes or SIZES) for fmt in (formats or FORMATS)
+        if overwrite or not storage.exists(derivative_name(field_file.name, size, fmt))
+    ]
+    if not wanted:
+        return 0
+    try:
+        image = _open(field_file)
+    except (OSError, UnidentifiedImageError) as exc:
+        logger.warning("Can't generate derivatives for %s: %s", field_file.name, exc)
+        return 0
+
+    written = 0
+    resized = {}
+    for size, fmt in wanted:
+        if size not in resized:
+            resized[size] = _resize(image, size)
+        name = derivative_name(field_file.name, size, fmt)
+        if storage.exists(name):
+            storage.delete(name)
+        storage.save(name, ContentFile(_encode(resized[size], fmt)))
+        cache.set(_flag_key(name), True, None)
+        written += 1
+    return written
+
+
+def delete_derivatives(field_file):
+    storage = field_file.storage
+    for size in SIZES:
+        for fmt in FORMATS:
+            name = derivative_name(field_file.name, size, fmt)
+            storage.delete(name)
+            cache.delete(_flag_key(name))
+
+
+def derivative_url(field_file, size, fmt='jpeg'):
+    """URL of a derivative, generating it if it doesn't exist yet
+
+    Falls back to the original's URL if the derivative can't be made.
+    """
+    name = derivative_name(field_file.name, size, fmt)
+    if not cache.get(_flag_key(name)):
+        if field_file.storage.exists(name):
+            cache.set(_flag_key(name), True, None)
+        elif not generate_derivatives(field_file, sizes=[size], formats=[fmt]):
+            return field_file.url
+    return field_file.storage.url(name)
+
+
+def derivative_urls(field_file, wanted):
+    """{(size, fmt): url} for several derivatives, checking the cache once"""
+    names = {pair: derivative_name(field_file.name, *pair) for pair in wanted}
+    known = cache.get_many([_flag_key(name) for name in names.values()])
+    return {
+        pair: field_file.storage.url(name) if _flag_key(name) in known else derivative_url(field_file, *pair)
+        for pair, name in names.items()
+    }
+
+
+def srcset(urls, sizes, fmt):
+    """srcset value listing derivatives (from derivative_urls) by their nominal width"""
+    return ', '.join(f'{urls[(size, fmt)]} {SIZES[size][0]}w' for size in sizes)
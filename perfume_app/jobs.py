@@ -0,0 +1,199 @@
+# jobs.py
+"""A background job queue stored in the database
+
+Work that doesn't have to finish before the response (sending mail,
+deleting an account and everything hanging off it) is enqueued as a Job
+row instead of being done in the request:
+
+    enqueue(tasks.send_email, subject=..., message=..., recipient_list=[...])
+
+A job is a dotted path to a function plus the keyword arguments, which
+must be JSON-serializable, to call it with. Being a row, it commits or
+rolls back with the transaction that enqueued it. The run_workers
+command runs a pool of worker processes that claim due jobs, highest
+priority first, and run them. A job that raises is retried after
+RETRY_DELAY, doubled on each attempt, until max_attempts, then kept as
+failed for the admin to look at and retry; one that succeeds is deleted.
+
+Claiming uses SELECT ... FOR UPDATE SKIP LOCKED where the database has
+it (PostgreSQL, MySQL 8), so workers never wait on each other. Elsewhere
+(SQLite) a claim is a conditional UPDATE that only one worker's can
+match. While a job runs, a heartbeat thread refreshes its lock every
+HEARTBEAT_INTERVAL, so however long it takes it stays its worker's; a
+job whose worker died mid-run stops being refreshed and is claimed again
+once its lock is older than LOCK_TIMEOUT.
+"""
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = timedelta(seconds=30)
+MAX_RETRY_DELAY = timedelta(hours=1)
+LOCK_TIMEOUT = timedelta(minutes=15)
+
+# How often a running job's lock is refreshed; well under LOCK_TIMEOUT so
+# a slow beat or two doesn't let another worker take the job
+HEARTBEAT_INTERVAL = timedelta(minutes=1)
+
+# Seconds an idle worker waits before looking for due jobs again
+POLL_INTERVAL = 1.0
+
+# Without SKIP LOCKED, how many due jobs a worker tries to claim before
+# concluding the others got them all
+CLAIM_CANDIDATES = 5
+
+
+def job_name(func):
+    return func if isinstance(func, str) else f'{func.__module__}.{func.__qualname__}'
+
+
+def enqueue(func, *, priority=0, delay=None, max_attempts=5, **kwargs):
+    """Queue a call of func (a module-level function or its dotted path) with kwargs; returns the Job"""
+    return Job.objects.create(
+        name=job_name(func),
+        kwargs=kwargs,
+        priority=priority,
+        run_at=timezone.now() + delay if delay else timezone.now(),
+        max_attempts=max_attempts,
+    )
+
+
+def retry_delay(attempts):
+    """How long to wait before the next attempt of a job that failed attempts times"""
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(worker):
+    """The next due job, marked as running for worker, or None"""
+    now = timezone.now()
+    due = Job.objects.filter(
+        Q(status=Job.QUEUED, run_at__lte=now) | Q(status=Job.RUNNING, locked_at__lt=now - LOCK_TIMEOUT)
+    ).order_by('-priority', 'run_at', 'pk')
+    locked = {'status': Job.RUNNING, 'locked_by': worker, 'locked_at': now, 'attempts': F('attempts') + 1}
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = due.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            Job.objects.filter(pk=job.pk).update(**locked)
+    else:
+        # Of the workers that read the same job, only the first update
+        # still finds it the way it was read
+        for job in due[:CLAIM_CANDIDATES]:
+            if Job.objects.filter(pk=job.pk, status=job.status, locked_at=job.locked_at).update(**locked):
+                break
+        else:
+            return None
+
+    job.status, job.locked_by, job.locked_at, job.attempts = Job.RUNNING, worker, now, job.attempts + 1
+    return job
+
+
+def heartbeat(job, done):
+    """Refresh a running job's lock every HEARTBEAT_INTERVAL until done (an Event) is set"""
+    try:
+        while not done.wait(HEARTBEAT_INTERVAL.total_seconds()):
+            try:
+                Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by).update(
+                    locked_at=timezone.now()
+                )
+            except DatabaseError:
+                logger.warning("Couldn't refresh the lock of job %s (%s)", job.pk, job.name, exc_info=True)
+    finally:
+        # The thread's own connection
+        connection.close()
+
+
+def run_job(job):
+    """Call a claimed job's function; returns whether it succeeded"""
+    try:
+        if job.attempts > job.max_attempts:
+            # Claimed again after its worker died on the last attempt
+            raise RuntimeError(f"Gave up after {job.max_attempts} attempts; the last one didn't finish.")
+        done = threading.Event()
+        beating = threading.Thread(target=heartbeat, args=(job, done), daemon=True)
+        beating.start()
+        try:
+            import_string(job.name)(**job.kwargs)
+        finally:
+            done.set()
+            beating.join()
+    except Exception:
+        failed = job.attempts >= job.max_attempts
+        logger.exception(
+            "Job %s (%s) failed on attempt %s of %s", job.pk, job.name, job.attempts, job.max_attempts
+        )
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.FAILED if failed else Job.QUEUED,
+            run_at=job.run_at if failed else timezone.now() + retry_delay(job.attempts),
+            locked_by='',
+            locked_at=None,
+            last_error=traceback.format_exc(),
+            updated_at=timezone.now(),
+        )
+        return False
+    Job.objects.filter(pk=job.pk).delete()
+    return True
+
+
+def work(worker=None, stop=None, burst=False):
+    """Claim and run jobs until stop (an Event) is set; returns how many ran
+
+    burst returns as soon as no job is due instead of waiting for more.
+    """
+    worker = worker or worker_id()
+    processed = 0
+    while not (stop and stop.is_set()):
+        # As between requests, drop a connection that broke or outlived
+        # CONN_MAX_AGE, unless it's in a caller's transaction
+        if not connection.in_atomic_block:
+            close_old_connections()
+        job = claim(worker)
+        if job is None:
+            if burst:
+                break
+            if stop:
+                stop.wait(POLL_INTERVAL)
+            else:
+                time.sleep(POLL_INTERVAL)
+            continue
+        run_job(job)
+        processed += 1
+    return processed
+
+
+def worker_process(stop, burst=False):
+    """Entry point of a run_workers pool process"""
+    import django
+    django.setup()
+    # Ctrl+C reaches the whole process group: let the parent decide, and
+    # finish the job at hand on either signal rather than dying mid-way
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    work(stop=stop, burst=burst)
+
+
+def retry(jobs):
+    """Queue failed jobs (a Job queryset) to run again now, with their attempts reset"""
+    return jobs.filter(status=Job.FAILED).update(
+        status=Job.QUEUED, run_at=timezone.now(), attempts=0, last_error='', updated_at=timezone.now()
+    )
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from perfume_app.page_cache import get_cache
+from perfume_app.singleflight import EVENTS, stats
+
+
+class Command(BaseCommand):
+    help = "Show hit / stale / wait / recompute counters for the catalog caches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', default=['pages', 'fragments'])
+
+    def handle(self, *args, **options):
+        cache = get_cache()
+        self.stdout.write(f"{'cache':<12}" + ''.join(f'{event:>12}' for event in EVENTS))
+        for name in options['names']:
+            counters = stats(cache, name)
+            self.stdout.write(f'{name:<12}' + ''.join(f'{counters[event]:>12}' for event in EVENTS))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from perfume_app.exports import EXPORTS, FORMATS, export_lines
+
+
+class Command(BaseCommand):
+    help = "Stream products, orders (with their items) or reviews as CSV or JSON Lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', choices=list(EXPORTS), help="What to export")
+        parser.add_argument(
+            '--format', choices=list(FORMATS), default='csv',
+            help="Output format (default: csv)",
+        )
+        parser.add_argument(
+            '--output', '-o',
+            help="File to write to (default: standard output)",
+        )
+
+    def handle(self, *args, **options):
+        lines = export_lines(options['export'], options['format'])
+        if not options['output']:
+            for block in lines:
+                self.stdout.write(block, ending='')
+            return
+
+        try:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                for block in lines:
+                    output.write(block)
+        except OSError as exc:
+            raise CommandError(str(exc))
+        self.stderr.write(self.style.SUCCESS(f"Exported {options['export']} to {options['output']}."))
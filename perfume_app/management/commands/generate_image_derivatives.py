@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from perfume_app.images import generate_derivatives
+from perfume_app.models import Category, ProductImage
+
+
+class Command(BaseCommand):
+    help = "Generate the resized WebP/JPEG derivatives of existing product and category images"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--overwrite', action='store_true',
+            help="Regenerate derivatives that already exist (e.g. after changing sizes or quality)",
+        )
+
+    def handle(self, *args, **options):
+        written = images = 0
+        for model in (ProductImage, Category):
+            for instance in model.objects.exclude(image='').exclude(image=None).only('pk', 'image').iterator():
+                written += generate_derivatives(instance.image, overwrite=options['overwrite'])
+                images += 1
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} derivative(s) for {images} image(s)."))
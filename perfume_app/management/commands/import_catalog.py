@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from perfume_app.catalog_import import CatalogImporter, chunked, read_rows
+
+
+class Command(BaseCommand):
+    help = "Create or update products from a CSV or JSON Lines file, matched on SKU"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The .csv or .jsonl file to import")
+        parser.add_argument(
+            '--format', choices=['csv', 'jsonl'],
+            help="File format, if the extension doesn't say",
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help="Rows written per upsert (default: 2000)",
+        )
+        parser.add_argument(
+            '--create-categories', action='store_true',
+            help="Create categories the file names that don't exist yet instead of rejecting their rows",
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Validate the file and report what would change without writing anything",
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+        importer = CatalogImporter(create_categories=options['create_categories'], dry_run=options['dry_run'])
+        started = time.monotonic()
+        rows = 0
+        try:
+            chunks = chunked(read_rows(options['path'], options['format']), options['chunk_size'])
+            for number, chunk in enumerate(chunks, 1):
+                created, updated, errors = importer.import_chunk(chunk)
+                rows += len(chunk)
+                self.stdout.write(
+                    f"Chunk {number}: {created} new, {updated} updated, {errors} rejected "
+                    f"({rows / max(time.monotonic() - started, 1e-6):,.0f} rows/s)"
+                )
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+
+        for line_number, message in importer.errors[:20]:
+            self.stderr.write(f"Line {line_number}: {message}")
+        if len(importer.errors) > 20:
+            self.stderr.write(f"... and {len(importer.errors) - 20} more rejected rows.")
+
+        importer.finish()
+        prefix = "Dry run: would have imported" if options['dry_run'] else "Imported"
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} {rows - len(importer.errors)} of {rows} rows "
+            f"({importer.created} new, {importer.updated} updated) in {time.monotonic() - started:.1f}s."
+        ))
+        if importer.product_ids:
+            self.stdout.write("Run rebuild_similar_products to bring similar products up to date.")
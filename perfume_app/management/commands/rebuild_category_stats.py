@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from perfume_app.category_stats import refresh_category_stats
+from perfume_app.models import Category
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored product count, price range and newest product date on Category"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--category', action='append', dest='slugs', default=[],
+            help="Only rebuild the category with this slug (may be repeated)",
+        )
+
+    def handle(self, *args, **options):
+        queryset = Category.objects.all()
+        if options['slugs']:
+            queryset = queryset.filter(slug__in=options['slugs'])
+
+        updated = refresh_category_stats(queryset)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt statistics for {updated} categor{'y' if updated == 1 else 'ies'}."))
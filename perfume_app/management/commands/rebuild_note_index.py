@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from perfume_app.models import Product
+from perfume_app.notes import index_product_notes
+
+
+class Command(BaseCommand):
+    help = "Parse Product.fragrance_notes into the Note / ProductNote index"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--product', action='append', dest='slugs', default=[],
+            help="Only re-index the product with this slug (may be repeated)",
+        )
+
+    def handle(self, *args, **options):
+        product_ids = None
+        if options['slugs']:
+            product_ids = list(Product.objects.filter(slug__in=options['slugs']).values_list('pk', flat=True))
+
+        indexed = index_product_notes(product_ids)
+        self.stdout.write(self.style.SUCCESS(f"Indexed the notes of {indexed} product{'' if indexed == 1 else 's'}."))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from perfume_app.models import Product
+from perfume_app.ratings import rebuild_product_ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored rating aggregates on Product from active reviews"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--product', action='append', dest='slugs', default=[],
+            help="Only rebuild the product with this slug (may be repeated)",
+        )
+
+    def handle(self, *args, **options):
+        queryset = Product.objects.all()
+        if options['slugs']:
+            queryset = queryset.filter(slug__in=options['slugs'])
+
+        updated = rebuild_product_ratings(queryset)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rating aggregates for {updated} product(s)."))
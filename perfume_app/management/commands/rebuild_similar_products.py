@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from perfume_app.models import Product
+from perfume_app.similarity import rebuild_similar_products
+
+
+class Command(BaseCommand):
+    help = "Recompute every product's list of scent-similar products"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--product', action='append', dest='slugs', default=[],
+            help="Only rebuild the list of the product with this slug (may be repeated)",
+        )
+
+    def handle(self, *args, **options):
+        product_ids = None
+        if options['slugs']:
+            product_ids = list(Product.objects.filter(slug__in=options['slugs']).values_list('pk', flat=True))
+
+        rebuilt = rebuild_similar_products(product_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt similar products for {rebuilt} product{'' if rebuilt == 1 else 's'}."))
@@ -0,0 +1,58 @@
+import multiprocessing
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from perfume_app.jobs import work, worker_process
+
+
+class Command(BaseCommand):
+    help = "Run background jobs in a pool of worker processes until stopped (Ctrl+C or SIGTERM)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=settings.JOB_WORKERS,
+            help="Worker processes to run (default: the JOB_WORKERS setting); 0 runs jobs in this process",
+        )
+        parser.add_argument(
+            '--burst', action='store_true',
+            help="Exit once no job is due instead of waiting for more",
+        )
+
+    def handle(self, *args, **options):
+        processes, burst = options['processes'], options['burst']
+        if processes < 0:
+            raise CommandError("--processes can't be negative.")
+        if processes == 0:
+            ran = work(burst=burst)
+            self.stdout.write(self.style.SUCCESS(f"Ran {ran} job(s)."))
+            return
+
+        stop = multiprocessing.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        # Children must open their own connections, not share this one
+        connections.close_all()
+
+        def start(number):
+            process = multiprocessing.Process(target=worker_process, args=(stop, burst), name=f'job-worker-{number}')
+            process.start()
+            return process
+
+        pool = [start(number) for number in range(processes)]
+        self.stdout.write(f"Started {processes} worker process(es).")
+        try:
+            while any(process.is_alive() for process in pool):
+                for number, process in enumerate(pool):
+                    process.join(timeout=1)
+                    if process.exitcode not in (None, 0) and not stop.is_set():
+                        # A worker that crashed is replaced; its job is claimed again after LOCK_TIMEOUT
+                        self.stderr.write(f"Worker {process.name} exited with {process.exitcode}; restarting it.")
+                        pool[number] = start(number)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping after the jobs in progress...")
+            stop.set()
+            for process in pool:
+                process.join()
+        self.stdout.write(self.style.SUCCESS("Workers stopped."))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from perfume_app.models import Campaign
+from perfume_app.newsletters import start_campaign
+
+
+class Command(BaseCommand):
+    help = "Queue a draft newsletter campaign for delivery by run_workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('campaign_id', type=int, help="Id of the campaign to send")
+
+    def handle(self, *args, **options):
+        try:
+            campaign = start_campaign(options['campaign_id'])
+        except Campaign.DoesNotExist:
+            raise CommandError(f"No campaign with id {options['campaign_id']}.")
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(
+            f"Queued \"{campaign}\" for {campaign.recipient_count} subscriber(s) "
+            f"in {campaign.batches.count()} batch(es)."
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from perfume_app.also_bought import update_also_bought
+
+
+class Command(BaseCommand):
+    help = "Fold orders placed since the last run into the \"customers also bought\" lists"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help="Start over from every order instead of the ones since the last run",
+        )
+
+    def handle(self, *args, **options):
+        orders, lists = update_also_bought(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {orders} order{'' if orders == 1 else 's'}, updated {lists} list{'' if lists == 1 else 's'}."
+        ))
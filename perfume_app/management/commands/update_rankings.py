@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from perfume_app.models import RankedProduct
+from perfume_app.rankings import update_rankings
+from perfume_app.sales_rollups import update_sales_rollups
+
+
+class Command(BaseCommand):
+    help = "Bring the sales rollups up to date, then recompute the best-seller and trending rankings and flags"
+
+    def handle(self, *args, **options):
+        update_sales_rollups()
+        ranked, changed = update_rankings()
+        self.stdout.write(self.style.SUCCESS(
+            f"Ranked {ranked[RankedProduct.BEST_SELLERS]} best sellers and "
+            f"{ranked[RankedProduct.TRENDING]} trending products, "
+            f"changed the flags of {changed} product{'' if changed == 1 else 's'}."
+        ))
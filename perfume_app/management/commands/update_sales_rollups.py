@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from perfume_app.sales_rollups import update_sales_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily sales rollups of the days whose orders changed since the last run"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help="Rebuild every day instead of the ones whose orders changed since the last run",
+        )
+
+    def handle(self, *args, **options):
+        orders, days = update_sales_rollups(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {orders} changed order{'' if orders == 1 else 's'}, "
+            f"recomputed {days} day{'' if days == 1 else 's'}."
+        ))
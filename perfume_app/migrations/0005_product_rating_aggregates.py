@@ -0,0 +1,51 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:05
+
+from django.db import migrations, models
+from django.db.models import Count, F, FloatField, OuterRef, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Product = apps.get_model('perfume_app', 'Product')
+    Review = apps.get_model('perfume_app', 'Review')
+
+    active_reviews = Review.objects.filter(
+        product=OuterRef('pk'), is_active=True
+    ).order_by().values('product')
+    Product.objects.update(
+        rating_sum=Coalesce(Subquery(active_reviews.annotate(total=Sum('rating')).values('total')), 0),
+        rating_count=Coalesce(Subquery(active_reviews.annotate(total=Count('id')).values('total')), 0),
+    )
+    Product.objects.filter(rating_count__gt=0).update(
+        avg_rating=Cast(F('rating_sum'), FloatField()) / Cast(NullIf(F('rating_count'), 0), FloatField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfume_app', '0004_remove_user_username_alter_user_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='avg_rating',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-avg_rating', '-id'], name='product_avg_rating_idx'),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
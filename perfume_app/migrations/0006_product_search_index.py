@@ -0,0 +1,60 @@
+# Generated by Django 5.2.5 on 2026-10-17 11:20
+
+from django.db import migrations
+from django.db.utils import OperationalError
+
+
+FTS_TABLE = 'perfume_app_product_fts'
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            try:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                    "name, category, description, tokenize = 'porter unicode61 remove_diacritics 2')"
+                )
+            except OperationalError:
+                # SQLite built without FTS5: searches use the icontains fallback
+                return
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, category, description) "
+                "SELECT p.id, p.name, c.name, p.description FROM perfume_app_product p "
+                "JOIN perfume_app_category c ON c.id = p.category_id"
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute("ALTER TABLE perfume_app_product ADD COLUMN IF NOT EXISTS search_vector tsvector")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS perfume_app_product_search_gin "
+                "ON perfume_app_product USING gin (search_vector)"
+            )
+            cursor.execute(
+                "UPDATE perfume_app_product p SET search_vector = "
+                "setweight(to_tsvector('english', coalesce(p.name, '')), 'A') || "
+                "setweight(to_tsvector('english', coalesce(c.name, '')), 'B') || "
+                "setweight(to_tsvector('english', coalesce(p.description, '')), 'C') "
+                "FROM perfume_app_category c WHERE c.id = p.category_id"
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        elif connection.vendor == 'postgresql':
+            cursor.execute("DROP INDEX IF EXISTS perfume_app_product_search_gin")
+            cursor.execute("ALTER TABLE perfume_app_product DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfume_app', '0005_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:10
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_category_stats(apps, schema_editor):
+    Category = apps.get_model('perfume_app', 'Category')
+    Product = apps.get_model('perfume_app', 'Product')
+
+    active_products = Product.objects.filter(
+        category=OuterRef('pk'), is_active=True
+    ).order_by().values('category')
+    Category.objects.update(
+        product_count=Coalesce(Subquery(active_products.annotate(total=Count('id')).values('total')), 0),
+        min_price=Subquery(active_products.annotate(value=Min('price')).values('value')),
+        max_price=Subquery(active_products.annotate(value=Max('price')).values('value')),
+        newest_product_at=Subquery(active_products.annotate(value=Max('created_at')).values('value')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfume_app', '0006_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='max_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='min_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='newest_product_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_category_stats, migrations.RunPython.noop),
+    ]
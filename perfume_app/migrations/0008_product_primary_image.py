@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_primary_images(apps, schema_editor):
+    Product = apps.get_model('perfume_app', 'Product')
+    ProductImage = apps.get_model('perfume_app', 'ProductImage')
+
+    first_image = ProductImage.objects.filter(product=OuterRef('pk')).order_by(
+        '-is_primary', 'order', '-created_at', 'id'
+    ).values('image')[:1]
+    Product.objects.update(primary_image=Coalesce(Subquery(first_image), Value('')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfume_app', '0007_category_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='primary_image',
+            field=models.ImageField(blank=True, editable=False, max_length=255, upload_to='products/'),
+        ),
+        migrations.RunPython(backfill_primary_images, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.5 on 2026-10-17 14:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfume_app', '0009_similar_products'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Note',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('slug', models.SlugField(max_length=100, unique=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductNote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tier', models.CharField(blank=True, choices=[('top', 'Top'), ('middle', 'Middle'), ('base', 'Base')], max_length=6)),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_notes', to='perfume_app.note')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_notes', to='perfume_app.product')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='notes',
+            field=models.ManyToManyField(blank=True, related_name='products', through='perfume_app.ProductNote', to='perfume_app.note'),
+        ),
+        migrations.AddIndex(
+            model_name='productnote',
+            index=models.Index(fields=['note', 'product'], name='product_note_posting_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='productnote',
+            constraint=models.UniqueConstraint(fields=('product', 'note'), name='product_note_unique'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-17 17:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfume_app', '0012_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Campaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('subject', models.CharField(max_length=200)),
+                ('body_text', models.TextField(help_text='Django template; {{ email }} and {{ unsubscribe_url }} are filled in for each recipient')),
+                ('body_html', models.TextField(blank=True, help_text='Optional HTML version, with the same variables')),
+                ('status', models.CharField(choices=[('draft', 'Draft'), ('sending', 'Sending'), ('sent', 'Sent')], default='draft', editable=False, max_length=10)),
+                ('recipient_count', models.PositiveIntegerField(default=0, editable=False)),
+                ('sent_count', models.PositiveIntegerField(default=0, editable=False)),
+                ('started_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, editable=False, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CampaignBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_subscriber_id', models.BigIntegerField()),
+                ('last_subscriber_id', models.BigIntegerField()),
+                ('position', models.BigIntegerField(default=0)),
+                ('sent_count', models.PositiveIntegerField(default=0)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='perfume_app.campaign')),
+            ],
+            options={
+                'ordering': ['campaign', 'first_subscriber_id'],
+                'constraints': [models.UniqueConstraint(fields=('campaign', 'first_subscriber_id'), name='campaign_batch_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.5 on 2026-10-17 19:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfume_app', '0014_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='is_trending',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='ProductActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('cart_adds', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='perfume_app.product')),
+            ],
+            options={
+                'verbose_name_plural': 'product activity',
+                'constraints': [models.UniqueConstraint(fields=('day', 'product'), name='product_activity_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RankedProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ranking', models.CharField(choices=[('best_sellers', 'Best sellers'), ('trending', 'Trending')], max_length=20)),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='perfume_app.product')),
+            ],
+            options={
+                'ordering': ['ranking', 'rank'],
+                'constraints': [models.UniqueConstraint(fields=('ranking', 'rank'), name='ranked_product_unique')],
+            },
+        ),
+    ]
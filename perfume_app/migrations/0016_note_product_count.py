@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-17 20:10
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_note_counts(apps, schema_editor):
+    Note = apps.get_model('perfume_app', 'Note')
+    ProductNote = apps.get_model('perfume_app', 'ProductNote')
+
+    postings = ProductNote.objects.filter(note=OuterRef('pk')).order_by().values('note')
+    Note.objects.update(product_count=Coalesce(Subquery(postings.annotate(total=Count('id')).values('total')), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfume_app', '0015_product_rankings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_note_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,104 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:40
+
+import re
+import unicodedata
+
+from django.db import migrations
+from django.utils.text import slugify
+
+# Copies of the parsing in perfume_app.notes as it stood when this
+# migration was written, so later changes there don't change it
+SECTION_RE = re.compile(r'[;\n]+')
+NOTE_SEPARATOR_RE = re.compile(r'[,/|]+|\band\b|&')
+PUNCTUATION_RE = re.compile(r'[^\w\s]|_')
+TIER_LABEL_RE = re.compile(r'^(top|head|heart|middle|base)(?:\s+notes?)?\s*[:\-]\s*')
+ANY_TIER_LABEL_RE = re.compile(r'(?:^|[,;\n])\s*(?:top|head|heart|middle|base)(?:\s+notes?)?\s*[:\-]')
+TIER_LABELS = {'top': 'top', 'head': 'top', 'heart': 'middle', 'middle': 'middle', 'base': 'base'}
+TIER_ORDER = ['top', 'middle', 'base', '']
+
+
+def normalize_note(text):
+    return ' '.join(PUNCTUATION_RE.sub(' ', text.lower()).split())[:100]
+
+
+def note_slug(name):
+    name = ''.join(char for char in unicodedata.normalize('NFKD', name) if not unicodedata.combining(char))
+    return slugify(name, allow_unicode=True)[:100]
+
+
+def parse_notes(fragrance_notes):
+    text = (fragrance_notes or '').lower()
+    sections = [section for section in SECTION_RE.split(text) if section.strip()]
+    positional = len(sections) == 3 and not ANY_TIER_LABEL_RE.search(text)
+
+    notes = {}
+    tier = ''
+    for position, section in enumerate(sections):
+        if positional:
+            tier = TIER_ORDER[position]
+        for piece in NOTE_SEPARATOR_RE.split(section):
+            piece = piece.strip()
+            label = TIER_LABEL_RE.match(piece)
+            if label:
+                tier = TIER_LABELS[label.group(1)]
+                piece = piece[label.end():]
+            name = normalize_note(piece)
+            if name and name not in ('note', 'notes'):
+                notes.setdefault(name, tier)
+    return list(notes.items())
+
+
+def index_product_notes(apps, schema_editor):
+    """Index every product's notes from scratch, with accent-free slugs
+
+    Products saved before 0010 had no ProductNote rows, and notes indexed
+    since were slugged with their accents ('café' and 'cafe' apart).
+    """
+    Note = apps.get_model('perfume_app', 'Note')
+    Product = apps.get_model('perfume_app', 'Product')
+    ProductNote = apps.get_model('perfume_app', 'ProductNote')
+
+    strings = dict(Product.objects.order_by().values_list('pk', 'fragrance_notes'))
+    parsed = {text: parse_notes(text) for text in set(strings.values())}
+    slugs = {name: note_slug(name) for notes in parsed.values() for name, _ in notes}
+    names = {}
+    for name, slug in slugs.items():
+        if slug:
+            names.setdefault(slug, name)
+
+    ProductNote.objects.all().delete()
+    Note.objects.all().delete()
+    note_ids = {
+        note.slug: note.pk
+        for note in Note.objects.bulk_create([Note(name=name, slug=slug) for slug, name in names.items()])
+    }
+    if len(note_ids) < len(names):
+        # Backends that don't return primary keys from bulk_create
+        note_ids = dict(Note.objects.values_list('slug', 'pk'))
+
+    rows = []
+    counts = {}
+    for product_id, text in strings.items():
+        tiers = {}
+        for name, tier in parsed[text]:
+            if slugs[name]:
+                tiers.setdefault(note_ids[slugs[name]], tier)
+        for note_id, tier in tiers.items():
+            rows.append(ProductNote(product_id=product_id, note_id=note_id, tier=tier))
+            counts[note_id] = counts.get(note_id, 0) + 1
+    ProductNote.objects.bulk_create(rows, batch_size=1000)
+    notes = list(Note.objects.all())
+    for note in notes:
+        note.product_count = counts.get(note.pk, 0)
+    Note.objects.bulk_update(notes, ['product_count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfume_app', '0016_note_product_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_product_notes, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,13 @@
 from django.db import models
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils.text import slugify
 from django.urls import reverse
 from django.utils import timezone
 import uuid
 from django.contrib.auth.models import AbstractUser
+from decimal import Decimal
 
 class TimeStampedModel(models.Model):
     """Abstract base model with created and updated timestamps"""
@@ -23,6 +25,12 @@ class Category(TimeStampedModel):
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
     is_active = models.BooleanField(default=True)
 
+    # Statistics over the category's active products, maintained by perfume_app.category_stats
+    product_count = models.PositiveIntegerField(default=0, editable=False)
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, editable=False)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, editable=False)
+    newest_product_at = models.DateTimeField(blank=True, null=True, editable=False)
+
     class Meta:
         verbose_name_plural = "Categories"
         ordering = ['name']
@@ -68,7 +76,9 @@ class Product(TimeStampedModel):
     # Flags (views.py expects these names!)
     is_active = models.BooleanField(default=True)
     is_featured = models.BooleanField(default=False)
+    # Set by the update_rankings command (see perfume_app.rankings)
     is_best_seller = models.BooleanField(default=False)
+    is_trending = models.BooleanField(default=False)
     is_new = models.BooleanField(default=True)
 
     # Fragrance details
@@ -103,20 +113,65 @@ class Product(TimeStampedModel):
     ]
     gender = models.CharField(max_length=1, choices=GENDER_CHOICES, default='U')
 
+    # fragrance_notes parsed into Notes, kept in sync by perfume_app.notes
+    notes = models.ManyToManyField('Note', through='ProductNote', related_name='products', blank=True)
+
+    # Path of the primary ProductImage, kept in sync by perfume_app.gallery
+    primary_image = models.ImageField(upload_to='products/', max_length=255, blank=True, editable=False)
+
+    # Rating aggregates, maintained from active reviews by perfume_app.ratings
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    avg_rating = models.FloatField(default=0, editable=False)
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-avg_rating', '-id'], name='product_avg_rating_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.get_size_display()})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what this product contributed to its category's statistics
+        if {'category_id', 'is_active', 'price', 'created_at'}.issubset(field_names):
+            instance._category_stats_state = instance.category_stats_contribution()
+        # ...and what its similar products are computed from
+        if {'is_active', 'fragrance_notes', 'intensity', 'longevity', 'gender'}.issubset(field_names):
+            instance._scent_state = instance.scent_profile()
+        # ...and what the catalog facet index holds
+        facet_fields = {
+            'is_active', 'category_id', 'price', 'gender', 'size', 'intensity', 'longevity', 'avg_rating', 'is_new',
+        }
+        if facet_fields.issubset(field_names):
+            instance._facet_state = instance.facet_state()
+        return instance
+
+    def category_stats_contribution(self):
+        """The fields Category statistics are computed from"""
+        return self.category_id, self.is_active, self.price, self.created_at
+
+    def scent_profile(self):
+        """The fields similar products are computed from"""
+        return self.is_active, self.fragrance_notes, self.intensity, self.longevity, self.gender
+
+    def facet_state(self):
+        """The fields the catalog facet index is built from"""
+        return (
+            self.is_active, self.category_id, self.price, self.gender, self.size,
+            self.intensity, self.longevity, self.avg_rating, self.is_new,
+        )
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
 
         # Generate SKU if not provided
         if not self.sku:
-            base_sku = f"{self.category.name[:3].upper()}-{self.name[:3].upper()}-{self.size}"
-            self.sku = slugify(base_sku).upper()
+            self.sku = self.build_sku(self.category.name, self.name, self.size)
 
         # Calculate cost per ml if price and size are available
         if self.price and self.size:
@@ -124,6 +179,11 @@ class Product(TimeStampedModel):
 
         super().save(*args, **kwargs)
 
+    @staticmethod
+    def build_sku(category_name, name, size):
+        base_sku = f"{category_name[:3].upper()}-{name[:3].upper()}-{size}"
+        return slugify(base_sku).upper()
+
     def get_absolute_url(self):
         return reverse('product_detail', kwargs={'slug': self.slug})
 
@@ -143,13 +203,50 @@ class Product(TimeStampedModel):
         return 0
 
     def average_rating(self):
-        reviews = self.reviews.filter(is_active=True)
-        if reviews.exists():
-            return round(reviews.aggregate(avg_rating=models.Avg('rating'))['avg_rating'], 1)
-        return 0
+        return round(self.avg_rating, 1) if self.rating_count else 0
 
     def review_count(self):
-        return self.reviews.filter(is_active=True).count()
+        return self.rating_count
+
+class Note(models.Model):
+    """A fragrance note, e.g. oud or pink pepper"""
+    name = models.CharField(max_length=100, unique=True)
+    slug = models.SlugField(max_length=100, unique=True)
+    # Products having the note (its document frequency), kept by perfume_app.notes
+    product_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+    def get_absolute_url(self):
+        return f"{reverse('product_list')}?note={self.slug}"
+
+class ProductNote(models.Model):
+    """A note of a product and the tier it sits in"""
+    TIER_CHOICES = [
+        ('top', 'Top'),
+        ('middle', 'Middle'),
+        ('base', 'Base'),
+    ]
+    product = models.ForeignKey(Product, related_name='product_notes', on_delete=models.CASCADE)
+    note = models.ForeignKey(Note, related_name='product_notes', on_delete=models.CASCADE)
+    # Blank when fragrance_notes doesn't say
+    tier = models.CharField(max_length=6, choices=TIER_CHOICES, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'note'], name='product_note_unique'),
+        ]
+        indexes = [
+            # A note's posting list: the products that have it
+            models.Index(fields=['note', 'product'], name='product_note_posting_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.note.name} ({self.get_tier_display() or 'unspecified'}) in {self.product.name}"
 
 class ProductImage(TimeStampedModel):
     """Product images model"""
@@ -165,12 +262,41 @@ class ProductImage(TimeStampedModel):
     def __str__(self):
         return f"Image for {self.product.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what decides whether this is the product's primary image
+        if {'product_id', 'image', 'is_primary', 'order'}.issubset(field_names):
+            instance._gallery_state = instance.gallery_state()
+        return instance
+
+    def gallery_state(self):
+        return self.product_id, self.image.name, self.is_primary, self.order
+
     def save(self, *args, **kwargs):
-        # If this is set as primary, ensure no other images are primary
-        if self.is_primary:
-            ProductImage.objects.filter(product=self.product).exclude(id=self.id).update(is_primary=False)
+        # If this just became primary, ensure no other images are primary
+        was_primary = getattr(self, '_gallery_state', (None, None, False, None))[2]
+        if self.is_primary and not was_primary:
+            ProductImage.objects.filter(product_id=self.product_id, is_primary=True).exclude(id=self.id).update(is_primary=False)
         super().save(*args, **kwargs)
 
+class SimilarProduct(models.Model):
+    """A product's rank-th most scent-similar product, maintained by perfume_app.similarity"""
+    product = models.ForeignKey(Product, related_name='similar_products', on_delete=models.CASCADE)
+    similar = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            # Also the index the detail page reads a product's list through
+            models.UniqueConstraint(fields=['product', 'rank'], name='similar_product_rank_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} -> {self.similar.name} (#{self.rank})"
+
 class Review(TimeStampedModel):
     """Product reviews model"""
     product = models.ForeignKey(Product, related_name='reviews', on_delete=models.CASCADE)
@@ -188,6 +314,20 @@ class Review(TimeStampedModel):
     def __str__(self):
         return f"Review by {self.user.username} for {self.product.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what this review contributed to its product's rating aggregates
+        if {'product_id', 'rating', 'is_active'}.issubset(field_names):
+            instance._rating_state = instance.rating_contribution()
+        return instance
+
+    def rating_contribution(self):
+        """(product_id, rating, count) this review adds to the product aggregates"""
+        if self.is_active:
+            return self.product_id, self.rating, 1
+        return self.product_id, 0, 0
+
 class Cart(TimeStampedModel):
     """Shopping cart model"""
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -195,13 +335,19 @@ class Cart(TimeStampedModel):
     def __str__(self):
         return f"Cart of {self.user.username}"
 
+    def get_summary(self):
+        """Item count and total price, computed once per instance in SQL"""
+        if not hasattr(self, '_summary'):
+            self._summary = self.items.totals()
+        return self._summary
+
     def get_items_count(self):
         """Total quantity of all items"""
-        return sum(item.quantity for item in self.items.all())
+        return self.get_summary()['count']
 
     def get_total(self):
         """Total price of all items in cart"""
-        return sum(item.total_price for item in self.items.all())
+        return self.get_summary()['total']
 
     # ✅ For Django Admin readability
     @property
@@ -218,7 +364,22 @@ class Cart(TimeStampedModel):
         return self.get_total()
 
     def get_total_price(self):
-        return sum(item.total_price for item in self.items.all())
+        return self.get_total()
+
+class CartItemQuerySet(models.QuerySet):
+    def totals(self):
+        """Summed quantity and price of these items in one aggregate query"""
+        totals = self.aggregate(
+            count=models.Sum('quantity'),
+            total=models.Sum(
+                models.F('quantity') * models.F('product__price'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+        return {
+            'count': totals['count'] or 0,
+            'total': (totals['total'] or Decimal('0')).quantize(Decimal('0.01')),
+        }
 
 class CartItem(TimeStampedModel):
     """Shopping cart item model"""
@@ -232,6 +393,8 @@ class CartItem(TimeStampedModel):
         default=1, validators=[MinValueValidator(1)]
     )
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -325,6 +488,11 @@ class Order(TimeStampedModel):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # What perfume_app.sales_rollups reads: changed orders, and a day's orders
+            models.Index(fields=['updated_at'], name='order_updated_at_idx'),
+            models.Index(fields=['created_at'], name='order_created_at_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.order_number} by {self.first_name} {self.last_name}"
@@ -366,6 +534,176 @@ class OrderItem(TimeStampedModel):
     def total_price(self):
         return self.price * self.quantity
 
+class CoPurchaseCount(models.Model):
+    """How many orders contained both products, maintained by perfume_app.also_bought
+
+    Rows come in both directions; the row of a product with itself counts
+    the orders that contained it.
+    """
+    product = models.ForeignKey(Product, related_name='co_purchase_counts', on_delete=models.CASCADE)
+    other = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='co_purchase_pair_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} & {self.other_id}: {self.orders} orders"
+
+class AlsoBoughtProduct(models.Model):
+    """A product's rank-th most often co-purchased product, maintained by perfume_app.also_bought"""
+    product = models.ForeignKey(Product, related_name='also_bought', on_delete=models.CASCADE)
+    recommended = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='also_bought_rank_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} -> {self.recommended.name} (#{self.rank})"
+
+class Checkpoint(TimeStampedModel):
+    """How far an incremental batch job has got, e.g. the last order it processed"""
+    name = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0)
+    # For jobs that follow a timestamp rather than an id
+    timestamp = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.position}"
+
+class SalesRollup(models.Model):
+    """A day's sales in one bucket, maintained by perfume_app.sales_rollups
+
+    Revenue is what the items sold for (quantity x price), before tax,
+    shipping and discounts. Cancelled and refunded orders don't count.
+    """
+    day = models.DateField()
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
+        ordering = ['day']
+
+class DailySales(SalesRollup):
+    """Sales per day and payment method; summed over methods, a day's totals"""
+    payment_method = models.CharField(max_length=20, choices=Order.PAYMENT_METHOD_CHOICES)
+
+    class Meta(SalesRollup.Meta):
+        verbose_name_plural = "daily sales"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'payment_method'], name='daily_sales_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.payment_method}: {self.revenue}"
+
+class DailyCategorySales(SalesRollup):
+    """Sales per day and category"""
+    category = models.ForeignKey(Category, related_name='+', on_delete=models.CASCADE)
+
+    class Meta(SalesRollup.Meta):
+        verbose_name_plural = "daily category sales"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category'], name='daily_category_sales_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.category}: {self.revenue}"
+
+class DailyProductSales(SalesRollup):
+    """Sales per day and product"""
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+
+    class Meta(SalesRollup.Meta):
+        verbose_name_plural = "daily product sales"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='daily_product_sales_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.product}: {self.revenue}"
+
+class ProductActivity(models.Model):
+    """A product's page views and add-to-cart clicks on a day, counted by perfume_app.activity"""
+    day = models.DateField()
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    views = models.PositiveIntegerField(default=0)
+    cart_adds = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "product activity"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='product_activity_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.product}: {self.views} views, {self.cart_adds} cart adds"
+
+class RankedProduct(models.Model):
+    """A place in a precomputed product ranking, maintained by perfume_app.rankings"""
+    BEST_SELLERS = 'best_sellers'
+    TRENDING = 'trending'
+    RANKING_CHOICES = [
+        (BEST_SELLERS, 'Best sellers'),
+        (TRENDING, 'Trending'),
+    ]
+
+    ranking = models.CharField(max_length=20, choices=RANKING_CHOICES)
+    rank = models.PositiveSmallIntegerField()
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['ranking', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['ranking', 'rank'], name='ranked_product_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_ranking_display()} #{self.rank}: {self.product}"
+
+class Job(TimeStampedModel):
+    """A unit of background work, run by the run_workers command (see perfume_app.jobs)"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    ]
+
+    # Dotted path of the function to call, and its keyword arguments
+    name = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    # Higher runs first
+    priority = models.SmallIntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-priority', 'run_at', 'id']
+        indexes = [
+            models.Index(fields=['status', '-priority', 'run_at', 'id'], name='job_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
 class NewsletterSubscriber(TimeStampedModel):
     """Newsletter subscription model"""
     email = models.EmailField(unique=True)
@@ -380,6 +718,63 @@ class NewsletterSubscriber(TimeStampedModel):
             self.token = str(uuid.uuid4())
         super().save(*args, **kwargs)
 
+class Campaign(TimeStampedModel):
+    """A newsletter mailed to every active subscriber (see perfume_app.newsletters)"""
+    DRAFT = 'draft'
+    SENDING = 'sending'
+    SENT = 'sent'
+    STATUS_CHOICES = [
+        (DRAFT, 'Draft'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+    ]
+
+    subject = models.CharField(max_length=200)
+    body_text = models.TextField(
+        help_text="Django template; {{ email }} and {{ unsubscribe_url }} are filled in for each recipient"
+    )
+    body_html = models.TextField(blank=True, help_text="Optional HTML version, with the same variables")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=DRAFT, editable=False)
+    recipient_count = models.PositiveIntegerField(default=0, editable=False)
+    sent_count = models.PositiveIntegerField(default=0, editable=False)
+    started_at = models.DateTimeField(blank=True, null=True, editable=False)
+    finished_at = models.DateTimeField(blank=True, null=True, editable=False)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return self.subject
+
+    def clean(self):
+        from .newsletters import recipient_variable_errors
+
+        errors = {
+            field: recipient_variable_errors(getattr(self, field)) for field in ('body_text', 'body_html')
+        }
+        errors = {field: messages for field, messages in errors.items() if messages}
+        if errors:
+            raise ValidationError(errors)
+
+class CampaignBatch(models.Model):
+    """A range of subscribers one job mails a campaign to, and how far it has got"""
+    campaign = models.ForeignKey(Campaign, related_name='batches', on_delete=models.CASCADE)
+    first_subscriber_id = models.BigIntegerField()
+    last_subscriber_id = models.BigIntegerField()
+    # The last subscriber mailed; a retried job carries on after it
+    position = models.BigIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['campaign', 'first_subscriber_id']
+        constraints = [
+            models.UniqueConstraint(fields=['campaign', 'first_subscriber_id'], name='campaign_batch_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.campaign}: subscribers {self.first_subscriber_id}-{self.last_subscriber_id}"
+
 class SiteSettings(TimeStampedModel):
     """Site settings model"""
     site_name = models.CharField(max_length=100, default="PerfumeLux")
@@ -0,0 +1,208 @@
+# newsletters.py
+"""Newsletter subscriptions and campaign delivery
+
+start_campaign() splits the active subscribers, read in id order a
+chunk at a time, into CampaignBatch ranges of BATCH_SIZE and queues a
+send_batch job for each (see jobs.py), so the run_workers pool mails
+them in parallel. A batch sends through one SMTP connection, reused for
+all its messages, SEND_CHUNK messages per send_messages() call, and
+records how far it got after each chunk: a job retried after a crash
+carries on from there instead of mailing the batch again.
+
+The campaign's templates are rendered once per worker process, with
+markers standing in for the per-recipient values (email, unsubscribe
+link) that are then substituted into each message with a string join.
+A filter or lookup on those variables would act on the marker rather
+than the value, so campaigns using one don't validate (Campaign.clean)
+or start. A worker keeps the last MESSAGE_CACHE_SIZE rendered campaigns.
+"""
+import re
+from itertools import islice
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.template import Context, Template, TemplateSyntaxError
+from django.template.base import VariableNode
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import escape
+
+from .jobs import enqueue
+from .models import Campaign, CampaignBatch, NewsletterSubscriber
+
+# Subscribers per job
+BATCH_SIZE = 1000
+
+# Messages per send_messages() call, and between progress updates
+SEND_CHUNK = 100
+
+# Values that differ per recipient; everything else is rendered once
+RECIPIENT_VARIABLES = ('email', 'unsubscribe_url')
+MARKER_RE = re.compile('\x00(\\w+)\x00')
+
+# Rendered campaigns kept per process, least recently used dropped first
+MESSAGE_CACHE_SIZE = 4
+
+_messages = {}
+
+
+def subscribe(email):
+    """Subscribe an address, or re-activate it if it unsubscribed; returns the NewsletterSubscriber"""
+    subscriber, created = NewsletterSubscriber.objects.get_or_create(email=email.strip().lower())
+    if not created and not subscriber.is_active:
+        subscriber.is_active = True
+        subscriber.save(update_fields=['is_active', 'updated_at'])
+    return subscriber
+
+
+def unsubscribe_url(token):
+    return settings.SITE_URL.rstrip('/') + reverse('newsletter_unsubscribe', args=[token])
+
+
+def recipient_variable_errors(source):
+    """Why a campaign template can't be filled in per recipient, as a list of messages
+
+    {{ email }} and {{ unsubscribe_url }} must be used as they are: no
+    filters ({{ email|upper }}) or lookups ({{ email.domain }}).
+    """
+    try:
+        nodes = Template(source).nodelist.get_nodes_by_type(VariableNode)
+    except TemplateSyntaxError as exc:
+        return [str(exc)]
+    errors = []
+    for node in nodes:
+        expression = node.filter_expression
+        lookups = getattr(expression.var, 'lookups', None) or ()
+        if lookups and lookups[0] in RECIPIENT_VARIABLES and (expression.filters or len(lookups) > 1):
+            errors.append(
+                f"{{{{ {expression.token} }}}}: {lookups[0]} is filled in per recipient and takes no filters."
+            )
+    return errors
+
+
+class CampaignMessage:
+    """A campaign's subject and bodies, rendered once, ready for per-recipient values"""
+
+    def __init__(self, campaign):
+        context = {'site_url': settings.SITE_URL, **{name: f'\x00{name}\x00' for name in RECIPIENT_VARIABLES}}
+        self.subject = campaign.subject
+        # Split at the markers: literal text at even indexes, variable names at odd ones
+        self.text = MARKER_RE.split(Template(campaign.body_text).render(Context(context, autoescape=False)))
+        self.html = None
+        if campaign.body_html:
+            self.html = MARKER_RE.split(Template(campaign.body_html).render(Context(context)))
+
+    @staticmethod
+    def _fill(parts, values):
+        return ''.join(values[part] if index % 2 else part for index, part in enumerate(parts))
+
+    def for_recipient(self, email, token):
+        values = {'email': email, 'unsubscribe_url': unsubscribe_url(token)}
+        message = EmailMultiAlternatives(
+            self.subject,
+            self._fill(self.text, values),
+            settings.DEFAULT_FROM_EMAIL,
+            [email],
+            headers={
+                'List-Unsubscribe': f"<{values['unsubscribe_url']}>",
+                # RFC 8058: clients may POST to the link without opening it
+                'List-Unsubscribe-Post': 'List-Unsubscribe=One-Click',
+            },
+        )
+        if self.html:
+            message.attach_alternative(
+                self._fill(self.html, {name: escape(value) for name, value in values.items()}), 'text/html'
+            )
+        return message
+
+
+def campaign_message(campaign):
+    """The CampaignMessage of a campaign, rendered once per process (and again if it's edited)"""
+    key = (campaign.pk, campaign.updated_at)
+    message = _messages.pop(key, None) or CampaignMessage(campaign)
+    _messages[key] = message
+    while len(_messages) > MESSAGE_CACHE_SIZE:
+        del _messages[next(iter(_messages))]
+    return message
+
+
+@transaction.atomic
+def start_campaign(campaign_id):
+    """Split a draft campaign's audience into batches and queue them; returns the Campaign
+
+    The audience is the subscribers active now; any who unsubscribe
+    before their batch is sent are skipped.
+    """
+    campaign = Campaign.objects.select_for_update().get(pk=campaign_id)
+    if campaign.status != Campaign.DRAFT:
+        raise ValueError(f"Campaign {campaign_id} has already been started.")
+    errors = recipient_variable_errors(campaign.body_text) + recipient_variable_errors(campaign.body_html)
+    if errors:
+        raise ValueError(' '.join(errors))
+
+    subscriber_ids = (
+        NewsletterSubscriber.objects.filter(is_active=True)
+        .order_by('pk')
+        .values_list('pk', flat=True)
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+    batches = []
+    recipients = 0
+    while chunk := list(islice(subscriber_ids, BATCH_SIZE)):
+        batches.append(CampaignBatch(campaign=campaign, first_subscriber_id=chunk[0], last_subscriber_id=chunk[-1]))
+        recipients += len(chunk)
+    batches = CampaignBatch.objects.bulk_create(batches, batch_size=1000)
+
+    now = timezone.now()
+    campaign.status = Campaign.SENDING if batches else Campaign.SENT
+    campaign.recipient_count = recipients
+    campaign.started_at = now
+    campaign.finished_at = None if batches else now
+    campaign.save(update_fields=['status', 'recipient_count', 'started_at', 'finished_at', 'updated_at'])
+    for batch in batches:
+        enqueue(send_batch, batch_id=batch.pk)
+    return campaign
+
+
+def send_batch(batch_id):
+    """Mail a batch's remaining subscribers (a job); returns how many messages were sent"""
+    batch = CampaignBatch.objects.select_related('campaign').get(pk=batch_id)
+    if batch.finished_at:
+        return 0
+    message = campaign_message(batch.campaign)
+    recipients = list(
+        NewsletterSubscriber.objects.filter(
+            is_active=True,
+            pk__gte=batch.first_subscriber_id,
+            pk__lte=batch.last_subscriber_id,
+            pk__gt=batch.position,
+        )
+        .order_by('pk')
+        .values_list('pk', 'email', 'token')
+    )
+
+    sent = 0
+    with get_connection(fail_silently=False) as connection:
+        for start in range(0, len(recipients), SEND_CHUNK):
+            chunk = recipients[start:start + SEND_CHUNK]
+            count = connection.send_messages([message.for_recipient(email, token) for _, email, token in chunk]) or 0
+            with transaction.atomic():
+                CampaignBatch.objects.filter(pk=batch.pk).update(
+                    position=chunk[-1][0], sent_count=F('sent_count') + count
+                )
+                Campaign.objects.filter(pk=batch.campaign_id).update(sent_count=F('sent_count') + count)
+            sent += count
+
+    with transaction.atomic():
+        # Locking the campaign makes the batches finish one at a time, so
+        # exactly one sees that it was the last
+        Campaign.objects.select_for_update().get(pk=batch.campaign_id)
+        now = timezone.now()
+        CampaignBatch.objects.filter(pk=batch.pk).update(finished_at=now)
+        if not CampaignBatch.objects.filter(campaign_id=batch.campaign_id, finished_at__isnull=True).exists():
+            Campaign.objects.filter(pk=batch.campaign_id, status=Campaign.SENDING).update(
+                status=Campaign.SENT, finished_at=now, updated_at=now
+            )
+    return sent
@@ -0,0 +1,184 @@
+# notes.py
+"""Fragrance notes parsed out of Product.fragrance_notes
+
+fragrance_notes stays the free text the admin edits. Its notes are
+parsed into Note rows, linked to the product through ProductNote with
+the tier (top / middle / base) they sit in, whenever it changes (see
+signals.py). ProductNote, indexed on (note, product), is an inverted
+index: "everything with oud" is one indexed lookup instead of an
+icontains over every description. Note.product_count, the length of a
+note's posting list, is kept alongside for the similarity weights.
+Migration 0017 indexed the products that existed before; the
+rebuild_note_index command (re)builds it all.
+"""
+import re
+import unicodedata
+
+from django.db import connection, transaction
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.text import slugify
+
+from .models import Note, Product, ProductNote
+
+# Sections are separated by semicolons or lines, notes within them by commas & co.
+SECTION_RE = re.compile(r'[;\n]+')
+NOTE_SEPARATOR_RE = re.compile(r'[,/|]+|\band\b|&')
+PUNCTUATION_RE = re.compile(r'[^\w\s]|_')
+TIER_LABEL_RE = re.compile(r'^(top|head|heart|middle|base)(?:\s+notes?)?\s*[:\-]\s*')
+ANY_TIER_LABEL_RE = re.compile(r'(?:^|[,;\n])\s*(?:top|head|heart|middle|base)(?:\s+notes?)?\s*[:\-]')
+TIER_LABELS = {'top': 'top', 'head': 'top', 'heart': 'middle', 'middle': 'middle', 'base': 'base'}
+TIER_ORDER = [tier for tier, _ in ProductNote.TIER_CHOICES] + ['']
+
+
+def normalize_note(text):
+    """'  Pink-Pepper.' -> 'pink pepper'"""
+    return ' '.join(PUNCTUATION_RE.sub(' ', text.lower()).split())[:100]
+
+
+def note_slug(name):
+    """'Café' -> 'cafe': accents are dropped, letters of other scripts kept"""
+    name = ''.join(char for char in unicodedata.normalize('NFKD', name) if not unicodedata.combining(char))
+    return slugify(name, allow_unicode=True)[:100]
+
+
+def parse_notes(fragrance_notes):
+    """[(note name, tier)] in a fragrance_notes string, each note once
+
+    Tiers come from labels ('Top: bergamot, lemon; Base notes - musk') and
+    carry on until the next label. Without labels, exactly three sections
+    are read as top, middle and base; anything else has no tier ('').
+    """
+    text = (fragrance_notes or '').lower()
+    sections = [section for section in SECTION_RE.split(text) if section.strip()]
+    positional = len(sections) == 3 and not ANY_TIER_LABEL_RE.search(text)
+
+    notes = {}
+    tier = ''
+    for position, section in enumerate(sections):
+        if positional:
+            tier = TIER_ORDER[position]
+        for piece in NOTE_SEPARATOR_RE.split(section):
+            piece = piece.strip()
+            label = TIER_LABEL_RE.match(piece)
+            if label:
+                tier = TIER_LABELS[label.group(1)]
+                piece = piece[label.end():]
+            name = normalize_note(piece)
+            if name and name not in ('note', 'notes'):
+                notes.setdefault(name, tier)
+    return list(notes.items())
+
+
+def refresh_note_counts(note_ids=None):
+    """Recount the products of the given notes (default: all)"""
+    notes = Note.objects.all()
+    if note_ids is not None:
+        notes = notes.filter(pk__in=note_ids)
+    postings = ProductNote.objects.filter(note_id=OuterRef('pk')).order_by().values('note_id')
+    notes.update(product_count=Coalesce(Subquery(postings.annotate(total=Count('id')).values('total')), 0))
+
+
+def index_product_notes(product_ids=None):
+    """Rebuild the ProductNote rows of the given products (default: all); returns how many products"""
+    products = Product.objects.order_by()
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+    # The sizes of one scent share their notes, so each distinct string is parsed once
+    strings = dict(products.values_list('pk', 'fragrance_notes'))
+    parsed_strings = {text: parse_notes(text) for text in set(strings.values())}
+    parsed = {pk: parsed_strings[text] for pk, text in strings.items()}
+
+    # Names that differ only in what note_slug drops ('café', 'cafe') share a Note
+    slugs = {name: note_slug(name) for name in {name for notes in parsed_strings.values() for name, _ in notes}}
+    slugs = {name: slug for name, slug in slugs.items() if slug}
+    names = {}
+    for name, slug in slugs.items():
+        names.setdefault(slug, name)
+    with transaction.atomic():
+        Note.objects.bulk_create([Note(name=name, slug=slug) for slug, name in names.items()], ignore_conflicts=True)
+        note_ids = dict(Note.objects.filter(slug__in=set(slugs.values())).values_list('slug', 'pk'))
+
+        rows = set()
+        for product_id, notes in parsed.items():
+            tiers = {}
+            for name, tier in notes:
+                if name in slugs:
+                    tiers.setdefault(note_ids[slugs[name]], tier)
+            rows.update((product_id, note_id, tier) for note_id, tier in tiers.items())
+
+        # Only the rows that differ are written: re-indexing an unchanged
+        # product (a re-import, a rebuild_note_index run) costs only a read
+        stored = ProductNote.objects.all()
+        if product_ids is not None:
+            stored = stored.filter(product_id__in=product_ids)
+        stored = set(stored.values_list('product_id', 'note_id', 'tier'))
+        table = ProductNote._meta.db_table
+        # Plain executemany: a product has several notes, and building a
+        # model instance for each row costs more than the statement itself
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {table} WHERE product_id = %s AND note_id = %s",
+                [(product_id, note_id) for product_id, note_id, _ in stored - rows],
+            )
+            cursor.executemany(
+                f"INSERT INTO {table} (product_id, note_id, tier) VALUES (%s, %s, %s)", sorted(rows - stored)
+            )
+        if product_ids is None:
+            Note.objects.filter(product_notes__isnull=True).delete()
+            refresh_note_counts()
+        else:
+            refresh_note_counts({note_id for _, note_id, _ in stored ^ rows})
+    return len(parsed)
+
+
+def product_changed(product_id, old_notes, new_notes):
+    """Re-index a product's notes if a save changed fragrance_notes (old_notes is None for a new product)"""
+    if old_notes != new_notes:
+        index_product_notes([product_id])
+
+
+def filter_by_notes(queryset, slugs):
+    """Narrow a Product queryset to the products having every note in slugs
+
+    Posting lists are intersected shortest first (by Note.product_count):
+    the products of the rarest note are each probed, through the (product, note) unique
+    index, for the other notes. An unknown slug matches nothing.
+    """
+    slugs = set(slugs)
+    if not slugs:
+        return queryset
+    note_ids = list(Note.objects.filter(slug__in=slugs).order_by('product_count').values_list('pk', flat=True))
+    if len(note_ids) < len(slugs):
+        return queryset.none()
+
+    rarest, *others = note_ids
+    postings = ProductNote.objects.filter(note_id=rarest)
+    for note_id in others:
+        postings = postings.filter(Exists(ProductNote.objects.filter(product_id=OuterRef('product_id'), note_id=note_id)))
+    return queryset.filter(pk__in=postings.values('product_id'))
+
+
+def notes_by_tier(product):
+    """[(tier label, [Note])] for a product, top notes first and untiered ones last"""
+    labels = {tier: f'{label} Notes' for tier, label in ProductNote.TIER_CHOICES}
+    labels[''] = 'Notes'
+    tiers = {}
+    for product_note in ProductNote.objects.filter(product=product).select_related('note').order_by('note__name'):
+        tiers.setdefault(product_note.tier, []).append(product_note.note)
+    return [(labels[tier], tiers[tier]) for tier in TIER_ORDER if tier in tiers]
+
+
+def selected_notes(request):
+    """The Notes picked with ?note=, each with the URL that drops it, for templates"""
+    slugs = request.GET.getlist('note')
+    if not slugs:
+        return []
+    selected = []
+    for note in Note.objects.filter(slug__in=slugs):
+        params = request.GET.copy()
+        for param in ('page', 'cursor'):
+            params.pop(param, None)
+        params.setlist('note', [slug for slug in slugs if slug != note.slug])
+        selected.append({'note': note, 'remove_url': '?' + params.urlencode()})
+    return selected
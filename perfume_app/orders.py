@@ -0,0 +1,125 @@
+# orders.py
+"""Order placement
+
+place_order() turns a user's cart into an order in a single transaction:
+the cart and product rows are locked, stock is decremented with one
+conditional UPDATE, order items are bulk-inserted and the cart is
+emptied with one DELETE. The number of queries doesn't depend on how
+many lines the cart has.
+
+reorder() goes the other way, putting a past order's products back in
+the cart with one upsert.
+"""
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, When
+
+from .carts import apply_cart_operations
+from .models import Cart, CartItem, Order, OrderItem, Product
+from .page_cache import invalidate
+
+
+class CheckoutError(Exception):
+    """The cart can't be turned into an order"""
+
+
+class EmptyCartError(CheckoutError):
+    pass
+
+
+class OutOfStockError(CheckoutError):
+    def __init__(self, products=()):
+        self.products = list(products)
+        message = "Some items in your cart are no longer available in the requested quantity"
+        if self.products:
+            message += ": " + ", ".join(product.name for product in self.products)
+        super().__init__(message + ".")
+
+
+def _decrement_stock(quantities):
+    """Take quantities ({product_id: qty}) off stock in one UPDATE
+
+    The WHERE clause only matches rows that still have enough stock, so
+    the update can never drive stock negative; fewer rows updated than
+    requested means someone else got there first.
+    """
+    enough_stock = Q()
+    for product_id, quantity in quantities.items():
+        enough_stock |= Q(pk=product_id, stock__gte=quantity)
+    return Product.objects.filter(enough_stock).update(
+        stock=Case(
+            *[When(pk=product_id, then=F('stock') - quantity) for product_id, quantity in quantities.items()],
+            default=F('stock'),
+            output_field=PositiveIntegerField(),
+        )
+    )
+
+
+@transaction.atomic
+def place_order(user, **order_fields):
+    """Create an Order from the user's cart, or raise a CheckoutError
+
+    order_fields are the customer, address and payment fields of Order.
+    """
+    # Locking the cart serialises double-submits of the same checkout
+    cart = Cart.objects.select_for_update().filter(user=user).first()
+    lines = dict(CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity')) if cart else {}
+    if not lines:
+        raise EmptyCartError("Your cart is empty.")
+
+    # Lock in primary key order so concurrent checkouts can't deadlock
+    products = list(
+        Product.objects.select_for_update()
+        .filter(pk__in=lines.keys(), is_active=True)
+        .order_by('pk')
+    )
+    unavailable = [product for product in products if product.stock < lines[product.pk]]
+    if unavailable or len(products) != len(lines):
+        raise OutOfStockError(unavailable)
+
+    if _decrement_stock(lines) != len(lines):
+        raise OutOfStockError(products)
+
+    subtotal = sum(product.price * lines[product.pk] for product in products)
+    tax_amount = order_fields.pop('tax_amount', 0)
+    shipping_cost = order_fields.pop('shipping_cost', 0)
+    discount_amount = order_fields.pop('discount_amount', 0)
+    order = Order.objects.create(
+        user=user,
+        subtotal=subtotal,
+        tax_amount=tax_amount,
+        shipping_cost=shipping_cost,
+        discount_amount=discount_amount,
+        total=subtotal + tax_amount + shipping_cost - discount_amount,
+        **order_fields,
+    )
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, quantity=lines[product.pk], price=product.price)
+        for product in products
+    ])
+    CartItem.objects.filter(cart=cart).delete()
+
+    # Product pages show the stock level
+    product_tags = [f'product:{product_id}' for product_id in lines]
+    transaction.on_commit(lambda: invalidate(*product_tags))
+    return order
+
+
+def reorder(user, order):
+    """Add the products of a past order to the user's cart
+
+    Lines whose product is inactive or out of stock are left out. Returns
+    the products that were skipped, as (id, name) pairs.
+    """
+    lines = OrderItem.objects.filter(order=order).values_list(
+        'product_id', 'product__name', 'product__is_active', 'product__stock', 'quantity'
+    )
+    changes, skipped = {}, {}
+    for product_id, name, is_active, stock, quantity in lines:
+        if is_active and stock > 0:
+            _, current = changes.get(product_id, (False, 0))
+            changes[product_id] = (False, current + quantity)
+        else:
+            skipped[product_id] = name
+    if changes:
+        apply_cart_operations(user, changes)
+    return list(skipped.items())
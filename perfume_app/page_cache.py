@@ -0,0 +1,230 @@
+# page_cache.py
+"""Full-page cache for anonymous catalog pages
+
+Pages are keyed by URL name, URL kwargs and the normalized query string.
+While a page renders, the views and templates record the objects it
+depends on as tags ("product:12", "category:3") plus collection tags
+("products", "categories"). Every tag maps to a random token in the
+cache; a cached page stores the tokens it was rendered against and is
+only served while they all still match. Invalidating a tag just deletes
+its token, so a purge is O(1) no matter how many pages carry the tag,
+and it works across processes with any shared cache backend.
+
+Rebuilds are single-flight (see perfume_app.singleflight): when a hot
+page expires or is purged, one worker re-renders it while the others
+keep serving the previous copy.
+"""
+import hashlib
+import re
+import time
+import uuid
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+from . import singleflight
+
+KEY_PREFIX = 'pagecache'
+CSRF_PLACEHOLDER = '__PAGE_CACHE_CSRF_TOKEN__'
+CSRF_INPUT_RE = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+# Campaign tracking parameters don't change the page
+IGNORED_PARAMS = {'fbclid', 'gclid', 'msclkid', 'mc_cid', 'mc_eid'}
+
+
+def get_cache():
+    return caches[getattr(settings, 'PAGE_CACHE_ALIAS', 'default')]
+
+
+def _tag_key(tag):
+    return f'{KEY_PREFIX}:tag:{tag}'
+
+
+def normalize_query(query_dict):
+    """Sorted, de-duplicated query string without empty or tracking params"""
+    items = sorted(
+        (key, value)
+        for key, values in query_dict.lists()
+        if key not in IGNORED_PARAMS and not key.startswith('utm_')
+        for value in set(values)
+        if value != ''
+    )
+    return urlencode(items)
+
+
+def page_key(request, view_kwargs):
+    match = request.resolver_match
+    url_name = match.url_name if match else request.path
+    args = urlencode(sorted(view_kwargs.items()))
+    digest = hashlib.md5(f'{args}?{normalize_query(request.GET)}'.encode()).hexdigest()
+    return f'{KEY_PREFIX}:page:{url_name}:{digest}'
+
+
+def tag_for(obj):
+    """Dependency tag for a model instance, or the tag itself for strings"""
+    if isinstance(obj, str):
+        return obj
+    return f'{obj._meta.model_name}:{obj.pk}'
+
+
+def cache_depends(request, *objects):
+    """Record that the page being rendered for request depends on objects"""
+    tags = getattr(request, '_page_cache_tags', None)
+    if tags is not None:
+        tags.update(tag_for(obj) for obj in objects if obj is not None)
+
+
+def set_page_meta(request, **meta):
+    """Store extra values with the cached page, handed to on_hit on later hits"""
+    page_meta = getattr(request, '_page_cache_meta', None)
+    if page_meta is not None:
+        page_meta.update(meta)
+
+
+def invalidate(*tags):
+    """Purge every cached page that recorded any of the given tags"""
+    if tags:
+        get_cache().delete_many([_tag_key(tag) for tag in tags])
+
+
+def _tag_tokens(cache, tags, create=False):
+    keys = {tag: _tag_key(tag) for tag in tags}
+    found = cache.get_many(keys.values())
+    tokens = {tag: found.get(key) for tag, key in keys.items()}
+    if create:
+        missing = {keys[tag]: uuid.uuid4().hex for tag, token in tokens.items() if token is None}
+        if missing:
+            cache.set_many(missing, None)
+            tokens.update({tag: missing[keys[tag]] for tag in tags if keys[tag] in missing})
+    return tokens
+
+
+def _tags_current(cache, tags):
+    return _tag_tokens(cache, tags) == tags
+
+
+def cached_value(key, compute, tags=(), timeout=None):
+    """Cache compute() under key until it expires or any of tags is invalidated
+
+    Used for expensive fragments (e.g. the home page product rows) that
+    logged-in visitors, who bypass the page cache, would otherwise
+    rebuild on every request.
+    """
+    cache = get_cache()
+
+    def compute_with_tags():
+        # Read tokens first so an invalidation during compute() isn't lost
+        tokens = _tag_tokens(cache, tags, create=True)
+        return {'tags': tokens, 'value': compute()}
+
+    entry = singleflight.remember(
+        cache, f'{KEY_PREFIX}:value:{key}', compute_with_tags,
+        timeout if timeout is not None else settings.PAGE_CACHE_TIMEOUT,
+        name='fragments',
+        is_current=lambda entry: _tags_current(cache, entry['tags']),
+        stale_ttl=settings.PAGE_CACHE_STALE_TTL,
+    )
+    return entry['value']
+
+
+def is_cacheable_request(request, skip_session_keys=()):
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    # Pending flash messages are rendered into the page for this visitor only
+    if request.COOKIES.get('messages') or request.session.get('_messages'):
+        return False
+    skip_session_keys = (*getattr(settings, 'PAGE_CACHE_SKIP_SESSION_KEYS', ()), *skip_session_keys)
+    return not any(request.session.get(key) for key in skip_session_keys)
+
+
+def _from_entry(request, entry, status='HIT'):
+    content = entry['content'].replace(CSRF_PLACEHOLDER, get_token(request))
+    response = HttpResponse(content, content_type=entry['content_type'])
+    response['X-Page-Cache'] = status
+    return response
+
+
+def _to_entry(response, tags, meta):
+    content = CSRF_INPUT_RE.sub(rf'\g<1>{CSRF_PLACEHOLDER}\g<2>', response.content.decode(response.charset))
+    return {
+        'content': content,
+        'content_type': response['Content-Type'],
+        'tags': tags,
+        'meta': meta,
+    }
+
+
+def cache_anonymous_page(tags=(), timeout=None, skip_session_keys=(), on_hit=None):
+    """Serve a view from the page cache for anonymous visitors
+
+    tags are collection tags the page always depends on; object tags are
+    added while rendering through cache_depends() or {% cache_depends %}.
+    Visitors with any of skip_session_keys set in their session get a
+    fresh render. on_hit(request, meta) runs whenever a cached copy is
+    served so views can replay side effects (e.g. session bookkeeping)
+    they would otherwise skip.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not is_cacheable_request(request, skip_session_keys):
+                return view_func(request, *args, **kwargs)
+
+            cache = get_cache()
+            key = page_key(request, kwargs)
+            record = cache.get(key)
+            if record is not None:
+                entry = record['value']
+                status = None
+                if _tags_current(cache, entry['tags']) and not singleflight.should_refresh(record):
+                    status = 'HIT'
+                elif not singleflight.acquire(cache, key):
+                    # Someone else is already rebuilding this page
+                    status = 'STALE'
+                if status:
+                    singleflight.count(cache, 'pages', status.lower())
+                    if on_hit is not None:
+                        on_hit(request, entry['meta'])
+                    return _from_entry(request, entry, status)
+            elif not singleflight.acquire(cache, key):
+                record = singleflight.wait_for(cache, key, wait=2.0)
+                if record is not None:
+                    singleflight.count(cache, 'pages', 'wait')
+                    if on_hit is not None:
+                        on_hit(request, record['value']['meta'])
+                    return _from_entry(request, record['value'])
+                return view_func(request, *args, **kwargs)
+
+            try:
+                return _render(request, view_func, args, kwargs, cache, key, tags, timeout)
+            finally:
+                singleflight.release(cache, key)
+        return wrapper
+    return decorator
+
+
+def _render(request, view_func, args, kwargs, cache, key, tags, timeout):
+    # Tokens taken before rendering let us notice a purge that lands
+    # mid-render, which would otherwise be cached as current.
+    before = _tag_tokens(cache, tags, create=True)
+    request._page_cache_tags = set(tags)
+    request._page_cache_meta = {}
+    started = time.monotonic()
+    response = view_func(request, *args, **kwargs)
+    if response.status_code == 200 and not response.streaming and not response.cookies:
+        page_tags = _tag_tokens(cache, request._page_cache_tags, create=True)
+        if any(page_tags[tag] != token for tag, token in before.items()):
+            return response
+        singleflight.store(
+            cache, key, _to_entry(response, page_tags, request._page_cache_meta),
+            timeout if timeout is not None else settings.PAGE_CACHE_TIMEOUT,
+            time.monotonic() - started,
+            settings.PAGE_CACHE_STALE_TTL,
+        )
+        singleflight.count(cache, 'pages', 'recompute')
+        response['X-Page-Cache'] = 'MISS'
+    return response
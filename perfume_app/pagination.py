@@ -0,0 +1,182 @@
+# pagination.py
+"""Keyset (cursor) pagination
+
+Offset pagination has to COUNT(*) the whole result and skip over every
+earlier row, so deep pages get slower. A keyset page instead continues
+from the sort key of the last row it showed: the cost of a page is the
+same wherever it sits in the listing.
+
+Cursors are signed with SECRET_KEY (salted per ordering) so clients can't
+forge or reuse them across sort orders.
+"""
+import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class KeysetPaginator:
+    """Paginate a queryset by its ordering, which must end with a unique field"""
+
+    def __init__(self, queryset, per_page, ordering=None):
+        ordering = ordering or queryset.query.order_by
+        if not ordering or ordering[-1].lstrip('-') not in ('id', 'pk'):
+            raise ValueError("Keyset pagination needs an ordering that ends with 'id'.")
+        self.queryset = queryset.order_by(*ordering)
+        self.per_page = int(per_page)
+        self.ordering = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+        self.salt = 'perfume_app.pagination:' + ','.join(ordering)
+
+    @cached_property
+    def count(self):
+        """Total number of rows; only computed if something actually reads it"""
+        return self.queryset.count()
+
+    def encode_cursor(self, obj, backwards=False):
+        values = [_serialize(getattr(obj, field)) for field, _ in self.ordering]
+        return signing.dumps({'v': values, 'b': backwards}, salt=self.salt, compress=True)
+
+    def decode_cursor(self, cursor):
+        try:
+            data = signing.loads(cursor, salt=self.salt)
+            values, backwards = data['v'], bool(data['b'])
+        except (signing.BadSignature, KeyError, TypeError):
+            return None, False
+        if len(values) != len(self.ordering):
+            return None, False
+        return values, backwards
+
+    def _seek(self, values, backwards):
+        """Rows strictly after (or before) the given sort key"""
+        condition = Q()
+        for position, (field, descending) in enumerate(self.ordering):
+            lookup = 'lt' if descending != backwards else 'gt'
+            clause = Q(**{f'{field}__{lookup}': values[position]})
+            for previous, (previous_field, _) in enumerate(self.ordering[:position]):
+                clause &= Q(**{previous_field: values[previous]})
+            condition |= clause
+        return condition
+
+    def get_page(self, cursor=None):
+        values, backwards = self.decode_cursor(cursor) if cursor else (None, False)
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, backwards))
+        if backwards:
+            queryset = queryset.reverse()
+
+        # One extra row tells us whether there is anything beyond this page
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            return KeysetPage(rows, self, has_next=values is not None, has_previous=has_more)
+        return KeysetPage(rows, self, has_next=has_more, has_previous=values is not None)
+
+
+class KeysetPage:
+    """A page of a KeysetPaginator, mirroring the parts of Page templates use"""
+
+    is_keyset = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_url = self.previous_url = None
+
+    def __repr__(self):
+        return f'<KeysetPage of {len(self.object_list)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[0], backwards=True)
+        return None
+
+
+def _serialize(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def use_keyset(request):
+    """Cursor mode is on site-wide via PAGINATION_MODE, or per request via ?cursor="""
+    return getattr(settings, 'PAGINATION_MODE', 'offset') == 'cursor' or 'cursor' in request.GET
+
+
+def paginate(request, queryset, per_page):
+    """Return a page of queryset in offset or cursor mode depending on the request
+
+    Querysets whose ordering doesn't end with the primary key (e.g. search
+    relevance) can't be keyset-paginated and always use offset pages.
+    Either way the page carries next_url and previous_url, and offset
+    pages page_links, [(number, url)] around the current page; all keep
+    the request's other parameters (filters, facets, sort, query).
+    """
+    if use_keyset(request):
+        try:
+            paginator = KeysetPaginator(queryset, per_page)
+        except ValueError:
+            pass
+        else:
+            page = paginator.get_page(request.GET.get('cursor'))
+            params = request.GET.copy()
+            params.pop('page', None)
+            if page.next_cursor:
+                params['cursor'] = page.next_cursor
+                page.next_url = '?' + params.urlencode()
+            if page.previous_cursor:
+                params['cursor'] = page.previous_cursor
+                page.previous_url = '?' + params.urlencode()
+            return page
+
+    paginator = Paginator(queryset, per_page)
+    page = paginator.get_page(request.GET.get('page'))
+    params = request.GET.copy()
+    params.pop('cursor', None)
+
+    def page_url(number):
+        params['page'] = number
+        return '?' + params.urlencode()
+
+    page.next_url = page_url(page.next_page_number()) if page.has_next() else None
+    page.previous_url = page_url(page.previous_page_number()) if page.has_previous() else None
+    page.page_links = [
+        (number, page_url(number))
+        for number in range(max(1, page.number - 2), min(paginator.num_pages, page.number + 2) + 1)
+    ]
+    return page
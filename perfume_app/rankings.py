@@ -0,0 +1,140 @@
+# rankings.py
+"""Best-seller and trending rankings, precomputed for the home page
+
+update_rankings() (the update_rankings command, run on a schedule after
+update_sales_rollups) ranks products with one grouped query per ranking:
+
+- best sellers by the units sold over the last BEST_SELLER_DAYS, read
+  from the daily sales rollups (see sales_rollups.py), so cancelled and
+  refunded orders don't count;
+- trending by how much busier their pages and add-to-cart buttons were
+  over the last TRENDING_DAYS than over the BASELINE_DAYS before, read
+  from ProductActivity (see activity.py).
+
+Each ranking is stored in order as RankedProduct rows, which the home
+page reads as they are, and the products' is_best_seller / is_trending
+flags are set to match with one bulk_update of the products whose flags
+changed.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from .models import DailyProductSales, Product, ProductActivity, RankedProduct
+from .page_cache import invalidate
+
+BEST_SELLER_DAYS = 30
+TRENDING_DAYS = 3
+BASELINE_DAYS = 28
+
+# Products kept per ranking
+RANKING_SIZE = 12
+
+# An add to cart says as much about interest as this many views
+CART_ADD_WEIGHT = 5
+
+# Weighted activity over TRENDING_DAYS below which a rise is noise
+MIN_TRENDING_ACTIVITY = 20
+
+# How many times its usual rate a product's activity must reach to trend
+MIN_TRENDING_RISE = 1.5
+
+# Added to every product's daily baseline, so a product that was never
+# looked at doesn't trend on its first few views
+BASELINE_SMOOTHING = 5
+
+FLAGS = {
+    RankedProduct.BEST_SELLERS: 'is_best_seller',
+    RankedProduct.TRENDING: 'is_trending',
+}
+
+
+def best_sellers(today):
+    """[(product id, units sold)] of the best sellers, best first"""
+    rows = (
+        DailyProductSales.objects.filter(day__gt=today - timedelta(days=BEST_SELLER_DAYS), product__is_active=True)
+        .values('product_id')
+        .annotate(sold=Sum('units'))
+        .filter(sold__gt=0)
+        .order_by('-sold', 'product_id')
+        .values_list('product_id', 'sold')
+    )
+    return list(rows[:RANKING_SIZE])
+
+
+def trending(today):
+    """[(product id, score)] of the trending products, most trending first
+
+    The score is the product's weighted activity per day over the last
+    TRENDING_DAYS divided by its (smoothed) rate over the BASELINE_DAYS
+    before; it must reach MIN_TRENDING_RISE.
+    """
+    recent_start = today - timedelta(days=TRENDING_DAYS - 1)
+    baseline_start = recent_start - timedelta(days=BASELINE_DAYS)
+    activity = F('views') + F('cart_adds') * CART_ADD_WEIGHT
+    rows = (
+        ProductActivity.objects.filter(day__gte=baseline_start, day__lte=today, product__is_active=True)
+        .values('product_id')
+        .annotate(
+            recent=Sum(activity, filter=Q(day__gte=recent_start), default=0),
+            baseline=Sum(activity, filter=Q(day__lt=recent_start), default=0),
+        )
+        .filter(recent__gte=MIN_TRENDING_ACTIVITY)
+        .order_by()
+        .values_list('product_id', 'recent', 'baseline')
+    )
+    scores = [
+        (product_id, (recent / TRENDING_DAYS) / (baseline / BASELINE_DAYS + BASELINE_SMOOTHING))
+        for product_id, recent, baseline in rows
+    ]
+    scores = [(product_id, score) for product_id, score in scores if score >= MIN_TRENDING_RISE]
+    scores.sort(key=lambda score: (-score[1], score[0]))
+    return scores[:RANKING_SIZE]
+
+
+@transaction.atomic
+def update_rankings():
+    """Recompute the rankings and the flags that follow them
+
+    Returns ({ranking: products ranked}, products whose flags changed).
+    """
+    today = timezone.localdate()
+    rankings = {RankedProduct.BEST_SELLERS: best_sellers(today), RankedProduct.TRENDING: trending(today)}
+
+    RankedProduct.objects.all().delete()
+    RankedProduct.objects.bulk_create([
+        RankedProduct(ranking=ranking, rank=rank, product_id=product_id, score=score)
+        for ranking, ranked in rankings.items()
+        for rank, (product_id, score) in enumerate(ranked, 1)
+    ])
+
+    flagged = {FLAGS[ranking]: {product_id for product_id, _ in ranked} for ranking, ranked in rankings.items()}
+    candidates = Q(pk__in=set().union(*flagged.values()))
+    for flag in flagged:
+        candidates |= Q(**{flag: True})
+    now = timezone.now()
+    changed = []
+    for product in Product.objects.filter(candidates).only('pk', *flagged):
+        flags = {flag: product.pk in product_ids for flag, product_ids in flagged.items()}
+        if any(getattr(product, flag) != value for flag, value in flags.items()):
+            for flag, value in flags.items():
+                setattr(product, flag, value)
+            product.updated_at = now
+            changed.append(product)
+    Product.objects.bulk_update(changed, [*flagged, 'updated_at'], batch_size=500)
+
+    product_tags = [f'product:{product.pk}' for product in changed]
+    transaction.on_commit(lambda: invalidate('rankings', *product_tags))
+    return {ranking: len(ranked) for ranking, ranked in rankings.items()}, len(changed)
+
+
+def ranked_products(ranking, limit=8):
+    """The active products of a ranking, in order"""
+    return [
+        row.product
+        for row in RankedProduct.objects.filter(ranking=ranking, product__is_active=True)
+        .select_related('product')
+        .order_by('rank')[:limit]
+    ]
@@ -0,0 +1,66 @@
+# ratings.py
+"""Maintenance of the denormalized rating aggregates stored on Product"""
+from django.db.models import Case, Count, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+from .models import Product, Review
+
+
+def _average(sum_expr, count_expr, is_empty):
+    return Case(
+        When(is_empty, then=Value(0.0)),
+        default=Cast(sum_expr, FloatField()) / Cast(count_expr, FloatField()),
+        output_field=FloatField(),
+    )
+
+
+def apply_rating_delta(product_id, sum_delta, count_delta):
+    """Shift a product's rating aggregates by the given deltas in one UPDATE"""
+    if not product_id or (not sum_delta and not count_delta):
+        return
+    new_sum = F('rating_sum') + sum_delta
+    new_count = F('rating_count') + count_delta
+    # Every expression in the SET clause sees the pre-update row, so the
+    # average is computed from the new sum and count without a re-read.
+    Product.objects.filter(pk=product_id).update(
+        rating_sum=new_sum,
+        rating_count=new_count,
+        avg_rating=_average(new_sum, new_count, Q(rating_count__lte=-count_delta)),
+    )
+
+
+def review_changed(old_state, new_state):
+    """Move a review's contribution from old_state to new_state
+
+    Both states are (product_id, rating, count) tuples as returned by
+    Review.rating_contribution(); None means the review did not exist.
+    """
+    old_product, old_rating, old_count = old_state or (None, 0, 0)
+    new_product, new_rating, new_count = new_state or (None, 0, 0)
+
+    if old_product == new_product:
+        apply_rating_delta(new_product, new_rating - old_rating, new_count - old_count)
+    else:
+        apply_rating_delta(old_product, -old_rating, -old_count)
+        apply_rating_delta(new_product, new_rating, new_count)
+
+
+def rebuild_product_ratings(queryset=None):
+    """Recompute the aggregates from scratch for the given products (default: all)"""
+    if queryset is None:
+        queryset = Product.objects.all()
+
+    active_reviews = Review.objects.filter(
+        product=OuterRef('pk'), is_active=True
+    ).order_by().values('product')
+    rating_sum = active_reviews.annotate(total=Sum('rating')).values('total')
+    rating_count = active_reviews.annotate(total=Count('id')).values('total')
+
+    updated = queryset.update(
+        rating_sum=Coalesce(Subquery(rating_sum), 0),
+        rating_count=Coalesce(Subquery(rating_count), 0),
+    )
+    queryset.update(
+        avg_rating=_average(F('rating_sum'), F('rating_count'), Q(rating_count=0)),
+    )
+    return updated
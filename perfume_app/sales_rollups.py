@@ -0,0 +1,181 @@
+# sales_rollups.py
+"""Daily sales rollups and the admin sales dashboard that reads them
+
+DailySales (per payment method), DailyCategorySales and
+DailyProductSales hold each day's orders, units and revenue per bucket,
+so sales questions read a few hundred rows per year instead of every
+Order and OrderItem.
+
+update_sales_rollups() (the update_sales_rollups command, run on a
+schedule) finds the orders whose updated_at moved past its watermark
+since the last run and recomputes the days those orders were placed on,
+from every order of those days: a new order, an edited one and one
+cancelled or refunded months later all land in the right day. Orders
+are read once they are SETTLE_TIME old, so one saved just before a run
+but committed after it isn't skipped. Deleting an order doesn't touch
+updated_at; --full rebuilds everything from scratch.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Checkpoint, DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem
+
+# Orders in these states are not sales
+EXCLUDED_STATUSES = ('cancelled', 'refunded')
+
+SETTLE_TIME = timedelta(minutes=5)
+CHECKPOINT = 'sales_rollups:orders'
+
+# Size of the dashboard's revenue chart, in SVG units
+CHART_WIDTH = 800
+CHART_HEIGHT = 200
+
+# rollup model -> (its bucket field, the OrderItem lookup that fills it)
+ROLLUPS = {
+    DailySales: ('payment_method', 'order__payment_method'),
+    DailyCategorySales: ('category_id', 'product__category_id'),
+    DailyProductSales: ('product_id', 'product_id'),
+}
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _days_filter(days):
+    """Q on OrderItem for orders placed on any of days, consecutive days as one range"""
+    query = Q()
+    days = sorted(days)
+    start = 0
+    for index, day in enumerate(days):
+        if index + 1 == len(days) or days[index + 1] != day + timedelta(days=1):
+            query |= Q(
+                order__created_at__gte=_day_start(days[start]),
+                order__created_at__lt=_day_start(day + timedelta(days=1)),
+            )
+            start = index + 1
+    return query
+
+
+def _rows(model, items):
+    field, lookup = ROLLUPS[model]
+    buckets = (
+        items.values(day=TruncDate('order__created_at'), bucket=F(lookup))
+        .annotate(
+            order_count=Count('order_id', distinct=True),
+            unit_count=Sum('quantity'),
+            item_revenue=Sum(F('quantity') * F('price'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+        )
+        .order_by()
+    )
+    return [
+        model(
+            day=bucket['day'],
+            orders=bucket['order_count'],
+            units=bucket['unit_count'],
+            revenue=bucket['item_revenue'],
+            **{field: bucket['bucket']},
+        )
+        for bucket in buckets.iterator(chunk_size=2000)
+    ]
+
+
+def rebuild_days(days=None):
+    """Recompute the rollup rows of the given days (default: every day)"""
+    items = OrderItem.objects.exclude(order__status__in=EXCLUDED_STATUSES)
+    if days is not None:
+        if not days:
+            return
+        items = items.filter(_days_filter(days))
+    with transaction.atomic():
+        for model in ROLLUPS:
+            stored = model.objects.all()
+            if days is not None:
+                stored = stored.filter(day__in=days)
+            stored.delete()
+            model.objects.bulk_create(_rows(model, items), batch_size=1000)
+
+
+@transaction.atomic
+def update_sales_rollups(full=False):
+    """Bring the rollups up to date with the orders changed since the last run
+
+    full recomputes every day instead. Returns (orders read, days
+    recomputed).
+    """
+    # Locking the checkpoint keeps two runs from interleaving
+    checkpoint, _ = Checkpoint.objects.select_for_update().get_or_create(name=CHECKPOINT)
+    until = timezone.now() - SETTLE_TIME
+    changed = Order.objects.filter(updated_at__lte=until).order_by()
+    if checkpoint.timestamp and not full:
+        changed = changed.filter(updated_at__gt=checkpoint.timestamp)
+    days = set(changed.annotate(day=TruncDate('created_at')).values_list('day', flat=True).distinct())
+
+    rebuild_days(None if full else days)
+    checkpoint.timestamp = until
+    checkpoint.save(update_fields=['timestamp', 'updated_at'])
+    return changed.count(), len(days)
+
+
+# Sums over rollup rows, named apart from the fields they add up
+SUMS = {'total_orders': Sum('orders'), 'total_units': Sum('units'), 'total_revenue': Sum('revenue')}
+
+
+def _totals(row):
+    return {'orders': row['total_orders'] or 0, 'units': row['total_units'] or 0, 'revenue': row['total_revenue'] or 0}
+
+
+def chart_points(values, width=CHART_WIDTH, height=CHART_HEIGHT):
+    """SVG polyline points plotting values left to right, the largest at the top"""
+    peak = max(values, default=0) or 1
+    step = width / max(len(values) - 1, 1)
+    return ' '.join(f'{index * step:.1f},{height - value / peak * height:.1f}' for index, value in enumerate(values))
+
+
+def sales_dashboard(days=365, top=10):
+    """What the admin sales dashboard shows for the last days days, read from the rollups only"""
+    end = timezone.localdate()
+    start = end - timedelta(days=days - 1)
+
+    daily = DailySales.objects.filter(day__gte=start, day__lte=end)
+    by_day = {row['day']: _totals(row) for row in daily.values('day').annotate(**SUMS).order_by()}
+    empty = {'orders': 0, 'units': 0, 'revenue': 0}
+    series = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        series.append({'day': day, **by_day.get(day, empty)})
+    totals = _totals(daily.aggregate(**SUMS))
+    totals['average_order'] = totals['revenue'] / totals['orders'] if totals['orders'] else 0
+
+    payment_methods = dict(Order.PAYMENT_METHOD_CHOICES)
+    by_payment = [
+        {'label': payment_methods.get(row['payment_method'], row['payment_method']), **_totals(row)}
+        for row in daily.values('payment_method').annotate(**SUMS).order_by('-total_revenue')
+    ]
+    by_category = [
+        {'label': row['category__name'], **_totals(row)}
+        for row in DailyCategorySales.objects.filter(day__gte=start, day__lte=end)
+        .values('category_id', 'category__name').annotate(**SUMS).order_by('-total_revenue')
+    ]
+    top_products = [
+        {'label': row['product__name'], **_totals(row)}
+        for row in DailyProductSales.objects.filter(day__gte=start, day__lte=end)
+        .values('product_id', 'product__name').annotate(**SUMS).order_by('-total_revenue')[:top]
+    ]
+    return {
+        'start': start,
+        'end': end,
+        'series': series,
+        'chart_points': chart_points([float(point['revenue']) for point in series]),
+        'chart_width': CHART_WIDTH,
+        'chart_height': CHART_HEIGHT,
+        'peak_revenue': max((point['revenue'] for point in series), default=0),
+        'totals': totals,
+        'by_payment': by_payment,
+        'by_category': by_category,
+        'top_products': top_products,
+    }
@@ -0,0 +1,203 @@
+# search.py
+"""Product full-text search backends
+
+The backend is picked from the database vendor: an FTS5 virtual table on
+SQLite, a weighted tsvector column with a GIN index on PostgreSQL. When
+the index is missing (or the database supports neither) searches fall
+back to the original icontains lookups. Set SEARCH_BACKEND to a dotted
+path to force a specific backend class.
+
+The match and its rank are part of the product query itself (the FTS
+table is joined in; the tsvector is a column), so every filter the
+caller adds, before or after, applies to all the matches, and a page of
+results reads only that page.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import Category, Product
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    return TOKEN_RE.findall((query or '').lower())
+
+
+class BasicSearchBackend:
+    """Unindexed icontains search over name, description and category name"""
+
+    def search(self, queryset, query):
+        if not query:
+            return queryset.none()
+        return queryset.filter(
+            Q(name__icontains=query) |
+            Q(description__icontains=query) |
+            Q(category__name__icontains=query)
+        ).order_by('name')
+
+    def index_products(self, product_ids):
+        pass
+
+    def index_category(self, category_id):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def rebuild(self):
+        return 0
+
+
+class SQLiteFTSBackend(BasicSearchBackend):
+    """FTS5 virtual table ranked with bm25()"""
+
+    table = 'perfume_app_product_fts'
+    # bm25() column weights: name, category, description
+    weights = (10.0, 5.0, 1.0)
+
+    def is_available(self):
+        return self.table in connection.introspection.table_names()
+
+    def match_expression(self, query):
+        # Quote every token so user input can't inject FTS5 syntax; the
+        # trailing * turns each into a prefix match for search-as-you-type.
+        return ' '.join(f'"{token}"*' for token in tokenize(query))
+
+    def search(self, queryset, query):
+        match = self.match_expression(query)
+        if not match:
+            return queryset.none()
+        product_table = connection.ops.quote_name(Product._meta.db_table)
+        # bm25() is lower for better matches. SQLite drives the join from
+        # the MATCH and looks products up by primary key
+        return queryset.extra(
+            tables=[self.table],
+            where=[f"{self.table}.rowid = {product_table}.id", f"{self.table} MATCH %s"],
+            params=[match],
+            select={'search_rank': f"bm25({self.table}, %s, %s, %s)"},
+            select_params=list(self.weights),
+        ).order_by('search_rank')
+
+    def _reindex(self, where, params):
+        product_table = Product._meta.db_table
+        category_table = Category._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE rowid IN "
+                f"(SELECT p.id FROM {product_table} p WHERE {where})",
+                params,
+            )
+            cursor.execute(
+                f"INSERT INTO {self.table} (rowid, name, category, description) "
+                f"SELECT p.id, p.name, c.name, p.description FROM {product_table} p "
+                f"JOIN {category_table} c ON c.id = p.category_id WHERE {where}",
+                params,
+            )
+            return cursor.rowcount
+
+    def index_products(self, product_ids):
+        if product_ids:
+            placeholders = ', '.join(['%s'] * len(product_ids))
+            self._reindex(f"p.id IN ({placeholders})", list(product_ids))
+
+    def index_category(self, category_id):
+        self._reindex("p.category_id = %s", [category_id])
+
+    def remove_products(self, product_ids):
+        if product_ids:
+            placeholders = ', '.join(['%s'] * len(product_ids))
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})",
+                    list(product_ids),
+                )
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+        return self._reindex("1 = 1", [])
+
+
+class PostgresSearchBackend(BasicSearchBackend):
+    """Weighted tsvector column with a GIN index, ranked with ts_rank_cd()
+
+    PostgreSQL has no built-in BM25; ts_rank_cd over A/B/C weighted
+    vectors is the closest native ranking.
+    """
+
+    column = 'search_vector'
+    config = 'english'
+
+    def is_available(self):
+        with connection.cursor() as cursor:
+            columns = connection.introspection.get_table_description(cursor, Product._meta.db_table)
+        return any(column.name == self.column for column in columns)
+
+    def tsquery(self, query):
+        return ' & '.join(f'{token}:*' for token in tokenize(query))
+
+    def search(self, queryset, query):
+        tsquery = self.tsquery(query)
+        if not tsquery:
+            return queryset.none()
+        column = f"{connection.ops.quote_name(Product._meta.db_table)}.{self.column}"
+        return queryset.extra(
+            where=[f"{column} @@ to_tsquery(%s, %s)"],
+            params=[self.config, tsquery],
+            select={'search_rank': f"ts_rank_cd({column}, to_tsquery(%s, %s))"},
+            select_params=[self.config, tsquery],
+        ).order_by('-search_rank')
+
+    def _reindex(self, where, params):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {Product._meta.db_table} p SET {self.column} = "
+                f"setweight(to_tsvector(%s, coalesce(p.name, '')), 'A') || "
+                f"setweight(to_tsvector(%s, coalesce(c.name, '')), 'B') || "
+                f"setweight(to_tsvector(%s, coalesce(p.description, '')), 'C') "
+                f"FROM {Category._meta.db_table} c WHERE c.id = p.category_id AND {where}",
+                [self.config, self.config, self.config, *params],
+            )
+            return cursor.rowcount
+
+    def index_products(self, product_ids):
+        if product_ids:
+            self._reindex("p.id = ANY(%s)", [list(product_ids)])
+
+    def index_category(self, category_id):
+        self._reindex("p.category_id = %s", [category_id])
+
+    def rebuild(self):
+        return self._reindex("TRUE", [])
+
+
+VENDOR_BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+_backend = None
+
+
+def get_search_backend():
+    """Return the configured backend, resolving it once per process"""
+    global _backend
+    if _backend is None:
+        backend_path = getattr(settings, 'SEARCH_BACKEND', None)
+        if backend_path:
+            _backend = import_string(backend_path)()
+        else:
+            backend_class = VENDOR_BACKENDS.get(connection.vendor)
+            backend = backend_class() if backend_class else None
+            _backend = backend if backend and backend.is_available() else BasicSearchBackend()
+    return _backend
+
+
+def search_products(queryset, query):
+    """Filter queryset down to products matching query, best match first"""
+    return get_search_backend().search(queryset, query)
@@ -0,0 +1,237 @@
+# signals.py
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .carts import cart_changed, merge_guest_cart, remember_cart_id
+from .category_stats import product_changed as category_stats_changed
+from .facets import product_changed as facet_index_changed
+from .models import Cart, CartItem, Category, Product, ProductImage, Review, Wishlist
+from .gallery import image_changed as gallery_image_changed
+from .images import delete_derivatives, generate_derivatives
+from .notes import product_changed as fragrance_notes_changed
+from .page_cache import invalidate
+from .ratings import review_changed
+from .search import get_search_backend
+from .similarity import product_changed as scent_profile_changed, product_deleted as scent_product_deleted
+from .wishlists import wishlist_changed
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    """Make sure we know what the stored row contributed before it is overwritten"""
+    if instance.pk and not hasattr(instance, '_rating_state'):
+        stored = Review.objects.filter(pk=instance.pk).first()
+        instance._rating_state = stored.rating_contribution() if stored else None
+
+
+@receiver(post_save, sender=Review)
+def update_product_rating_on_save(sender, instance, created, raw=False, **kwargs):
+    """Keep Product.rating_sum/rating_count/avg_rating in step with its reviews"""
+    if raw:
+        return
+    old_state = None if created else getattr(instance, '_rating_state', None)
+    new_state = instance.rating_contribution()
+    review_changed(old_state, new_state)
+    instance._rating_state = new_state
+
+
+@receiver(post_delete, sender=Review)
+def update_product_rating_on_delete(sender, instance, **kwargs):
+    review_changed(getattr(instance, '_rating_state', instance.rating_contribution()), None)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_state(sender, instance, raw=False, **kwargs):
+    """What the stored row contributed to category statistics, similar products and facets"""
+    if raw or not instance.pk:
+        return
+    states = ('_category_stats_state', '_scent_state', '_facet_state')
+    if not all(hasattr(instance, state) for state in states):
+        stored = Product.objects.filter(pk=instance.pk).first()
+        if not hasattr(instance, '_category_stats_state'):
+            instance._category_stats_state = stored.category_stats_contribution() if stored else None
+        if not hasattr(instance, '_scent_state'):
+            instance._scent_state = stored.scent_profile() if stored else None
+        if not hasattr(instance, '_facet_state'):
+            instance._facet_state = stored.facet_state() if stored else None
+
+
+@receiver(post_save, sender=Product)
+def update_category_stats_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    new_state = instance.category_stats_contribution()
+    category_stats_changed(getattr(instance, '_category_stats_state', None), new_state)
+    instance._category_stats_state = new_state
+
+
+@receiver(post_delete, sender=Product)
+def update_category_stats_on_delete(sender, instance, **kwargs):
+    state = getattr(instance, '_category_stats_state', None) or instance.category_stats_contribution()
+    category_stats_changed(state, None)
+
+
+@receiver(post_save, sender=Product)
+def update_facet_index_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    new_state = instance.facet_state()
+    facet_index_changed(getattr(instance, '_facet_state', None), new_state)
+    instance._facet_state = new_state
+
+
+@receiver(post_delete, sender=Product)
+def update_facet_index_on_delete(sender, instance, **kwargs):
+    facet_index_changed(instance.facet_state(), None)
+
+
+@receiver(post_save, sender=Product)
+def update_scent_indexes_on_save(sender, instance, raw=False, **kwargs):
+    """Keep the note index and similar products in step with the scent profile"""
+    if raw:
+        return
+    old_state = getattr(instance, '_scent_state', None)
+    new_state = instance.scent_profile()
+    fragrance_notes_changed(instance.pk, old_state and old_state[1], new_state[1])
+    scent_profile_changed(instance.pk, old_state, new_state)
+    instance._scent_state = new_state
+
+
+@receiver(pre_delete, sender=Product)
+def refill_similar_products_on_delete(sender, instance, **kwargs):
+    scent_product_deleted(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        get_search_backend().index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, raw=False, **kwargs):
+    """Category names are indexed with every product, so refresh them all"""
+    if not raw and not created:
+        get_search_backend().index_category(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def purge_product_pages(sender, instance, **kwargs):
+    invalidate(f'product:{instance.pk}', 'products')
+
+
+@receiver([post_save, post_delete], sender=Category)
+def purge_category_pages(sender, instance, **kwargs):
+    invalidate(f'category:{instance.pk}', 'categories')
+
+
+@receiver(post_save, sender=ProductImage)
+def sync_primary_image_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    new_state = instance.gallery_state()
+    gallery_image_changed(getattr(instance, '_gallery_state', None), new_state)
+    instance._gallery_state = new_state
+
+
+@receiver(post_delete, sender=ProductImage)
+def sync_primary_image_on_delete(sender, instance, **kwargs):
+    gallery_image_changed(instance.gallery_state(), None)
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def purge_product_image_pages(sender, instance, **kwargs):
+    invalidate(f'product:{instance.product_id}')
+
+
+@receiver([post_save, post_delete], sender=Review)
+def purge_review_pages(sender, instance, **kwargs):
+    """Reviews move the product's rating, which listings show, sort and facet by"""
+    invalidate(f'product:{instance.product_id}', 'products', 'facets')
+
+
+@receiver([post_save, post_delete], sender=CartItem)
+def forget_cart_summary(sender, instance, **kwargs):
+    cart_changed(instance.cart_id)
+
+
+@receiver(post_save, sender=Product)
+def forget_cart_summaries_with_product(sender, instance, created, raw=False, **kwargs):
+    """Cart totals are priced from the product, so drop the ones that include it"""
+    if not created and not raw:
+        cart_ids = list(CartItem.objects.filter(product=instance).values_list('cart_id', flat=True))
+        if cart_ids:
+            cart_changed(*cart_ids)
+
+
+@receiver(post_save, sender=Cart)
+def cache_cart_id(sender, instance, created, **kwargs):
+    if created:
+        remember_cart_id(instance.user_id, instance.pk)
+
+
+@receiver(post_delete, sender=Cart)
+def forget_cart_id(sender, instance, **kwargs):
+    remember_cart_id(instance.user_id, 0)
+
+
+@receiver(m2m_changed, sender=Wishlist.products.through)
+def forget_wishlisted_ids(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            wishlist_changed(instance.user_id)
+        return
+    # Changed from the product side, where pk_set holds wishlist ids
+    if action == 'pre_clear':
+        instance._cleared_wishlist_users = set(
+            Wishlist.objects.filter(products=instance).values_list('user_id', flat=True)
+        )
+    elif action == 'post_clear':
+        user_ids = getattr(instance, '_cleared_wishlist_users', ())
+        if user_ids:
+            wishlist_changed(*user_ids)
+    elif action.startswith('post_') and pk_set:
+        wishlist_changed(*Wishlist.objects.filter(pk__in=pk_set).values_list('user_id', flat=True).distinct())
+
+
+@receiver(pre_delete, sender=Product)
+def forget_wishlists_with_product(sender, instance, **kwargs):
+    """The cascade that takes a deleted product out of wishlists sends no m2m_changed"""
+    user_ids = list(Wishlist.objects.filter(products=instance).values_list('user_id', flat=True).distinct())
+    if user_ids:
+        wishlist_changed(*user_ids)
+
+
+@receiver(post_delete, sender=Wishlist)
+def forget_deleted_wishlist(sender, instance, **kwargs):
+    wishlist_changed(instance.user_id)
+
+
+@receiver(user_logged_in)
+def merge_guest_cart_on_login(sender, request, user, **kwargs):
+    session = getattr(request, 'session', None)
+    if session is not None:
+        merge_guest_cart(session, user)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=Category)
+def generate_image_derivatives(sender, instance, raw=False, **kwargs):
+    """Resize new uploads once the row is committed; existing derivatives are kept"""
+    if not raw and instance.image:
+        image = instance.image
+        transaction.on_commit(lambda: generate_derivatives(image))
+
+
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_delete, sender=Category)
+def delete_image_derivatives(sender, instance, **kwargs):
+    if instance.image:
+        delete_derivatives(instance.image)
@@ -0,0 +1,234 @@
+# similarity.py
+"""Scent-similar products for the detail page's "You May Also Like"
+
+Each active product is described by its fragrance notes, weighted with
+TF-IDF so that sharing a rare note (oud, tuberose) counts for more than
+sharing a common one (bergamot, musk), and by its intensity, longevity
+and gender. A product's TOP_K most similar products that share at least
+one note are precomputed into SimilarProduct, so the detail page reads
+them with one indexed query.
+
+Notes are read from the ProductNote index (see notes.py) and weighed
+with the stored Note.product_count, so scoring one product only reads
+the products sharing a note with it.
+
+The rebuild_similar_products command rebuilds the whole table. In
+between, a product whose scent profile changes queues a job (see
+jobs.py) that recomputes its own list and moves it into, within or out
+of the lists of the products it shares notes with, leaving every other
+list as it is (see signals.py). A list it drops out of that was full is
+recomputed, since another product may now belong in it. Those updates
+weigh notes by the catalog as it is at the time, so lists nobody
+touched drift slightly as notes come and go; a periodic rebuild brings
+them back in line.
+"""
+import heapq
+import math
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import Q
+
+from .jobs import enqueue
+from .models import Note, Product, ProductNote, SimilarProduct
+from .notes import parse_notes, refresh_note_counts
+from .page_cache import invalidate
+
+TOP_K = 8
+
+# Notes decide most of the score; the rest is how close the profiles are
+NOTES_WEIGHT = 0.7
+INTENSITY_WEIGHT = 0.1
+LONGEVITY_WEIGHT = 0.1
+GENDER_WEIGHT = 0.1
+
+
+def note_tokens(fragrance_notes):
+    """Set of the normalized notes in a fragrance_notes string"""
+    return {name for name, _ in parse_notes(fragrance_notes)}
+
+
+def _profile_similarity(profile, other):
+    """Weighted closeness of two (intensity, longevity, gender) profiles"""
+    (intensity, longevity, gender), (other_intensity, other_longevity, other_gender) = profile, other
+    if gender == other_gender:
+        gender_match = 1.0
+    else:
+        gender_match = 0.5 if 'U' in (gender, other_gender) else 0.0
+    return (
+        INTENSITY_WEIGHT * (1 - abs(intensity - other_intensity) / 4)
+        + LONGEVITY_WEIGHT * (1 - abs(longevity - other_longevity) / 4)
+        + GENDER_WEIGHT * gender_match
+    )
+
+
+class ScentIndex:
+    """TF-IDF note vectors of a set of active products with an inverted index over notes"""
+
+    def __init__(self, profiles, notes, document_frequency, total):
+        # profiles: {pk: (intensity, longevity, gender)}, notes: {pk: {note id}},
+        # document_frequency: {note id: products having it} out of total products
+        self.profiles = profiles
+        idf = {note: math.log((1 + total) / (1 + count)) + 1 for note, count in document_frequency.items()}
+
+        # Every note occurs once per product, so a vector is its notes' IDFs, L2-normalized
+        self.postings = {}
+        self.vectors = {}
+        for pk, tokens in notes.items():
+            norm = math.sqrt(sum(idf[token] ** 2 for token in tokens)) or 1.0
+            vector = {token: idf[token] / norm for token in tokens}
+            self.vectors[pk] = vector
+            for token, weight in vector.items():
+                self.postings.setdefault(token, []).append((pk, weight))
+
+        # There are few distinct profiles, so their similarities are looked up rather than computed per pair
+        distinct = set(self.profiles.values())
+        self.profile_similarity = {
+            (profile, other): _profile_similarity(profile, other) for profile in distinct for other in distinct
+        }
+
+    @classmethod
+    def load(cls, products):
+        """Index of the active products of a Product queryset"""
+        products = products.filter(is_active=True).order_by()
+        profiles = {
+            pk: (intensity, longevity, gender)
+            for pk, intensity, longevity, gender in products.values_list('pk', 'intensity', 'longevity', 'gender')
+        }
+        notes = {}
+        postings = ProductNote.objects.filter(product__in=products).values_list('product_id', 'note_id')
+        for product_id, note_id in postings:
+            notes.setdefault(product_id, set()).add(note_id)
+        document_frequency = dict(
+            Note.objects.filter(product_notes__product__in=products).distinct().values_list('pk', 'product_count')
+        )
+        return cls(profiles, notes, document_frequency, Product.objects.count())
+
+    @classmethod
+    def build(cls):
+        """Index of the whole active catalog"""
+        return cls.load(Product.objects.all())
+
+    @classmethod
+    def around(cls, product_id):
+        """Index of a product and the products sharing a note with it"""
+        sharing = ProductNote.objects.filter(
+            note_id__in=ProductNote.objects.filter(product_id=product_id).values('note_id')
+        ).values('product_id')
+        return cls.load(Product.objects.filter(Q(pk=product_id) | Q(pk__in=sharing)))
+
+    def scores(self, product_id):
+        """{other product id: similarity} for the products sharing a note with product_id
+
+        Similarity is symmetric, so this is also product_id's score in
+        each of those products' lists.
+        """
+        cosine = {}
+        for token, weight in self.vectors.get(product_id, {}).items():
+            for other, other_weight in self.postings[token]:
+                cosine[other] = cosine.get(other, 0.0) + weight * other_weight
+        cosine.pop(product_id, None)
+
+        profile, profiles, profile_similarity = self.profiles[product_id], self.profiles, self.profile_similarity
+        return {
+            other: NOTES_WEIGHT * notes_similarity + profile_similarity[profile, profiles[other]]
+            for other, notes_similarity in cosine.items()
+        }
+
+    def neighbours(self, product_id, k=TOP_K):
+        """[(product id, score)] of the k most similar products, best first"""
+        if product_id not in self.profiles:
+            return []
+        return heapq.nlargest(k, self.scores(product_id).items(), key=itemgetter(1))
+
+
+def _store(lists):
+    """Replace the stored lists of some products ({product id: [(similar id, score)]})"""
+    rows = [
+        SimilarProduct(product_id=product_id, similar_id=similar_id, rank=rank, score=score)
+        for product_id, neighbours in lists.items()
+        for rank, (similar_id, score) in enumerate(neighbours, 1)
+    ]
+    with transaction.atomic():
+        SimilarProduct.objects.filter(product_id__in=list(lists)).delete()
+        SimilarProduct.objects.bulk_create(rows, batch_size=1000)
+    # The detail page shows the list
+    invalidate(*[f'product:{product_id}' for product_id in lists])
+    return len(lists)
+
+
+def rebuild_similar_products(product_ids=None):
+    """Recompute the lists of the given products (default: all); returns how many"""
+    if product_ids is not None:
+        return refill_similar_products(product_ids)
+    index = ScentIndex.build()
+    with transaction.atomic():
+        # Lists of products that are no longer active go too
+        SimilarProduct.objects.all().delete()
+        return _store({product_id: index.neighbours(product_id) for product_id in index.profiles})
+
+
+def refill_similar_products(product_ids):
+    """Recompute the lists of the given products, each from its own neighbourhood (a job)"""
+    return _store({product_id: ScentIndex.around(product_id).neighbours(product_id) for product_id in product_ids})
+
+
+def update_similar_products(product_id):
+    """Bring every list product_id is, was or should be part of up to date (a job)
+
+    Its own list is recomputed. In the lists of the products it shares
+    a note with, it takes the place its new score earns; lists it leaves
+    are recomputed if they were full and just lose it otherwise. Returns
+    how many lists changed.
+    """
+    index = ScentIndex.around(product_id)
+    scores = index.scores(product_id) if product_id in index.profiles else {}
+    stored = {}
+    listed_by = SimilarProduct.objects.filter(similar_id=product_id).values('product_id')
+    rows = SimilarProduct.objects.filter(
+        Q(product_id__in=list(scores)) | Q(product_id__in=listed_by)
+    ).order_by('product_id', 'rank')
+    for owner, similar_id, score in rows.values_list('product_id', 'similar_id', 'score'):
+        stored.setdefault(owner, []).append((similar_id, score))
+
+    lists = {product_id: index.neighbours(product_id)}
+    refill = []
+    for owner in (stored.keys() | scores.keys()) - {product_id}:
+        current = stored.get(owner, [])
+        others = [(similar_id, score) for similar_id, score in current if similar_id != product_id]
+        if owner in scores:
+            neighbours = heapq.nlargest(TOP_K, others + [(product_id, scores[owner])], key=itemgetter(1))
+        elif len(current) == TOP_K:
+            refill.append(owner)
+            continue
+        else:
+            neighbours = others
+        if neighbours != current:
+            lists[owner] = neighbours
+    lists.update({owner: ScentIndex.around(owner).neighbours(owner) for owner in refill})
+    return _store(lists)
+
+
+def product_changed(product_id, old_state, new_state):
+    """Queue the update of the lists a product save affects
+
+    States are Product.scent_profile() before and after (None for a new
+    product). The job commits or rolls back with the save.
+    """
+    if old_state != new_state:
+        enqueue(update_similar_products, product_id=product_id)
+
+
+def product_deleted(product_id):
+    """Queue the refill of the lists a product is about to be deleted from
+
+    Its own rows go with it (CASCADE), as do its notes' postings; this
+    runs before the delete, while the lists holding it and its notes can
+    still be found.
+    """
+    listed_by = list(SimilarProduct.objects.filter(similar_id=product_id).values_list('product_id', flat=True))
+    note_ids = list(ProductNote.objects.filter(product_id=product_id).values_list('note_id', flat=True))
+    if note_ids:
+        transaction.on_commit(lambda: refresh_note_counts(note_ids))
+    if listed_by:
+        enqueue(refill_similar_products, product_ids=listed_by)
@@ -0,0 +1,106 @@
+# singleflight.py
+"""Stampede protection for expensive cached values
+
+Values are stored with a soft expiry and kept in the cache for a grace
+period after it. Once a value is due for refresh, the first worker to
+take a short lock recomputes it while everyone else keeps serving the
+stale copy. Refreshes also start probabilistically a little before the
+soft expiry ("XFetch", Vattani et al.): the longer a value took to
+compute, the earlier a worker may volunteer, so hot keys are usually
+rebuilt before they expire at all.
+
+Hit, stale-serve, wait and recompute counters are kept in the cache so
+they aggregate across worker processes; see stats().
+"""
+import math
+import random
+import time
+
+LOCK_PREFIX = 'singleflight:lock'
+STATS_PREFIX = 'singleflight:stats'
+EVENTS = ('hit', 'stale', 'wait', 'recompute')
+
+# Default grace period during which an expired value may still be served
+STALE_TTL = 300
+LOCK_TIMEOUT = 30
+
+
+def count(cache, name, event):
+    key = f'{STATS_PREFIX}:{name}:{event}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def stats(cache, name):
+    """Counters for one named cache, e.g. {'hit': 120, 'stale': 3, ...}"""
+    keys = {f'{STATS_PREFIX}:{name}:{event}': event for event in EVENTS}
+    found = cache.get_many(keys)
+    return {event: found.get(key, 0) for key, event in keys.items()}
+
+
+def should_refresh(record, beta=1.0):
+    """True once the record is past its soft expiry, or probabilistically shortly before"""
+    jitter = -record['delta'] * beta * math.log(1.0 - random.random())
+    return time.time() + jitter >= record['expires']
+
+
+def acquire(cache, key, timeout=LOCK_TIMEOUT):
+    return cache.add(f'{LOCK_PREFIX}:{key}', 1, timeout)
+
+
+def release(cache, key):
+    cache.delete(f'{LOCK_PREFIX}:{key}')
+
+
+def store(cache, key, value, timeout, delta, stale_ttl=STALE_TTL):
+    record = {'value': value, 'expires': time.time() + timeout, 'delta': delta}
+    cache.set(key, record, timeout + stale_ttl)
+
+
+def wait_for(cache, key, wait, interval=0.05):
+    """Poll for a record another worker is computing; None if it doesn't show up in time"""
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        record = cache.get(key)
+        if record is not None:
+            return record
+    return None
+
+
+def remember(cache, key, compute, timeout, name='default', is_current=None,
+             stale_ttl=STALE_TTL, wait=2.0):
+    """Return the cached value for key, letting only one worker recompute it
+
+    is_current(value) can reject a cached value (e.g. after invalidation)
+    without dropping it: it is then served stale while one worker
+    rebuilds it.
+    """
+    record = cache.get(key)
+    if record is not None:
+        current = is_current is None or is_current(record['value'])
+        if current and not should_refresh(record):
+            count(cache, name, 'hit')
+            return record['value']
+        if not acquire(cache, key):
+            count(cache, name, 'stale')
+            return record['value']
+    elif not acquire(cache, key):
+        # Cold key already being built elsewhere: give that worker a moment
+        record = wait_for(cache, key, wait)
+        if record is not None:
+            count(cache, name, 'wait')
+            return record['value']
+        return compute()
+
+    try:
+        started = time.monotonic()
+        value = compute()
+        store(cache, key, value, timeout, time.monotonic() - started, stale_ttl)
+        count(cache, name, 'recompute')
+        return value
+    finally:
+        release(cache, key)
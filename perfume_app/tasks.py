@@ -0,0 +1,52 @@
+# tasks.py
+"""Functions run as background jobs (see jobs.py)
+
+Each takes only JSON-serializable keyword arguments and raises on
+failure, so the queue retries it.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import EmailMultiAlternatives
+from django.template import loader
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+
+def send_email(subject, message, recipient_list, from_email=None, html_message=None, reply_to=None):
+    """Send one email through the configured backend"""
+    email = EmailMultiAlternatives(
+        subject, message, from_email or settings.DEFAULT_FROM_EMAIL, recipient_list, reply_to=reply_to,
+    )
+    if html_message:
+        email.attach_alternative(html_message, 'text/html')
+    email.send(fail_silently=False)
+
+
+def send_password_reset(user_id, domain, site_name, protocol, subject_template_name, email_template_name,
+                        html_email_template_name=None, from_email=None):
+    """Email a user a password reset link, made only now so the job never holds one"""
+    user = get_user_model().objects.filter(pk=user_id, is_active=True).first()
+    if user is None or not user.has_usable_password():
+        return
+    context = {
+        'email': user.email,
+        'domain': domain,
+        'site_name': site_name,
+        'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+        'user': user,
+        'token': default_token_generator.make_token(user),
+        'protocol': protocol,
+    }
+    send_email(
+        subject=''.join(loader.render_to_string(subject_template_name, context).splitlines()),
+        message=loader.render_to_string(email_template_name, context),
+        recipient_list=[user.email],
+        from_email=from_email,
+        html_message=html_email_template_name and loader.render_to_string(html_email_template_name, context),
+    )
+
+
+def delete_user(user_id):
+    """Delete an account that was deactivated for deletion, with everything that cascades from it"""
+    get_user_model().objects.filter(pk=user_id, is_active=False).delete()
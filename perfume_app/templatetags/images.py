@@ -0,0 +1,24 @@
+from django import template
+
+from perfume_app.images import FORMATS, SRCSET_SIZES, derivative_urls, srcset
+
+register = template.Library()
+
+
+@register.inclusion_tag('perfumelux/includes/picture.html')
+def picture(image, size, alt='', style='', sizes=None, lazy=True):
+    """<picture> with WebP and JPEG srcsets of an image's derivatives for a slot of the given size"""
+    if not image:
+        return {'image': None}
+    srcset_sizes, default_sizes = SRCSET_SIZES[size]
+    urls = derivative_urls(image, [(name, fmt) for name in srcset_sizes for fmt in FORMATS])
+    return {
+        'image': image,
+        'src': urls[(size, 'jpeg')],
+        'webp_srcset': srcset(urls, srcset_sizes, 'webp'),
+        'jpeg_srcset': srcset(urls, srcset_sizes, 'jpeg'),
+        'sizes': sizes or default_sizes,
+        'alt': alt,
+        'style': style,
+        'lazy': lazy,
+    }
@@ -0,0 +1,14 @@
+from django import template
+
+from perfume_app.page_cache import cache_depends as record_dependency
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def cache_depends(context, *objects):
+    """Record objects this page renders so the page cache can purge it when they change"""
+    request = context.get('request')
+    if request is not None:
+        record_dependency(request, *objects)
+    return ''
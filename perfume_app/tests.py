@@ -1,3 +1,1328 @@
-from django.test import TestCase
+import csv
+import json
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.core import mail
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import QueryDict
+from django.db import connection
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import escape
+from PIL import Image
+
+from . import activity, newsletters, singleflight
+from .also_bought import also_bought_products, update_also_bought
+from .carts import GuestCart, merge_guest_cart
+from .catalog_import import CatalogImporter
+from .category_stats import refresh_category_stats
+from .context_processors import header_counts
+from .exports import export_lines
+from .facets import FacetIndex, facet_counts
+from .gallery import prefetch_gallery, sync_primary_images
+from .images import SIZES, delete_derivatives, derivative_name, derivative_url, generate_derivatives
+from .jobs import LOCK_TIMEOUT, RETRY_DELAY, claim, enqueue, retry, work
+from .newsletters import MESSAGE_CACHE_SIZE, campaign_message, start_campaign, subscribe, unsubscribe_url
+from .models import (
+    AlsoBoughtProduct, Campaign, Cart, CartItem, Category, CoPurchaseCount, DailyCategorySales, DailyProductSales,
+    DailySales, Job, NewsletterSubscriber, Note, Order, OrderItem, Product, ProductActivity, ProductImage,
+    ProductNote, RankedProduct, Review, SimilarProduct, User, Wishlist,
+)
+from .notes import filter_by_notes, index_product_notes, parse_notes
+from .orders import EmptyCartError, OutOfStockError, place_order, reorder
+from .page_cache import get_cache, invalidate, normalize_query
+from .pagination import KeysetPaginator
+from .rankings import update_rankings
+from .ratings import rebuild_product_ratings
+from .search import search_products
+from .sales_rollups import update_sales_rollups
+from .similarity import ScentIndex, note_tokens, rebuild_similar_products
+from .wishlists import get_wishlisted_ids
+
+ORDER_FIELDS = {
+    'first_name': 'Ada',
+    'last_name': 'Lovelace',
+    'email': 'ada@example.com',
+    'phone': '555-0100',
+    'address': '1 Analytical St',
+    'city': 'London',
+    'state': 'LDN',
+    'zip_code': 'N1',
+    'country': 'UK',
+    'payment_method': 'cod',
+}
+
+
+def make_product(category, name, price, stock):
+    return Product.objects.create(
+        name=name, sku=name.upper(), description=name, category=category,
+        price=price, stock=stock, fragrance_notes='bergamot, rose, musk',
+    )
+
+
+def image_file(name, size=(1200, 900), mode='RGB'):
+    buffer = BytesIO()
+    Image.new(mode, size, 'red').save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+def fill_cart(user, *lines):
+    cart, _ = Cart.objects.get_or_create(user=user)
+    for product, quantity in lines:
+        CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+    return cart
+
+
+class PlaceOrderTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='buyer@example.com')
+        category = Category.objects.create(name='Floral')
+        self.products = [make_product(category, f'Scent {i}', 10 + i, stock=5) for i in range(10)]
+
+    def test_order_totals_items_and_stock(self):
+        fill_cart(self.user, (self.products[0], 2), (self.products[1], 1))
+
+        order = place_order(self.user, **ORDER_FIELDS)
+
+        self.assertEqual(order.subtotal, 2 * 10 + 11)
+        self.assertEqual(order.total, order.subtotal)
+        self.assertEqual(
+            set(order.items.values_list('product_id', 'quantity', 'price')),
+            {(self.products[0].pk, 2, 10), (self.products[1].pk, 1, 11)},
+        )
+        self.products[0].refresh_from_db()
+        self.products[1].refresh_from_db()
+        self.assertEqual((self.products[0].stock, self.products[1].stock), (3, 4))
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        fill_cart(self.user, *[(product, 1) for product in self.products])
+        # cart, cart lines, products, stock UPDATE, order INSERT,
+        # order items INSERT, cart DELETE (collected first for the cart
+        # summary signal), plus the savepoint pair
+        with self.assertNumQueries(10):
+            order = place_order(self.user, **ORDER_FIELDS)
+        self.assertEqual(order.items.count(), len(self.products))
+
+    def test_insufficient_stock_rolls_back(self):
+        fill_cart(self.user, (self.products[0], 1), (self.products[1], 6))
+
+        with self.assertRaises(OutOfStockError) as raised:
+            place_order(self.user, **ORDER_FIELDS)
+
+        self.assertEqual(raised.exception.products, [self.products[1]])
+        self.assertFalse(Order.objects.exists())
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 5)
+        self.assertEqual(CartItem.objects.filter(cart__user=self.user).count(), 2)
+
+    def test_empty_cart(self):
+        with self.assertRaises(EmptyCartError):
+            place_order(self.user, **ORDER_FIELDS)
+
+
+class ReorderTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='regular@example.com')
+        category = Category.objects.create(name='Woody')
+        self.products = [make_product(category, f'Wood {i}', 20 + i, stock=5) for i in range(10)]
+
+    def past_order(self, *lines):
+        order = Order.objects.create(user=self.user, subtotal=0, total=0, **ORDER_FIELDS)
+        for product, quantity in lines:
+            OrderItem.objects.create(order=order, product=product, quantity=quantity, price=product.price)
+        return order
+
+    def test_adds_to_existing_quantities_and_skips_unavailable(self):
+        fill_cart(self.user, (self.products[0], 1))
+        self.products[1].is_active = False
+        self.products[1].save()
+        self.products[2].stock = 0
+        self.products[2].save()
+        order = self.past_order((self.products[0], 2), (self.products[1], 1), (self.products[2], 1), (self.products[3], 4))
+
+        skipped = reorder(self.user, order)
+
+        self.assertEqual(sorted(product_id for product_id, _ in skipped), [self.products[1].pk, self.products[2].pk])
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity')),
+            {self.products[0].pk: 3, self.products[3].pk: 4},
+        )
+
+    def test_query_count_does_not_grow_with_order_size(self):
+        fill_cart(self.user, (self.products[0], 1))
+        order = self.past_order(*[(product, 1) for product in self.products])
+        # order lines, savepoint pair, locked cart, existing quantities, upsert
+        with self.assertNumQueries(6):
+            reorder(self.user, order)
+        self.assertEqual(CartItem.objects.filter(cart__user=self.user).count(), len(self.products))
+
+
+class RatingTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Floral')
+        self.rose, self.iris = make_product(category, 'Rose', 20, stock=5), make_product(category, 'Iris', 35, stock=5)
+        self.users = [User.objects.create(email=f'reviewer{i}@example.com') for i in range(3)]
+
+    def review(self, user, rating, product=None, **fields):
+        return Review.objects.create(
+            product=product or self.rose, user=user, rating=rating, title='Nice', comment='Nice', **fields
+        )
+
+    def aggregates(self, product):
+        product.refresh_from_db()
+        return product.rating_sum, product.rating_count, product.avg_rating
+
+    def test_aggregates_follow_reviews(self):
+        first = self.review(self.users[0], 5)
+        second = self.review(self.users[1], 2)
+        self.review(self.users[2], 1, is_active=False)
+        self.assertEqual(self.aggregates(self.rose), (7, 2, 3.5))
+
+        second.rating = 4
+        second.save()
+        self.assertEqual(self.aggregates(self.rose), (9, 2, 4.5))
+
+        first.is_active = False
+        first.save()
+        self.assertEqual(self.aggregates(self.rose), (4, 1, 4.0))
+        first.is_active = True
+        first.save()
+        self.assertEqual(self.aggregates(self.rose), (9, 2, 4.5))
+
+        second.product = self.iris
+        second.save()
+        self.assertEqual(self.aggregates(self.rose), (5, 1, 5.0))
+        self.assertEqual(self.aggregates(self.iris), (4, 1, 4.0))
+
+        first.delete()
+        self.assertEqual(self.aggregates(self.rose), (0, 0, 0.0))
+
+    def test_stale_instances_apply_deltas_not_totals(self):
+        self.review(self.users[0], 5)
+        Review.objects.get(user=self.users[0]).delete()
+        self.review(self.users[1], 3)
+        stale = Review.objects.get(user=self.users[1])
+        self.review(self.users[2], 1)
+        stale.rating = 5
+        stale.save()
+        self.assertEqual(self.aggregates(self.rose), (6, 2, 3.0))
+
+        Product.objects.filter(pk=self.rose.pk).update(rating_sum=0, rating_count=0, avg_rating=0)
+        rebuild_product_ratings()
+        self.assertEqual(self.aggregates(self.rose), (6, 2, 3.0))
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        self.cache = LocMemCache('singleflight-tests', {})
+        self.cache.clear()
+        self.compute = mock.Mock(side_effect=lambda: self.compute.call_count)
+
+    def remember(self, **kwargs):
+        return singleflight.remember(self.cache, 'key', self.compute, 60, name='test', **kwargs)
+
+    def expire(self):
+        record = self.cache.get('key')
+        record['expires'] = 0
+        self.cache.set('key', record)
+
+    def test_value_is_computed_once_then_served(self):
+        self.assertEqual([self.remember() for _ in range(3)], [1, 1, 1])
+        self.assertEqual(singleflight.stats(self.cache, 'test'), {'hit': 2, 'stale': 0, 'wait': 0, 'recompute': 1})
+
+    def test_expired_value_is_served_stale_while_another_worker_rebuilds(self):
+        self.remember()
+        self.expire()
+        singleflight.acquire(self.cache, 'key')
+        self.assertEqual(self.remember(), 1)
+        singleflight.release(self.cache, 'key')
+        self.assertEqual(self.remember(), 2)
+        self.assertEqual(singleflight.stats(self.cache, 'test')['stale'], 1)
+
+    def test_rejected_value_is_rebuilt(self):
+        self.remember()
+        self.assertEqual(self.remember(is_current=lambda value: value != 1), 2)
+        self.assertEqual(self.remember(is_current=lambda value: value != 1), 2)
+
+    def test_cold_key_waits_for_the_worker_building_it(self):
+        singleflight.acquire(self.cache, 'key')
+        self.assertEqual(self.remember(wait=0.1), 1)
+        self.assertIsNone(self.cache.get('key'))
+
+        self.cache.get = mock.Mock(side_effect=[None, None, {'value': 'built elsewhere'}])
+        self.assertEqual(self.remember(wait=1.0), 'built elsewhere')
+        self.assertEqual(self.compute.call_count, 1)
+
+    def test_refresh_starts_after_expiry_or_early_for_slow_values(self):
+        now = time.time()
+        self.assertTrue(singleflight.should_refresh({'expires': now - 1, 'delta': 0}))
+        self.assertFalse(singleflight.should_refresh({'expires': now + 60, 'delta': 0}))
+        with mock.patch('random.random', return_value=0.99):
+            self.assertTrue(singleflight.should_refresh({'expires': now + 60, 'delta': 30}))
+
+
+class CategoryStatsTests(TestCase):
+    def setUp(self):
+        self.woody = Category.objects.create(name='Woody')
+        self.floral = Category.objects.create(name='Floral')
+
+    def stats(self, category):
+        category.refresh_from_db()
+        return category.product_count, category.min_price, category.max_price
+
+    def test_stats_follow_product_saves_and_deletes(self):
+        cedar = make_product(self.woody, 'Cedar', 30, stock=5)
+        oud = make_product(self.woody, 'Oud', 250, stock=5)
+        self.assertEqual(self.stats(self.woody), (2, 30, 250))
+        self.woody.refresh_from_db()
+        self.assertEqual(self.woody.newest_product_at, oud.created_at)
+
+        oud.is_active = False
+        oud.save()
+        self.assertEqual(self.stats(self.woody), (1, 30, 30))
+
+        cedar.category = self.floral
+        cedar.price = 45
+        cedar.save()
+        self.assertEqual(self.stats(self.woody), (0, None, None))
+        self.assertEqual(self.stats(self.floral), (1, 45, 45))
+
+        cedar.delete()
+        self.assertEqual(self.stats(self.floral), (0, None, None))
+
+    def test_unrelated_saves_run_no_refresh(self):
+        cedar = make_product(self.woody, 'Cedar', 30, stock=5)
+        cedar = Product.objects.get(pk=cedar.pk)
+        cedar.stock = 2
+        with mock.patch('perfume_app.category_stats.refresh_category_stats') as refresh:
+            cedar.save()
+        refresh.assert_not_called()
+
+    def test_refresh_recomputes_from_scratch(self):
+        make_product(self.woody, 'Cedar', 30, stock=5)
+        Category.objects.update(product_count=9, min_price=1, max_price=1)
+        self.assertEqual(refresh_category_stats(), 2)
+        self.assertEqual(self.stats(self.woody), (1, 30, 30))
+        self.assertEqual(self.stats(self.floral), (0, None, None))
+
+
+class GuestCartTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Floral')
+        self.rose = make_product(category, 'Rose', 20, stock=5)
+        self.iris = make_product(category, 'Iris', 35, stock=5)
+        self.session = {}
+
+    def test_summary_counts_only_lines_it_prices(self):
+        cart = GuestCart(self.session)
+        cart.add(self.rose.pk, 2)
+        cart.add(self.iris.pk, 1)
+        cart.add(self.iris.pk + 100, 4)
+        self.assertEqual(cart.get_summary(), {'count': 3, 'total': Decimal('75.00')})
+
+        self.iris.is_active = False
+        self.iris.save()
+        self.assertEqual(GuestCart(self.session).get_summary(), {'count': 2, 'total': Decimal('40.00')})
+        self.assertEqual(GuestCart(self.session).get_items_count(), 2)
+
+    def test_every_endpoint_reports_the_same_count(self):
+        add = self.client.post(
+            reverse('add_to_cart'), json.dumps({'product_id': self.iris.pk}), content_type='application/json'
+        )
+        self.assertEqual(add.json()['cart_count'], 1)
+        self.iris.is_active = False
+        self.iris.save()
+        add = self.client.post(
+            reverse('add_to_cart'), json.dumps({'product_id': self.rose.pk, 'quantity': 2}),
+            content_type='application/json',
+        )
+        batch = self.client.post(
+            reverse('cart_batch'), json.dumps({'operations': [{'op': 'add', 'product_id': self.rose.pk}]}),
+            content_type='application/json',
+        )
+        badge = self.client.get(reverse('get_cart_count'))
+        self.assertEqual([add.json()['cart_count'], batch.json()['cart_count'], badge.json()['count']], [2, 3, 3])
+
+
+    def test_login_merges_guest_lines_into_the_user_cart(self):
+        user = User.objects.create(email='shopper@example.com')
+        fill_cart(user, (self.rose, 1))
+        cart = GuestCart(self.session)
+        cart.add(self.rose.pk, 2)
+        cart.add(self.iris.pk, 1)
+        self.iris.is_active = False
+        self.iris.save()
+
+        user_logged_in.send(sender=User, request=mock.Mock(session=self.session), user=user)
+        self.assertEqual(dict(CartItem.objects.filter(cart__user=user).values_list('product_id', 'quantity')), {
+            self.rose.pk: 3,
+        })
+        self.assertEqual(self.session, {})
+        merge_guest_cart(self.session, user)
+        self.assertEqual(CartItem.objects.get(cart__user=user).quantity, 3)
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        category = Category.objects.create(name='Floral')
+        self.products = [make_product(category, f'Scent {i}', 10, stock=5) for i in range(3)]
+        self.products[2].is_active = False
+        self.products[2].save()
+        self.user = User.objects.create(email='shopper@example.com')
+
+    def batch(self, *operations):
+        return self.client.post(
+            reverse('cart_batch'), json.dumps({'operations': list(operations)}), content_type='application/json'
+        )
+
+    def test_operations_fold_into_one_change_per_product(self):
+        rose, iris, gone = self.products
+        for login in (False, True):
+            if login:
+                self.client.force_login(self.user)
+            self.batch({'op': 'add', 'product_id': rose.pk, 'quantity': 4})
+            response = self.batch(
+                {'op': 'add', 'product_id': rose.pk},
+                {'op': 'set', 'product_id': iris.pk, 'quantity': 2},
+                {'op': 'add', 'product_id': iris.pk},
+                {'op': 'add', 'product_id': gone.pk},
+                {'op': 'remove', 'product_id': rose.pk},
+                {'op': 'add', 'product_id': rose.pk, 'quantity': 2},
+            ).json()
+            self.assertEqual(
+                (response['items'], response['skipped'], response['cart_count']),
+                ({str(rose.pk): 2, str(iris.pk): 3}, [gone.pk], 5),
+            )
+        self.assertEqual(CartItem.objects.filter(cart__user=self.user).count(), 2)
+
+    def test_malformed_batches_are_rejected(self):
+        self.assertEqual(self.batch().status_code, 400)
+        self.assertEqual(self.batch({'op': 'swap', 'product_id': 1}).status_code, 400)
+        self.assertEqual(self.batch({'op': 'add', 'product_id': 'x'}).status_code, 400)
+        self.assertEqual(self.batch(*[{'op': 'add', 'product_id': 1}] * 101).status_code, 400)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        category = Category.objects.create(name='Floral')
+        # Equal prices make the id tie-breaker matter
+        self.products = [make_product(category, f'Scent {i}', 10 + i // 2, stock=5) for i in range(5)]
+        self.paginator = KeysetPaginator(Product.objects.all(), 2, ordering=['price', 'id'])
+
+    def test_cursors_walk_forward_and_back(self):
+        pages = [self.paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(self.paginator.get_page(pages[-1].next_cursor))
+        self.assertEqual([product for page in pages for product in page], self.products)
+        self.assertEqual([page.has_previous() for page in pages], [False, True, True])
+
+        back = self.paginator.get_page(pages[2].previous_cursor)
+        self.assertEqual(list(back), list(pages[1]))
+        self.assertTrue(back.has_previous())
+        self.assertEqual(list(self.paginator.get_page(back.previous_cursor)), self.products[:2])
+
+    def test_tampered_or_foreign_cursors_start_over(self):
+        cursor = self.paginator.get_page().next_cursor
+        self.assertEqual(list(self.paginator.get_page(cursor[:-2] + 'xx')), self.products[:2])
+        by_name = KeysetPaginator(Product.objects.all(), 2, ordering=['name', 'id'])
+        self.assertEqual(by_name.decode_cursor(cursor), (None, False))
+        with self.assertRaises(ValueError):
+            KeysetPaginator(Product.objects.all(), 2, ordering=['price'])
+
+    def test_relevance_ordered_search_falls_back_to_offset_pages(self):
+        response = self.client.get(reverse('product_list'), {'q': 'scent', 'cursor': ''})
+        self.assertFalse(getattr(response.context['page_obj'], 'is_keyset', False))
+        response = self.client.get(reverse('product_list'), {'sort': 'name', 'cursor': ''})
+        self.assertTrue(response.context['page_obj'].is_keyset)
+
+
+class HeaderCountsTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        category = Category.objects.create(name='Floral')
+        self.rose = make_product(category, 'Rose', 20, stock=5)
+        self.user = User.objects.create(email='shopper@example.com')
+
+    def request(self, user=None, session=None):
+        request = RequestFactory().get('/')
+        request.user = user or mock.Mock(is_authenticated=False)
+        request.session = session if session is not None else {}
+        return request
+
+    def test_counts_are_lazy_and_cached(self):
+        fill_cart(self.user, (self.rose, 3))
+        Wishlist.objects.create(user=self.user).products.add(self.rose)
+
+        with self.assertNumQueries(0):
+            counts = header_counts(self.request(self.user))
+        self.assertEqual([counts['cart_count'], counts['wishlist_count']], [3, 1])
+        self.assertIn(self.rose.pk, counts['wishlisted_ids'])
+        with self.assertNumQueries(0):
+            counts = header_counts(self.request(self.user))
+            self.assertEqual([counts['cart_count'], counts['wishlist_count']], [3, 1])
+
+    def test_guest_cart_count_comes_from_the_session(self):
+        gone = make_product(self.rose.category, 'Gone', 20, stock=5)
+        gone.is_active = False
+        gone.save()
+        with self.assertNumQueries(0):
+            counts = header_counts(self.request(session={'cart': {str(self.rose.pk): 2, str(gone.pk): 4}}))
+        with self.assertNumQueries(1):
+            self.assertEqual([counts['cart_count'], counts['wishlist_count']], [2, 0])
+        with self.assertNumQueries(0):
+            self.assertEqual(header_counts(self.request())['cart_count'], 0)
+        self.assertEqual(header_counts(self.request())['wishlisted_ids'], frozenset())
+
+
+class WishlistStatusTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        category = Category.objects.create(name='Floral')
+        self.rose = make_product(category, 'Rose', 20, stock=5)
+        self.iris = make_product(category, 'Iris', 35, stock=5)
+        self.user = User.objects.create(email='shopper@example.com')
+        self.client.force_login(self.user)
+
+    def toggle(self, product):
+        response = self.client.post(
+            reverse('toggle_wishlist'), json.dumps({'product_id': product.pk}), content_type='application/json'
+        )
+        return response.json()['is_in_wishlist']
+
+    def status(self, *product_ids):
+        return self.client.get(reverse('wishlist_status'), {'ids': ','.join(map(str, product_ids))})
+
+    def test_status_follows_toggles(self):
+        self.assertTrue(self.toggle(self.rose))
+        self.assertEqual(self.status(self.rose.pk, self.iris.pk, 999).json(), {'wishlisted': [self.rose.pk]})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_wishlisted_ids(self.user.pk), {self.rose.pk})
+
+        self.assertFalse(self.toggle(self.rose))
+        self.assertEqual(self.status(self.rose.pk).json(), {'wishlisted': []})
+        response = self.client.get(reverse('check_wishlist_status', args=[self.rose.pk]))
+        self.assertFalse(response.json()['is_in_wishlist'])
+
+    def test_changes_outside_the_views_drop_the_cached_ids(self):
+        self.toggle(self.rose)
+        wishlist = Wishlist.objects.get(user=self.user)
+        wishlist.products.add(self.iris)
+        self.assertEqual(get_wishlisted_ids(self.user.pk), {self.rose.pk, self.iris.pk})
+        self.rose.delete()
+        self.assertEqual(get_wishlisted_ids(self.user.pk), {self.iris.pk})
+        wishlist.delete()
+        self.assertEqual(get_wishlisted_ids(self.user.pk), frozenset())
+
+    def test_bad_ids_and_guests(self):
+        self.assertEqual(self.status('1', 'x').status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.status(self.rose.pk).json(), {'wishlisted': []})
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        get_cache().clear()
+        self.product = make_product(Category.objects.create(name='Floral'), 'Rose', 20, stock=5)
+
+    def upload(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProductImage.objects.create(product=self.product, image=image_file('rose.png', **kwargs))
+
+    def dimensions(self, field_file, size, fmt):
+        with default_storage.open(derivative_name(field_file.name, size, fmt)) as derivative:
+            return Image.open(derivative).size
+
+    def test_upload_writes_every_derivative_without_upscaling(self):
+        image = self.upload(mode='RGBA').image
+        self.assertEqual(
+            {size: self.dimensions(image, size, 'jpeg') for size in SIZES},
+            {'thumb': (100, 100), 'card': (400, 300), 'detail': (800, 600), 'zoom': (1200, 900)},
+        )
+        self.assertEqual(self.dimensions(image, 'card', 'webp'), (400, 300))
+        self.assertEqual(generate_derivatives(image), 0)
+        self.assertEqual(generate_derivatives(image, sizes=['thumb'], overwrite=True), 2)
+
+    def test_missing_derivatives_are_made_on_first_use(self):
+        image = self.upload().image
+        delete_derivatives(image)
+        name = derivative_name(image.name, 'card', 'webp')
+        self.assertFalse(default_storage.exists(name))
+        self.assertEqual(derivative_url(image, 'card', 'webp'), default_storage.url(name))
+        self.assertTrue(default_storage.exists(name))
+
+    def test_unreadable_images_fall_back_to_the_original(self):
+        image = ProductImage.objects.create(
+            product=self.product, image=SimpleUploadedFile('broken.png', b'not an image', content_type='image/png'),
+        ).image
+        with self.assertLogs('perfume_app.images', 'WARNING'):
+            self.assertEqual(generate_derivatives(image), 0)
+        with self.assertLogs('perfume_app.images', 'WARNING'):
+            self.assertEqual(derivative_url(image, 'thumb'), image.url)
+
+
+class GalleryTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.product = make_product(Category.objects.create(name='Floral'), 'Rose', 20, stock=5)
+
+    def add_image(self, name, **fields):
+        return ProductImage.objects.create(product=self.product, image=image_file(name, size=(10, 10)), **fields)
+
+    def primary(self):
+        self.product.refresh_from_db()
+        return self.product.primary_image.name
+
+    def test_primary_image_follows_the_gallery(self):
+        self.assertEqual(self.primary(), '')
+        second = self.add_image('second.png', order=2)
+        first = self.add_image('first.png', order=1)
+        self.assertEqual(self.primary(), first.image.name)
+
+        second.is_primary = True
+        second.save()
+        self.assertEqual(self.primary(), second.image.name)
+        first.is_primary = True
+        first.save()
+        self.assertFalse(ProductImage.objects.get(pk=second.pk).is_primary)
+        self.assertEqual(self.primary(), first.image.name)
+
+        first.delete()
+        self.assertEqual(self.primary(), second.image.name)
+        second.delete()
+        self.assertEqual(self.primary(), '')
+
+    def test_sync_and_prefetch(self):
+        images = [self.add_image(f'{order}.png', order=order) for order in (3, 1, 2)]
+        Product.objects.update(primary_image='')
+        self.assertEqual(sync_primary_images(), 1)
+        self.assertEqual(self.primary(), images[1].image.name)
+
+        with self.assertNumQueries(2):
+            product = prefetch_gallery(Product.objects.all()).get()
+            self.assertEqual(product.gallery, [images[1], images[2], images[0]])
+
+
+class SimilarProductsTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Woody')
+        self.oud, self.rose, self.citrus = [
+            Product.objects.create(
+                name=name, sku=name.upper(), description=name, category=category, price=50, fragrance_notes=notes,
+            )
+            for name, notes in [
+                ('Oud', 'Top: Saffron, Rose; Base notes - Oud & Amber'),
+                ('Rose', 'rose, saffron, musk'),
+                ('Citrus', 'lemon, neroli'),
+            ]
+        ]
+
+    def similar(self, product):
+        return list(SimilarProduct.objects.filter(product=product).values_list('similar_id', flat=True))
+
+    def test_note_tokens_are_normalized(self):
+        self.assertEqual(note_tokens(self.oud.fragrance_notes), {'saffron', 'rose', 'oud', 'amber'})
+
+    def test_only_products_sharing_a_note_are_listed(self):
+        rebuild_similar_products()
+
+        self.assertEqual(self.similar(self.oud), [self.rose.pk])
+        self.assertEqual(self.similar(self.rose), [self.oud.pk])
+        self.assertEqual(self.similar(self.citrus), [])
+
+    def test_changing_notes_updates_the_lists_involved(self):
+        rebuild_similar_products()
+
+        self.citrus.fragrance_notes = 'lemon, oud'
+        self.citrus.save()
+        # The update is a queued job that only reads the products sharing a note
+        with mock.patch.object(ScentIndex, 'build', side_effect=AssertionError("full rebuild")):
+            work(burst=True)
+
+        self.assertEqual(self.similar(self.citrus), [self.oud.pk])
+        self.assertEqual(self.similar(self.oud), [self.rose.pk, self.citrus.pk])
+
+        self.oud.is_active = False
+        self.oud.save()
+        work(burst=True)
+
+        self.assertEqual(self.similar(self.oud), [])
+        self.assertEqual(self.similar(self.citrus), [])
+        self.assertEqual(self.similar(self.rose), [])
+
+    def test_incremental_updates_match_a_full_rebuild(self):
+        category = self.oud.category
+        for i, notes in enumerate(['rose, musk', 'oud, musk, amber', 'saffron, lemon', 'musk', 'rose, oud']):
+            Product.objects.create(
+                name=f'Blend {i}', sku=f'BLEND-{i}', description='', category=category, price=40,
+                fragrance_notes=notes, intensity=1 + i % 5,
+            )
+            work(burst=True)
+        self.rose.fragrance_notes = 'rose, lemon, amber'
+        self.rose.save()
+        Product.objects.get(name='Blend 3').delete()
+        work(burst=True)
+        incremental = set(SimilarProduct.objects.values_list('product_id', 'similar_id'))
+
+        # Scores stored earlier were weighed by the catalog of the time, so
+        # only the lists' members (none is full here) are sure to agree
+        rebuild_similar_products()
+        self.assertEqual(set(SimilarProduct.objects.values_list('product_id', 'similar_id')), incremental)
+
+
+class NoteIndexTests(TestCase):
+    def test_tiers_come_from_labels_or_three_sections(self):
+        self.assertEqual(
+            parse_notes('Top: Bergamot, Pink  Pepper; base notes - Musk & amber.'),
+            [('bergamot', 'top'), ('pink pepper', 'top'), ('musk', 'base'), ('amber', 'base')],
+        )
+        self.assertEqual(
+            parse_notes('lemon\nrose, jasmine\nvanilla'),
+            [('lemon', 'top'), ('rose', 'middle'), ('jasmine', 'middle'), ('vanilla', 'base')],
+        )
+        self.assertEqual(parse_notes('oud, rose'), [('oud', ''), ('rose', '')])
+
+    def test_accents_are_dropped_from_slugs(self):
+        category = Category.objects.create(name='Gourmand')
+        for name, notes in [('Latte', 'Café, Crème'), ('Espresso', 'cafe'), ('Oud', 'عود')]:
+            Product.objects.create(
+                name=name, sku=name.upper(), description=name, category=category, price=50, fragrance_notes=notes,
+            )
+        self.assertEqual(set(Note.objects.values_list('slug', 'product_count')), {('cafe', 2), ('creme', 1), ('عود', 1)})
+        self.assertEqual(filter_by_notes(Product.objects.all(), ['cafe']).count(), 2)
+
+    def test_filter_keeps_products_with_every_note(self):
+        category = Category.objects.create(name='Woody')
+        oud_rose, oud, _ = [
+            Product.objects.create(
+                name=name, sku=name.upper(), description=name, category=category, price=50, fragrance_notes=notes,
+            )
+            for name, notes in [('Oud Rose', 'Oud, Rose, Amber'), ('Oud', 'oud, leather'), ('Rose', 'rose')]
+        ]
+
+        products = Product.objects.all()
+        self.assertEqual(list(filter_by_notes(products, ['oud', 'rose'])), [oud_rose])
+        self.assertEqual(set(filter_by_notes(products, ['oud'])), {oud_rose, oud})
+        self.assertEqual(list(filter_by_notes(products, ['oud', 'unknown'])), [])
+
+        oud.fragrance_notes = 'rose, oud'
+        oud.save()
+        self.assertEqual(set(filter_by_notes(products, ['oud', 'rose'])), {oud_rose, oud})
+        self.assertEqual(ProductNote.objects.filter(product=oud).count(), 2)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.woody = Category.objects.create(name='Woody')
+        self.floral = Category.objects.create(name='Floral')
+        self.rose_oud = make_product(self.woody, 'Rose Oud', 80, 5)
+        self.oud = make_product(self.woody, 'Oud Noir', 90, 5)
+        self.rose = make_product(self.floral, 'Rose Water', 40, 5)
+
+    def test_filters_apply_to_every_match_before_and_after_ranking(self):
+        woody = Product.objects.filter(category=self.woody)
+        self.assertEqual(set(search_products(woody, 'oud')), {self.oud, self.rose_oud})
+        self.assertEqual(list(search_products(Product.objects.all(), 'rose').filter(price__lt=50)), [self.rose])
+
+        self.rose.is_active = False
+        self.rose.save()
+        matches = search_products(Product.objects.filter(is_active=True), 'rose')
+        self.assertEqual(list(matches), [self.rose_oud])
+        self.assertEqual(list(matches.values_list('pk', flat=True)), [self.rose_oud.pk])
+
+    def test_catalog_search_counts_only_filtered_matches(self):
+        response = self.client.get(reverse('product_list'), {'q': 'rose', 'category': self.woody.pk})
+        self.assertEqual(list(response.context['page_obj']), [self.rose_oud])
+        self.assertEqual(response.context['result_count'], 1)
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.category = Category.objects.create(name='Woody')
+        self.url = reverse('category_detail', args=[self.category.slug])
+
+    def test_query_is_normalized_and_escaped(self):
+        self.assertEqual(
+            normalize_query(QueryDict('sort=price&utm_source=mail&q=rose&sort=price&page=&gclid=x')),
+            normalize_query(QueryDict('q=rose&sort=price')),
+        )
+        self.assertNotEqual(normalize_query(QueryDict('a=x%26b%3Dy')), normalize_query(QueryDict('a=x&b=y')))
+
+    def test_escaped_query_gets_its_own_page(self):
+        self.client.get(self.url, {'page': '2&sort=name'})
+        response = self.client.get(self.url + '?page=2&sort=name')
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+
+    def test_pages_are_served_until_a_tag_is_invalidated(self):
+        self.assertEqual(self.client.get(self.url)['X-Page-Cache'], 'MISS')
+        self.assertEqual(self.client.get(self.url, {'utm_source': 'mail'})['X-Page-Cache'], 'HIT')
+
+        invalidate('products')
+        self.assertEqual(self.client.get(self.url)['X-Page-Cache'], 'MISS')
+        self.assertEqual(self.client.get(self.url)['X-Page-Cache'], 'HIT')
+
+        self.category.description = 'Cedar and oud'
+        self.category.save()
+        self.assertEqual(self.client.get(self.url)['X-Page-Cache'], 'MISS')
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.category = Category.objects.create(name='Woody')
+        self.cheap = make_product(self.category, 'Cedar', 30, stock=5)
+        self.dear = make_product(self.category, 'Oud', 250, stock=5)
+
+    def test_bad_category_is_ignored(self):
+        response = self.client.get(reverse('product_list'), {'category': 'abc'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['result_count'], 2)
+        self.assertEqual(self.client.get(reverse('product_facets'), {'category': '1 OR 1'}).json()['total'], 2)
+
+    def test_index_is_rebuilt_only_when_what_it_holds_changes(self):
+        with mock.patch.object(FacetIndex, 'build', side_effect=FacetIndex.build) as build:
+            self.assertEqual(facet_counts({}, self.category.pk)['facets']['price']['0-50'], 1)
+            self.cheap.stock = 1
+            self.cheap.save()
+            facet_counts({})
+            self.assertEqual(build.call_count, 1)
+
+            self.dear.price = 40
+            self.dear.save()
+            self.assertEqual(facet_counts({})['facets']['price']['0-50'], 2)
+            self.assertEqual(build.call_count, 2)
+
+    def test_page_links_keep_the_filters(self):
+        for i in range(14):
+            make_product(self.category, f'Rose {i}', 20, stock=5)
+        Product.objects.filter(name__startswith='Rose').update(gender='W')
+
+        params = {'gender': 'W', 'sort': 'price_low'}
+        response = self.client.get(reverse('product_list'), params)
+        first = response.context['page_obj']
+        self.assertIn('gender=W', first.next_url)
+        self.assertContains(response, f'href="{escape(first.next_url)}"', count=2)
+        self.assertEqual(dict(first.page_links)[2], first.next_url)
+        second = self.client.get(reverse('product_list') + first.next_url).context['page_obj']
+        self.assertEqual(second.number, 2)
+        self.assertEqual({product.gender for product in second}, {'W'})
+        self.assertEqual(len(first) + len(second), 14)
+        self.assertIn('gender=W', second.previous_url)
+
+        Product.objects.filter(name__startswith='Rose').update(fragrance_notes='vanilla, musk')
+        index_product_notes()
+        response = self.client.get(reverse('product_list'), {'note': 'vanilla', 'sort': 'price_low'})
+        second = self.client.get(reverse('product_list') + response.context['page_obj'].next_url).context['page_obj']
+        self.assertEqual(len(second), 2)
+        self.assertIn('note=vanilla', second.previous_url)
+
+
+class AlsoBoughtTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='buyer@example.com')
+        category = Category.objects.create(name='Floral')
+        self.products = [make_product(category, f'Scent {i}', 10, stock=5) for i in range(4)]
+
+    def place(self, *baskets):
+        for basket in baskets:
+            order = Order.objects.create(user=self.user, subtotal=10, total=10, **ORDER_FIELDS)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=self.products[i], quantity=1, price=10) for i in basket
+            ])
+        # Only settled orders are read
+        Order.objects.update(created_at=timezone.now() - timedelta(hours=1))
+
+    def state(self):
+        return (
+            sorted(CoPurchaseCount.objects.values_list('product_id', 'other_id', 'orders')),
+            sorted(AlsoBoughtProduct.objects.values_list('product_id', 'recommended_id', 'rank')),
+        )
+
+    def test_incremental_updates_match_a_full_rebuild(self):
+        self.place((0, 1), (0, 1, 2), (0, 2))
+        self.assertEqual(update_also_bought(), (3, 3))
+        self.place((0, 1), (1, 2), (2, 3), (2, 3))
+        update_also_bought()
+        self.assertEqual(update_also_bought(), (0, 0))
+        incremental = self.state()
+
+        update_also_bought(full=True)
+        self.assertEqual(self.state(), incremental)
+
+    def test_lists_rank_by_cosine_and_skip_rare_pairs(self):
+        self.place((0, 1), (0, 1), (0, 2), (0, 2), (0, 2), (2,), (2,), (2,), (0, 3))
+        update_also_bought()
+
+        # 0 & 1: 2 / sqrt(6 * 2) beats 0 & 2: 3 / sqrt(6 * 6); 0 & 3 was bought together once
+        self.assertEqual(also_bought_products([self.products[0].pk]), [self.products[1], self.products[2]])
+        self.assertEqual(also_bought_products([self.products[0].pk, self.products[1].pk]), [self.products[2]])
+
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Floral')
+
+    def run_import(self, *rows, **options):
+        importer = CatalogImporter(**options)
+        importer.import_chunk(enumerate(rows, 2))
+        importer.finish()
+        return importer
+
+    def test_upsert_creates_then_updates_only_the_columns_given(self):
+        self.run_import(
+            {'sku': 'ROSE-50', 'name': 'Rose', 'category': 'floral', 'price': '50', 'size': '50', 'stock': '7',
+             'fragrance_notes': 'rose, musk'},
+            {'name': 'Iris', 'category': 'Floral', 'price': '30'},
+        )
+        rose = Product.objects.get(sku='ROSE-50')
+        self.assertEqual((rose.slug, rose.stock, str(rose.cost_per_ml)), ('rose', 7, '1.00'))
+        self.assertEqual(set(rose.notes.values_list('slug', flat=True)), {'rose', 'musk'})
+        self.assertTrue(Product.objects.filter(sku=Product.build_sku('Floral', 'Iris', 100), slug='iris').exists())
+
+        importer = self.run_import({'sku': 'ROSE-50', 'name': 'Rose Absolue', 'category': 'Floral', 'price': '60'})
+        self.assertEqual((importer.created, importer.updated), (0, 1))
+        rose.refresh_from_db()
+        self.assertEqual((rose.name, rose.slug, rose.price, rose.stock, rose.size), ('Rose Absolue', 'rose', 60, 7, 50))
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_bad_rows_are_reported_and_dry_run_writes_nothing(self):
+        importer = self.run_import(
+            {'name': 'Rose', 'category': 'Floral', 'price': 'free'},
+            {'name': 'Oud', 'category': 'Woody', 'price': '80'},
+            {'name': 'Iris', 'category': 'Floral', 'price': '30', 'size': '33'},
+            {'name': 'Musk', 'category': 'Floral', 'price': '20'},
+            dry_run=True,
+        )
+        self.assertEqual([line for line, _ in importer.errors], [2, 3, 4])
+        self.assertEqual((importer.created, importer.updated), (1, 0))
+        self.assertFalse(Product.objects.exists())
+
+    def test_colliding_derived_skus_are_errors_not_merges(self):
+        make_product(self.category, 'Rose Noir', 50, stock=3)
+        Product.objects.filter(name='Rose Noir').update(sku=Product.build_sku('Floral', 'Rose Noir', 100))
+        importer = self.run_import(
+            {'name': 'Rosewood', 'category': 'Floral', 'price': '40'},
+            {'name': 'Lily', 'category': 'Floral', 'price': '30'},
+            {'name': 'Lilac', 'category': 'Floral', 'price': '35'},
+            {'name': 'Rose Noir', 'category': 'Floral', 'price': '55'},
+        )
+        self.assertEqual([line for line, _ in importer.errors], [2, 4])
+        self.assertEqual(
+            sorted(Product.objects.values_list('name', 'price')), [('Lily', 30), ('Rose Noir', 55)]
+        )
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='buyer@example.com')
+        category = Category.objects.create(name='Citrus')
+        self.products = [make_product(category, f'Citrus {i}', 15, stock=5) for i in range(3)]
+        self.orders = []
+        for lines in [(0, 1), (2,)]:
+            order = Order.objects.create(user=self.user, subtotal=15, total=15, **ORDER_FIELDS)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=self.products[i], quantity=1, price=15) for i in lines
+            ])
+            self.orders.append(order)
+
+    def test_orders_are_read_with_their_items_in_one_query(self):
+        with self.assertNumQueries(1):
+            records = [json.loads(line) for block in export_lines('orders', 'jsonl') for line in block.splitlines()]
+        self.assertEqual([record['order_number'] for record in records], [order.order_number for order in self.orders])
+        self.assertEqual([item['sku'] for item in records[0]['items']], ['CITRUS 0', 'CITRUS 1'])
+        self.assertEqual(records[0]['total'], '15.00')
+
+        with self.assertNumQueries(1):
+            rows = list(csv.reader(''.join(export_lines('orders', 'csv')).splitlines()))
+        self.assertEqual(len(rows), 1 + 3)
+        self.assertEqual(rows[0][-4:], ['item_sku', 'item_product', 'item_quantity', 'item_price'])
+
+    def test_admin_action_streams_the_selected_rows(self):
+        admin_user = User.objects.create(email='admin@example.com', is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+        response = self.client.post(reverse('admin:perfume_app_product_changelist'), {
+            'action': 'export_csv',
+            '_selected_action': [self.products[0].pk, self.products[2].pk],
+        })
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="products-', response['Content-Disposition'])
+        rows = list(csv.DictReader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual([row['sku'] for row in rows], ['CITRUS 0', 'CITRUS 2'])
+
+    def test_command_writes_to_its_stdout(self):
+        out = StringIO()
+        call_command('export_data', 'orders', format='jsonl', stdout=out)
+        self.assertEqual(out.getvalue(), ''.join(export_lines('orders', 'jsonl')))
+        self.assertEqual(len(out.getvalue().splitlines()), len(self.orders))
+
+
+RAN_JOBS = []
+
+
+def record_job(label):
+    RAN_JOBS.append(label)
+
+
+def failing_job():
+    raise ConnectionError("SMTP server unreachable")
+
+
+def outlasting_job():
+    # Age the lock past LOCK_TIMEOUT, as a long run would, then give the
+    # heartbeat a few beats before another worker tries to claim the job
+    Job.objects.update(locked_at=timezone.now() - LOCK_TIMEOUT - timedelta(minutes=1))
+    time.sleep(0.3)
+    RAN_JOBS.append(claim('other-worker'))
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        RAN_JOBS.clear()
+
+    def test_jobs_run_by_priority_and_are_removed_when_done(self):
+        enqueue(record_job, label='routine')
+        enqueue('perfume_app.tests.record_job', label='urgent', priority=10)
+        enqueue(record_job, label='later', delay=timedelta(hours=1))
+
+        self.assertEqual(work(burst=True), 2)
+        self.assertEqual(RAN_JOBS, ['urgent', 'routine'])
+        self.assertEqual(list(Job.objects.values_list('kwargs', flat=True)), [{'label': 'later'}])
+
+    def test_failures_are_retried_with_backoff_then_kept(self):
+        job = enqueue(failing_job, max_attempts=2)
+
+        with self.assertLogs('perfume_app.jobs', 'ERROR'):
+            self.assertEqual(work(burst=True), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now() + RETRY_DELAY - timedelta(seconds=5))
+        self.assertEqual(work(burst=True), 0)
+
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs('perfume_app.jobs', 'ERROR'):
+            work(burst=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.locked_by), (Job.FAILED, 2, ''))
+        self.assertIn('SMTP server unreachable', job.last_error)
+
+        retry(Job.objects.all())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 0))
+
+    @override_settings(CONTACT_EMAIL='owner@example.com')
+    def test_contact_form_queues_its_email(self):
+        response = self.client.post(reverse('contact'), {
+            'name': 'Ada', 'email': 'ada@example.com', 'subject': 'order', 'message': 'Where is my order?',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+
+        work(burst=True)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].reply_to, ['ada@example.com'])
+
+    def test_password_reset_job_holds_no_reset_link(self):
+        user = User.objects.create(email='forgetful@example.com')
+        user.set_password('old-password')
+        user.save()
+        self.client.post(reverse('password_reset'), {'email': user.email})
+
+        job = Job.objects.get()
+        self.assertEqual(job.kwargs['user_id'], user.pk)
+        self.assertNotIn('token', json.dumps(job.kwargs))
+        self.assertNotIn('password-reset-confirm', json.dumps(job.kwargs))
+
+        work(burst=True)
+        self.assertEqual(mail.outbox[0].to, [user.email])
+        link = re.search(r'https?://[^"\s<]*password-reset-confirm/[^"\s<]+', mail.outbox[0].body).group()
+        response = self.client.get(link, follow=True)
+        self.assertContains(response, 'new_password1')
+
+
+class JobHeartbeatTests(TransactionTestCase):
+    def setUp(self):
+        RAN_JOBS.clear()
+
+    @mock.patch('perfume_app.jobs.HEARTBEAT_INTERVAL', timedelta(seconds=0.05))
+    def test_running_job_is_not_claimed_again(self):
+        enqueue(outlasting_job)
+
+        self.assertEqual(work(worker='first-worker', burst=True), 1)
+        self.assertEqual(RAN_JOBS, [None])
+        self.assertFalse(Job.objects.exists())
+
+
+class NewsletterTests(TestCase):
+    def setUp(self):
+        self.subscribers = [subscribe(f'reader{i}@example.com') for i in range(5)]
+        NewsletterSubscriber.objects.filter(pk=self.subscribers[1].pk).update(is_active=False)
+        self.campaign = Campaign.objects.create(
+            subject='Autumn scents',
+            body_text='Hi {{ email }}, see {{ site_url }}. Unsubscribe: {{ unsubscribe_url }}',
+            body_html='<p>Hi {{ email }}</p><a href="{{ unsubscribe_url }}">Unsubscribe</a>',
+        )
+
+    @mock.patch('perfume_app.newsletters.BATCH_SIZE', 2)
+    def test_each_active_subscriber_gets_one_personalized_message(self):
+        start_campaign(self.campaign.pk)
+        self.assertEqual(self.campaign.batches.count(), 2)
+        work(burst=True)
+
+        active = [subscriber for subscriber in self.subscribers if subscriber.pk != self.subscribers[1].pk]
+        self.assertEqual([message.to for message in mail.outbox], [[subscriber.email] for subscriber in active])
+        message, subscriber = mail.outbox[0], active[0]
+        link = unsubscribe_url(subscriber.token)
+        self.assertEqual(message.body, f'Hi {subscriber.email}, see {settings.SITE_URL}. Unsubscribe: {link}')
+        self.assertEqual(message.extra_headers['List-Unsubscribe'], f'<{link}>')
+        self.assertEqual(message.extra_headers['List-Unsubscribe-Post'], 'List-Unsubscribe=One-Click')
+        self.assertEqual(message.alternatives[0][0], f'<p>Hi {subscriber.email}</p><a href="{link}">Unsubscribe</a>')
+
+        self.campaign.refresh_from_db()
+        self.assertEqual(
+            (self.campaign.status, self.campaign.recipient_count, self.campaign.sent_count), (Campaign.SENT, 4, 4)
+        )
+
+    def test_a_retried_batch_carries_on_where_it_stopped(self):
+        start_campaign(self.campaign.pk)
+        # As if the job died after mailing the first chunk
+        self.campaign.batches.update(position=self.subscribers[2].pk, sent_count=2)
+
+        work(burst=True)
+        self.assertEqual([message.to for message in mail.outbox], [[s.email] for s in self.subscribers[3:]])
+        self.assertEqual(self.campaign.batches.get().sent_count, 4)
+
+    def test_unsubscribe_link_asks_before_unsubscribing(self):
+        url = reverse('newsletter_unsubscribe', args=[self.subscribers[0].token])
+        self.assertContains(self.client.get(url), 'Stop sending our newsletter')
+        self.assertTrue(NewsletterSubscriber.objects.get(pk=self.subscribers[0].pk).is_active)
+
+        self.client.post(url)
+        self.assertFalse(NewsletterSubscriber.objects.get(pk=self.subscribers[0].pk).is_active)
+
+    def test_recipient_variables_take_no_filters(self):
+        self.campaign.body_text = 'Hi {{ email|upper }}, {% if site_url %}{{ unsubscribe_url|urlencode }}{% endif %}'
+        self.campaign.body_html = '<p>{{ email.domain }} {{ site_url|upper }}</p>'
+        with self.assertRaises(ValidationError) as raised:
+            self.campaign.full_clean()
+        self.assertEqual(
+            {field: len(messages) for field, messages in raised.exception.message_dict.items()},
+            {'body_text': 2, 'body_html': 1},
+        )
+        self.campaign.save()
+        with self.assertRaises(ValueError):
+            start_campaign(self.campaign.pk)
+        self.assertEqual(Job.objects.count(), 0)
+
+    def test_rendered_campaigns_are_kept_for_a_few_campaigns(self):
+        campaigns = [
+            Campaign.objects.create(subject=f'Issue {number}', body_text='Hi {{ email }}')
+            for number in range(MESSAGE_CACHE_SIZE + 2)
+        ]
+        for campaign in campaigns:
+            campaign_message(campaign)
+        campaign_message(campaigns[0])
+        self.assertLessEqual(len(newsletters._messages), MESSAGE_CACHE_SIZE)
+        self.assertIn((campaigns[0].pk, campaigns[0].updated_at), newsletters._messages)
+
+    def test_one_click_unsubscribe_needs_no_page_or_csrf_token(self):
+        url = reverse('newsletter_unsubscribe', args=[self.subscribers[2].token])
+        response = Client(enforce_csrf_checks=True).post(url, {'List-Unsubscribe': 'One-Click'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(NewsletterSubscriber.objects.get(pk=self.subscribers[2].pk).is_active)
+
+
+# Orders are read as soon as they are saved
+@mock.patch('perfume_app.sales_rollups.SETTLE_TIME', timedelta(0))
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='buyer@example.com')
+        self.categories = [Category.objects.create(name='Floral'), Category.objects.create(name='Woody')]
+        self.products = [make_product(self.categories[i % 2], f'Scent {i}', 10, stock=50) for i in range(3)]
+
+    def place(self, days_ago, *lines, payment_method='cod'):
+        """An order placed days_ago days ago with (product index, quantity, price) lines"""
+        order = Order.objects.create(
+            user=self.user, subtotal=0, total=0, **{**ORDER_FIELDS, 'payment_method': payment_method}
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=self.products[i], quantity=quantity, price=price)
+            for i, quantity, price in lines
+        ])
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        order.refresh_from_db()
+        return order
+
+    def state(self):
+        fields = ('day', 'orders', 'units', 'revenue')
+        return (
+            sorted(DailySales.objects.values_list('payment_method', *fields)),
+            sorted(DailyCategorySales.objects.values_list('category_id', *fields)),
+            sorted(DailyProductSales.objects.values_list('product_id', *fields)),
+        )
+
+    def test_incremental_updates_match_a_full_rebuild(self):
+        self.place(3, (0, 2, 10), (1, 1, 12))
+        self.place(3, (0, 1, 10), payment_method='credit_card')
+        self.place(1, (2, 4, 8))
+        self.assertEqual(update_sales_rollups(), (3, 2))
+        self.place(1, (0, 1, 9))
+        self.place(0, (1, 3, 12))
+        self.assertEqual(update_sales_rollups(), (2, 2))
+        self.assertEqual(update_sales_rollups(), (0, 0))
+        incremental = self.state()
+
+        update_sales_rollups(full=True)
+        self.assertEqual(self.state(), incremental)
+        three_days_ago = (timezone.now() - timedelta(days=3)).date()
+        day = DailyProductSales.objects.get(day=three_days_ago, product=self.products[0])
+        self.assertEqual((day.orders, day.units, str(day.revenue)), (2, 3, '30.00'))
+
+    def test_a_late_cancellation_leaves_its_day(self):
+        order = self.place(30, (0, 2, 10))
+        self.place(30, (1, 1, 12))
+        update_sales_rollups()
+
+        order.status = 'cancelled'
+        order.save()
+        self.assertEqual(update_sales_rollups(), (1, 1))
+        day = DailySales.objects.get()
+        self.assertEqual((day.orders, day.units, str(day.revenue)), (1, 1, '12.00'))
+        self.assertFalse(DailyProductSales.objects.filter(product=self.products[0]).exists())
+
+    def test_dashboard_reads_the_rollups(self):
+        self.place(2, (0, 2, 10), (1, 1, 12))
+        update_sales_rollups()
+        admin_user = User.objects.create(email='admin@example.com', is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+
+        response = self.client.get(reverse('admin:perfume_app_dailysales_changelist'), {'days': 30})
+        self.assertContains(response, 'Sales dashboard')
+        self.assertEqual(response.context['totals']['revenue'], 32)
+        self.assertEqual(len(response.context['series']), 30)
+        self.assertEqual([row['label'] for row in response.context['top_products']], ['Scent 0', 'Scent 1'])
+
+
+class RankingTests(TestCase):
+    def setUp(self):
+        # Drop counts other tests left in this process
+        activity.flush()
+        category = Category.objects.create(name='Floral')
+        self.products = [make_product(category, f'Scent {i}', 10, stock=50) for i in range(4)]
+        Product.objects.filter(pk=self.products[3].pk).update(is_best_seller=True)
+
+    def sold(self, product, units, days_ago=1):
+        DailyProductSales.objects.create(
+            day=timezone.localdate() - timedelta(days=days_ago), product=product,
+            orders=1, units=units, revenue=units * 10,
+        )
+
+    def flags(self):
+        return {
+            flag: set(Product.objects.filter(**{flag: True}).values_list('name', flat=True))
+            for flag in ('is_best_seller', 'is_trending')
+        }
+
+    def test_best_sellers_rank_by_units_in_the_window(self):
+        self.sold(self.products[0], 3)
+        self.sold(self.products[1], 5)
+        self.sold(self.products[1], 1, days_ago=5)
+        self.sold(self.products[2], 50, days_ago=40)
+
+        self.assertEqual(update_rankings(), ({RankedProduct.BEST_SELLERS: 2, RankedProduct.TRENDING: 0}, 3))
+        self.assertEqual(self.flags(), {'is_best_seller': {'Scent 0', 'Scent 1'}, 'is_trending': set()})
+        self.assertEqual(update_rankings()[1], 0)
+
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.context['best_selling_products'], [self.products[1], self.products[0]])
+
+    def test_flush_adds_counters_with_batched_upserts(self):
+        today = timezone.localdate()
+        ProductActivity.objects.create(day=today, product=self.products[0], views=4, cart_adds=1)
+        for product in self.products:
+            activity.record_view(product.pk)
+        activity.record_cart_add(self.products[0].pk)
+        with mock.patch('perfume_app.activity.UPSERT_BATCH', 2), self.assertNumQueries(3):
+            self.assertEqual(activity.flush(), len(self.products))
+        self.assertEqual(
+            sorted(ProductActivity.objects.filter(day=today).values_list('views', 'cart_adds')),
+            sorted([(5, 2)] + [(1, 0)] * (len(self.products) - 1)),
+        )
+
+    def test_trending_follows_views_and_cart_adds(self):
+        with mock.patch('perfume_app.activity.FLUSH_SIZE', 1):
+            for _ in range(30):
+                self.client.get(reverse('product_detail', args=[self.products[2].slug]))
+            self.client.post(
+                reverse('add_to_cart'), json.dumps({'product_id': self.products[1].pk}), content_type='application/json'
+            )
+        self.assertEqual(ProductActivity.objects.get(product=self.products[2]).views, 30)
+        self.assertEqual(ProductActivity.objects.get(product=self.products[1]).cart_adds, 1)
+        # The same attention every day for a month isn't a trend
+        today = timezone.localdate()
+        ProductActivity.objects.create(day=today - timedelta(days=10), product=self.products[0], views=900)
+        ProductActivity.objects.create(day=today, product=self.products[0], views=30)
+        ProductActivity.objects.filter(product=self.products[1]).update(cart_adds=5)
+
+        update_rankings()
+        trending = RankedProduct.objects.filter(ranking=RankedProduct.TRENDING).values_list('product__name', flat=True)
+        self.assertEqual(list(trending), ['Scent 2', 'Scent 1'])
+        self.assertEqual(self.flags()['is_trending'], {'Scent 1', 'Scent 2'})
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    buyers = 12
+
+    def test_last_unit_is_sold_once(self):
+        category = Category.objects.create(name='Woody')
+        product = make_product(category, 'Last Bottle', 99, stock=1)
+        users = [User.objects.create(email=f'buyer{i}@example.com') for i in range(self.buyers)]
+        for user in users:
+            fill_cart(user, (product, 1))
+
+        barrier = threading.Barrier(self.buyers)
+        outcomes = []
+
+        def checkout(user):
+            try:
+                barrier.wait()
+                place_order(user, **ORDER_FIELDS)
+                outcomes.append('ordered')
+            except OutOfStockError:
+                outcomes.append('out of stock')
+
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(outcomes.count('ordered'), 1)
+        self.assertEqual(outcomes.count('out of stock'), self.buyers - 1)
+        self.assertEqual(OrderItem.objects.filter(product=product).count(), 1)
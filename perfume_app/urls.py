@@ -12,6 +12,7 @@ from .views import (
 urlpatterns = [
     path('', views.home, name='home'),
     path('products/', views.product_list, name='product_list'),
+    path('products/facets/', views.product_facets, name='product_facets'),
     path('products/<slug:slug>/', views.product_detail, name='product_detail'),
     path('products/<int:product_id>/quick-view/', views.product_quick_view, name='product_quick_view'),
     path('products/<int:product_id>/review/', views.add_review, name='add_review'),
@@ -23,10 +24,12 @@ urlpatterns = [
     path('cart/add/', views.add_to_cart, name='add_to_cart'),
     path('cart/update/', views.update_cart_item, name='update_cart_item'),
     path('cart/remove/', views.remove_from_cart, name='remove_from_cart'),
+    path('cart/batch/', views.cart_batch, name='cart_batch'),
 
     path('wishlist/', views.wishlist_view, name='wishlist'),
     path('wishlist/toggle/', views.toggle_wishlist, name='toggle_wishlist'),
     path('wishlist/check/<int:product_id>/', views.check_wishlist_status, name='check_wishlist_status'),
+    path('wishlist/status/', views.wishlist_status, name='wishlist_status'),
 
     path('checkout/', views.checkout, name='checkout'),
     path('checkout/confirmation/<int:order_id>/', views.order_confirmation, name='order_confirmation'),
@@ -39,6 +42,7 @@ urlpatterns = [
 
     path('search/', views.search, name='search'),
     path('newsletter/subscribe/', views.newsletter_subscribe, name='newsletter_subscribe'),
+    path('newsletter/unsubscribe/<str:token>/', views.newsletter_unsubscribe, name='newsletter_unsubscribe'),
 
     # API endpoints
     path('api/cart/count/', views.get_cart_count, name='get_cart_count'),
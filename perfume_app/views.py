@@ -2,25 +2,42 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
-from django.core.paginator import Paginator
-from django.db.models import Q, Avg
+from django.http import Http404, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.views.generic import ListView, DetailView
 from django.utils import timezone
 from datetime import timedelta
 import json
-from django.core.mail import send_mail
 from django.conf import settings
 
-from .forms import ContactForm
-from .models import Contact
+from .forms import ContactForm, QueuedPasswordResetForm
+from . import tasks
+from .jobs import enqueue
+from .models import Contact, NewsletterSubscriber
+from .newsletters import subscribe
+from .search import search_products
+from .also_bought import also_bought_products
+from .activity import record_cart_add, record_view
+from .rankings import ranked_products
+from .gallery import prefetch_gallery
+from .notes import filter_by_notes, notes_by_tier, selected_notes
+from .facets import (
+    apply_facet_filters, clear_facets_url, facet_counts, facet_sidebar, parse_facet_filters,
+)
+from .pagination import paginate
+from .orders import CheckoutError, place_order, reorder as reorder_to_cart
+from .carts import (
+    GuestCart, apply_cart_operations, fold_operations, get_cart_summary, get_request_cart_summary,
+)
+from .wishlists import get_wishlist_count, get_wishlisted_ids, remember_wishlisted_ids
+from .page_cache import cache_anonymous_page, cache_depends, cached_value, set_page_meta
 
-from .models import Category, Product, Cart, CartItem, Wishlist, Order, OrderItem, Review
+from .models import Category, Product, Cart, CartItem, Wishlist, Order, RankedProduct, Review, SimilarProduct
 from .forms import CheckoutForm, ReviewForm, NewsletterForm
 
 
-from django.contrib.auth import login, authenticate
+from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.views import (
     PasswordResetView, PasswordResetDoneView,
     PasswordResetConfirmView, PasswordResetCompleteView
@@ -37,10 +54,36 @@ from django.views.decorators.http import require_POST
 from django.http import JsonResponse
 
 
+# Every listing order ends with the primary key so keyset pagination has a
+# stable tie-breaker between products sharing a price, name or rating.
+PRODUCT_SORTS = {
+    'name': ('name', 'id'),
+    'price_low': ('price', 'id'),
+    'price_high': ('-price', '-id'),
+    'newest': ('-created_at', '-id'),
+    'rating': ('-avg_rating', '-id'),
+}
+
+
+@cache_anonymous_page(tags=['products', 'categories', 'rankings'], skip_session_keys=['recently_viewed'])
 def home(request):
-    """Homepage view with featured and best-selling products"""
-    featured_products = Product.objects.filter(is_featured=True, is_active=True)[:8]
-    best_selling_products = Product.objects.filter(is_best_seller=True, is_active=True)[:8]
+    """Homepage view with featured, best-selling and trending products"""
+    featured_products = cached_value(
+        'home:featured',
+        lambda: list(Product.objects.filter(is_featured=True, is_active=True)[:8]),
+        tags=['products'],
+    )
+    # Rankings are precomputed in order by the update_rankings command
+    best_selling_products = cached_value(
+        'home:best_sellers',
+        lambda: ranked_products(RankedProduct.BEST_SELLERS),
+        tags=['products', 'rankings'],
+    )
+    trending_products = cached_value(
+        'home:trending',
+        lambda: ranked_products(RankedProduct.TRENDING),
+        tags=['products', 'rankings'],
+    )
     categories = Category.objects.filter(is_active=True)[:4]
 
     recently_viewed_ids = request.session.get('recently_viewed', [])
@@ -49,81 +92,124 @@ def home(request):
     context = {
         'featured_products': featured_products,
         'best_selling_products': best_selling_products,
+        'trending_products': trending_products,
         'categories': categories,
         'recently_viewed': recently_viewed,
     }
     return render(request, 'perfumelux/home.html', context)
 
 
-def product_list(request):
-    """Display all products with filtering and sorting options"""
+def _catalog(request):
+    """Active products narrowed by ?category=, ?note= and ?q=, before facets and sorting
+
+    Also returns the ids of the products left when ?note= or ?q= narrowed
+    them, for the facet counts, else None.
+    """
     products = Product.objects.filter(is_active=True)
+    # A ?category= that isn't an id is ignored rather than a server error
     category_id = request.GET.get('category')
-    sort = request.GET.get('sort', 'name')
+    category_id = int(category_id) if category_id and category_id.isdigit() else None
+    note_slugs = request.GET.getlist('note')
     query = request.GET.get('q')
 
     # Filter by category
     if category_id:
         products = products.filter(category__id=category_id)
 
-    # Search functionality
+    # Filter by notes (every one of them)
+    if note_slugs:
+        products = filter_by_notes(products, note_slugs)
+
+    # Search functionality (results come back best match first)
     if query:
-        products = products.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(category__name__icontains=query)
-        )
+        products = search_products(products, query)
+    product_ids = products.values_list('pk', flat=True) if query or note_slugs else None
+    return products, category_id, query, product_ids
+
+
+@cache_anonymous_page(tags=['products', 'categories'])
+def product_list(request):
+    """Display all products with filtering and sorting options"""
+    products, category_id, query, product_ids = _catalog(request)
+    sort = request.GET.get('sort', 'relevance' if query else 'name')
+
+    # Facets (gender, size, price...) and their counts
+    filters = parse_facet_filters(request.GET)
+    counts = facet_counts(filters, category_id, product_ids)
+    products = apply_facet_filters(products, filters)
 
     # Sorting options
-    if sort == 'price_low':
-        products = products.order_by('price')
-    elif sort == 'price_high':
-        products = products.order_by('-price')
-    elif sort == 'newest':
-        products = products.order_by('-created_at')
-    elif sort == 'rating':
-        products = products.annotate(avg_rating=Avg('reviews__rating')).order_by('-avg_rating')
-    else:
-        products = products.order_by('name')
+    if sort in PRODUCT_SORTS:
+        products = products.order_by(*PRODUCT_SORTS[sort])
+    elif not (sort == 'relevance' and query):
+        products = products.order_by(*PRODUCT_SORTS['name'])
 
     # Pagination
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate(request, products, 12)
 
     categories = Category.objects.all()
 
     context = {
         'page_obj': page_obj,
         'categories': categories,
-        'selected_category': int(category_id) if category_id else None,
+        'selected_category': category_id,
         'sort': sort,
         'query': query,
+        'facets': facet_sidebar(request, counts, filters),
+        'result_count': counts['total'],
+        'clear_facets_url': clear_facets_url(request),
+        'selected_notes': selected_notes(request),
     }
     return render(request, 'perfumelux/products/list.html', context)
 
 
-def product_detail(request, slug):
-    """Product detail view with reviews and related products"""
-    product = get_object_or_404(Product, slug=slug, is_active=True)
-    # related_products = Product.objects.filter(category=product.category, is_active=True)
+def product_facets(request):
+    """Facet counts for the catalog as JSON, honouring the same filters as product_list"""
+    products, category_id, query, product_ids = _catalog(request)
+    filters = parse_facet_filters(request.GET)
+    counts = facet_counts(filters, category_id, product_ids)
+    return JsonResponse(counts)
 
 
-# Add to recently viewed
+def remember_recently_viewed(request, product_id):
+    """Add to recently viewed"""
     recently_viewed = request.session.get('recently_viewed', [])
-    if product.id in recently_viewed:
-        recently_viewed.remove(product.id)
-    recently_viewed.insert(0, product.id)
+    if product_id in recently_viewed:
+        recently_viewed.remove(product_id)
+    recently_viewed.insert(0, product_id)
     # Keep only the last 5 viewed products
     request.session['recently_viewed'] = recently_viewed[:5]
 
-    # Get reviews
-    reviews = product.reviews.filter(active=True).order_by('-created_at')
 
-    # Get related products
-    related_products = Product.objects.filter(
-        category=product.category, active=True
-    ).exclude(id=product.id)[:4]
+def _product_page_hit(request, meta):
+    remember_recently_viewed(request, meta['product_id'])
+    record_view(meta['product_id'])
+
+
+@cache_anonymous_page(on_hit=_product_page_hit)
+def product_detail(request, slug):
+    """Product detail view with reviews and related products"""
+    product = get_object_or_404(
+        prefetch_gallery(Product.objects.select_related('category')), slug=slug, is_active=True
+    )
+    cache_depends(request, product, product.category)
+    set_page_meta(request, product_id=product.id)
+
+    remember_recently_viewed(request, product.id)
+    record_view(product.id)
+
+    # Get reviews
+    reviews = product.reviews.filter(is_active=True).order_by('-created_at')
+
+    # Get related products: the most scent-similar ones, topped up from the same category
+    related_products = [
+        row.similar for row in SimilarProduct.objects.filter(product=product, similar__is_active=True)
+        .select_related('similar').order_by('rank')[:4]
+    ]
+    if len(related_products) < 4:
+        related_products += Product.objects.filter(
+            category=product.category, is_active=True
+        ).exclude(id__in=[product.id, *(related.id for related in related_products)])[:4 - len(related_products)]
 
     # Review form
     review_form = ReviewForm()
@@ -140,6 +226,8 @@ def product_detail(request, slug):
         'product': product,
         'reviews': reviews,
         'related_products': related_products,
+        'also_bought': also_bought_products([product.id]),
+        'notes_by_tier': notes_by_tier(product),
         'review_form': review_form,
         'user_review': user_review,
     }
@@ -150,7 +238,7 @@ def product_detail(request, slug):
 @require_POST
 def add_review(request, product_id):
     """Add a review to a product"""
-    product = get_object_or_404(Product, id=product_id, active=True)
+    product = get_object_or_404(Product, id=product_id, is_active=True)
     form = ReviewForm(request.POST)
 
     if form.is_valid():
@@ -183,16 +271,18 @@ def category_list(request):
     return render(request, 'perfumelux/categories/list.html', context)
 
 
+@cache_anonymous_page(tags=['products'])
 def category_detail(request, slug):
     """Display products in a specific category"""
     category = get_object_or_404(Category, slug=slug)
-    products = Product.objects.filter(category=category, is_active=True)
-
+    cache_depends(request, category)
+    sort = request.GET.get('sort', 'name')
+    products = Product.objects.filter(category=category, is_active=True).order_by(
+        *PRODUCT_SORTS.get(sort, PRODUCT_SORTS['name'])
+    )
 
     # Pagination
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate(request, products, 12)
 
     context = {
         'category': category,
@@ -201,20 +291,23 @@ def category_detail(request, slug):
     return render(request, 'perfumelux/categories/detail.html', context)
 
 
-@login_required
 def cart_view(request):
-    """Display user's shopping cart"""
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_items = cart.items.select_related('product')  # ✅ use related_name="items"
+    """Display the shopping cart; guests see the cart kept in their session"""
+    if request.user.is_authenticated:
+        cart, created = Cart.objects.get_or_create(user=request.user)
+        cart_items = cart.items.select_related('product', 'product__category')
+    else:
+        cart = GuestCart(request.session)
+        cart_items = cart.get_items()
 
     context = {
         'cart': cart,
         'cart_items': cart_items,
+        'also_bought': also_bought_products(item.product.id for item in cart_items),
     }
     return render(request, 'perfumelux/cart.html', context)
 
 
-@login_required
 @require_POST
 def add_to_cart(request):
     """Add product to cart or update quantity"""
@@ -223,71 +316,92 @@ def add_to_cart(request):
     quantity = int(data.get('quantity', 1))
 
     product = get_object_or_404(Product, id=product_id, is_active=True)
-    cart, created = Cart.objects.get_or_create(user=request.user)
+    record_cart_add(product.pk)
 
-    cart_item, created = CartItem.objects.get_or_create(
-        cart=cart,
-        product=product,
-        defaults={'quantity': quantity}
-    )
+    if request.user.is_authenticated:
+        cart, created = Cart.objects.get_or_create(user=request.user)
+
+        cart_item, created = CartItem.objects.get_or_create(
+            cart=cart,
+            product=product,
+            defaults={'quantity': quantity}
+        )
 
-    if not created:
-        cart_item.quantity += quantity
-        cart_item.save()
+        if not created:
+            cart_item.quantity += quantity
+            cart_item.save()
+
+        cart_count = get_cart_summary(request.user.id)['count']
+    else:
+        guest_cart = GuestCart(request.session)
+        guest_cart.add(product.pk, quantity)
+        cart_count = guest_cart.get_items_count()
 
     return JsonResponse({
         'success': True,
         'message': 'Product added to cart',
-        'cart_count': cart.get_items_count(),   # ✅ fixed
+        'cart_count': cart_count,
     })
 
 
-@login_required
 @require_POST
 def update_cart_item(request):
-    """Update cart item quantity"""
+    """Update cart item quantity; for guests item_id is the product id"""
     data = json.loads(request.body)
     item_id = data.get('item_id')
     quantity = int(data.get('quantity', 1))
 
-    cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
+    if request.user.is_authenticated:
+        cart_item = get_object_or_404(
+            CartItem.objects.select_related('product'), id=item_id, cart__user=request.user
+        )
 
-    if quantity <= 0:
-        cart_item.delete()
-        message = 'Item removed from cart'
+        if quantity <= 0:
+            cart_item.delete()
+        else:
+            cart_item.quantity = quantity
+            cart_item.save()
+        price = cart_item.product.price
     else:
-        cart_item.quantity = quantity
-        cart_item.save()
-        message = 'Cart updated'
+        guest_cart = GuestCart(request.session)
+        if item_id not in guest_cart:
+            raise Http404('No such cart item.')
+        price = get_object_or_404(Product, id=item_id).price
+        guest_cart.set(item_id, quantity)
 
-    cart = Cart.objects.get(user=request.user)
+    summary = get_request_cart_summary(request)
 
     return JsonResponse({
         'success': True,
-        'message': message,
-        'cart_total': cart.get_total_price(),   # ✅ fixed
-        'item_total': cart_item.total_price if quantity > 0 else 0,  # ✅ fixed
-        'cart_count': cart.get_items_count(),   # ✅ fixed
+        'message': 'Cart updated' if quantity > 0 else 'Item removed from cart',
+        'cart_total': summary['total'],
+        'item_total': price * quantity if quantity > 0 else 0,
+        'cart_count': summary['count'],
     })
 
 
-@login_required
 @require_POST
 def remove_from_cart(request):
-    """Remove item from cart"""
+    """Remove item from cart; for guests item_id is the product id"""
     data = json.loads(request.body)
     item_id = data.get('item_id')
 
-    cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
-    cart_item.delete()
+    if request.user.is_authenticated:
+        cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
+        cart_item.delete()
+    else:
+        guest_cart = GuestCart(request.session)
+        if item_id not in guest_cart:
+            raise Http404('No such cart item.')
+        guest_cart.remove(item_id)
 
-    cart = Cart.objects.get(user=request.user)
+    summary = get_request_cart_summary(request)
 
     return JsonResponse({
         'success': True,
         'message': 'Item removed from cart',
-        'cart_total': cart.get_total_price(),   # ✅ fixed
-        'cart_count': cart.get_items_count(),   # ✅ fixed
+        'cart_total': summary['total'],
+        'cart_count': summary['count'],
     })
 
 
@@ -313,16 +427,21 @@ def toggle_wishlist(request):
 
     # corrected field name from active to is_active
     product = get_object_or_404(Product, id=product_id, is_active=True)
-    wishlist, created = Wishlist.objects.get_or_create(user=request.user)
+    wishlisted = get_wishlisted_ids(request.user.pk)
 
-    if wishlist.products.filter(id=product.id).exists():
-        wishlist.products.remove(product)
+    if product.pk in wishlisted:
+        for wishlist in Wishlist.objects.filter(user=request.user):
+            wishlist.products.remove(product)
+        wishlisted = wishlisted - {product.pk}
         is_in_wishlist = False
         message = 'Product removed from wishlist'
     else:
+        wishlist, created = Wishlist.objects.get_or_create(user=request.user)
         wishlist.products.add(product)
+        wishlisted = wishlisted | {product.pk}
         is_in_wishlist = True
         message = 'Product added to wishlist'
+    remember_wishlisted_ids(request.user.pk, wishlisted)
 
     return JsonResponse({
         'success': True,
@@ -344,45 +463,28 @@ def checkout(request):
     if request.method == 'POST':
         form = CheckoutForm(request.POST)
         if form.is_valid():
-            # Calculate totals
-            subtotal = cart.get_total_price()
-            tax_amount = 0  # add tax rules if needed
-            shipping_cost = 0  # add shipping rules
-            discount_amount = 0  # add coupon logic if needed
-            total = subtotal + tax_amount + shipping_cost - discount_amount
-
-            # Create order
-            order = Order.objects.create(
-                user=request.user,
-                first_name=form.cleaned_data['first_name'],
-                last_name=form.cleaned_data['last_name'],
-                email=form.cleaned_data['email'],
-                phone=form.cleaned_data['phone'],
-                address=form.cleaned_data['address'],
-                city=form.cleaned_data['city'],
-                state=form.cleaned_data['state'],
-                zip_code=form.cleaned_data['zip_code'],
-                country=form.cleaned_data['country'],
-                payment_method=form.cleaned_data['payment_method'],  # ✅ now required
-                subtotal=subtotal,
-                tax_amount=tax_amount,
-                shipping_cost=shipping_cost,
-                discount_amount=discount_amount,
-                total=total,
-                notes=form.cleaned_data.get('notes', '')
-            )
-
-            # Create order items
-            for cart_item in cart_items:
-                OrderItem.objects.create(
-                    order=order,
-                    product=cart_item.product,
-                    quantity=cart_item.quantity,
-                    price=cart_item.product.price
+            try:
+                # Totals, stock, order items and clearing the cart happen in one transaction
+                order = place_order(
+                    request.user,
+                    first_name=form.cleaned_data['first_name'],
+                    last_name=form.cleaned_data['last_name'],
+                    email=form.cleaned_data['email'],
+                    phone=form.cleaned_data['phone'],
+                    address=form.cleaned_data['address'],
+                    city=form.cleaned_data['city'],
+                    state=form.cleaned_data['state'],
+                    zip_code=form.cleaned_data['zip_code'],
+                    country=form.cleaned_data['country'],
+                    payment_method=form.cleaned_data['payment_method'],  # ✅ now required
+                    tax_amount=0,  # add tax rules if needed
+                    shipping_cost=0,  # add shipping rules
+                    discount_amount=0,  # add coupon logic if needed
+                    notes=form.cleaned_data.get('notes', '')
                 )
-
-            # Clear the cart
-            cart.items.all().delete()
+            except CheckoutError as e:
+                messages.error(request, str(e))
+                return redirect('cart')
 
             messages.success(request, 'Your order has been placed successfully!')
             return redirect('order_confirmation', order_id=order.id)
@@ -415,22 +517,6 @@ def order_confirmation(request, order_id):
     return render(request, 'perfumelux/order_confirmation.html', context)
 
 
-@login_required
-def order_history(request):
-    """Display user's order history"""
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-
-    # Pagination
-    paginator = Paginator(orders, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-
-    context = {
-        'page_obj': page_obj,
-    }
-    return render(request, 'perfumelux/orders/history.html', context)
-
-
 @login_required
 def order_detail(request, order_id):
     """Order detail view"""
@@ -441,6 +527,7 @@ def order_detail(request, order_id):
     return render(request, 'perfumelux/orders/detail.html', context)
 
 
+@cache_anonymous_page()
 def about(request):
     """About page"""
     return render(request, 'perfumelux/about.html')
@@ -449,8 +536,7 @@ def about(request):
 def contact(request):
     """
     Contact page with form submission.
-    Saves message to database and sends email to owner.
-    Shows success or error messages on the page.
+    Saves message to database and queues an email to the owner.
     """
     if request.method == "POST":
         form = ContactForm(request.POST)
@@ -458,7 +544,7 @@ def contact(request):
             # Save to DB
             contact_obj = form.save()
 
-            # Prepare email
+            # Email the owner from a background job, so the visitor doesn't wait on SMTP
             subject = f"New Contact Form Submission: {contact_obj.subject}"
             message = f"""
 You have received a new message from {contact_obj.name} ({contact_obj.email}).
@@ -468,20 +554,14 @@ Subject: {contact_obj.subject}
 Message:
 {contact_obj.message}
 """
-
-            try:
-                # Send email to owner
-                send_mail(
-                    subject,
-                    message,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [settings.CONTACT_EMAIL],
-                    fail_silently=False,   # Show errors instead of hiding
-                )
-                messages.success(request, "✅ Your message has been sent successfully!")
-            except Exception as e:
-                # Show the actual Gmail error in browser
-                messages.error(request, f"❌ Email sending failed: {e}")
+            enqueue(
+                tasks.send_email,
+                subject=subject,
+                message=message,
+                recipient_list=[settings.CONTACT_EMAIL],
+                reply_to=[contact_obj.email],
+            )
+            messages.success(request, "✅ Your message has been sent successfully!")
 
             return redirect("contact")  # Redirect to clear POST data
     else:
@@ -495,26 +575,34 @@ def newsletter_subscribe(request):
     if request.method == 'POST':
         form = NewsletterForm(request.POST)
         if form.is_valid():
-            # Here you would typically save to database and send to email service
-            # For now, we'll just return a success message
             email = form.cleaned_data['email']
+            subscribe(email)
             messages.success(request, f'Thank you for subscribing with {email}!')
             return redirect('home')
 
     return redirect('home')
 
 
+@csrf_exempt
+def newsletter_unsubscribe(request, token):
+    """Unsubscribe link of newsletter emails
+
+    GET asks for confirmation, so link scanners don't unsubscribe anyone;
+    POST, also what one-click List-Unsubscribe clients send, unsubscribes.
+    """
+    subscriber = get_object_or_404(NewsletterSubscriber, token=token)
+    if request.method == 'POST':
+        NewsletterSubscriber.objects.filter(pk=subscriber.pk).update(is_active=False, updated_at=timezone.now())
+        subscriber.is_active = False
+    return render(request, 'perfumelux/newsletter/unsubscribe.html', {'subscriber': subscriber})
+
+
 def search(request):
     """Search products"""
     query = request.GET.get('q', '')
 
     if query:
-        products = Product.objects.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(category__name__icontains=query),
-            is_active=True  # <-- corrected field name
-        ).order_by('name')
+        products = search_products(Product.objects.filter(is_active=True), query)
     else:
         products = Product.objects.none()
 
@@ -525,22 +613,67 @@ def search(request):
     return render(request, 'perfumelux/search.html', context)
 
 
+@require_POST
+def cart_batch(request):
+    """Apply a list of add/set/remove operations to the cart in one request
+
+    Body: {"operations": [{"op": "add", "product_id": 3, "quantity": 2},
+    {"op": "remove", "product_id": 5}, ...]}. Products that aren't
+    available are skipped and listed in the response.
+    """
+    try:
+        changes = fold_operations(json.loads(request.body).get('operations'))
+    except (ValueError, AttributeError) as exc:
+        return JsonResponse({'success': False, 'message': str(exc)}, status=400)
+
+    # Products can always be removed, but only active ones added
+    adding = [product_id for product_id, (absolute, quantity) in changes.items() if quantity > 0]
+    available = set(Product.objects.filter(pk__in=adding, is_active=True).values_list('pk', flat=True))
+    skipped = [product_id for product_id in adding if product_id not in available]
+    for product_id in skipped:
+        del changes[product_id]
+
+    if request.user.is_authenticated:
+        items = apply_cart_operations(request.user, changes) if changes else {}
+        summary = CartItem.objects.filter(cart__user=request.user).totals()
+    else:
+        guest_cart = GuestCart(request.session)
+        items = guest_cart.apply(changes)
+        summary = guest_cart.get_summary()
+
+    return JsonResponse({
+        'success': True,
+        'message': 'Cart updated',
+        'items': {str(product_id): quantity for product_id, quantity in items.items()},
+        'skipped': skipped,
+        'cart_total': summary['total'],
+        'cart_count': summary['count'],
+    })
+
+
 # API views for AJAX functionality
-@login_required
 def get_cart_count(request):
     """Get cart item count for navbar icon"""
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    return JsonResponse({'count': cart.get_items_count()})
+    if request.user.is_authenticated:
+        return JsonResponse({'count': get_cart_summary(request.user.id)['count']})
+    return JsonResponse({'count': GuestCart(request.session).get_items_count()})
 
 
 @login_required
 def check_wishlist_status(request, product_id):
     """Check if product is in user's wishlist"""
-    product = get_object_or_404(Product, id=product_id)
-    wishlist, created = Wishlist.objects.get_or_create(user=request.user)
-    is_in_wishlist = wishlist.products.filter(id=product.id).exists()
+    return JsonResponse({'is_in_wishlist': product_id in get_wishlisted_ids(request.user.pk)})
+
+
+def wishlist_status(request):
+    """Which of ?ids=1,2,3 are in the user's wishlist, for product grids"""
+    try:
+        product_ids = [int(value) for value in request.GET.get('ids', '').split(',') if value.strip()]
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'ids must be a comma-separated list of integers'}, status=400)
 
-    return JsonResponse({'is_in_wishlist': is_in_wishlist})
+    wishlisted = get_wishlisted_ids(request.user.pk) if request.user.is_authenticated else frozenset()
+    return JsonResponse({'wishlisted': [product_id for product_id in product_ids if product_id in wishlisted]})
 
 
 def product_quick_view(request, product_id):
@@ -589,7 +722,7 @@ def profile(request):
     """User profile view"""
     user = request.user
     orders = user.order_set.all().order_by('-created_at')[:5]
-    wishlist_count = user.wishlist_set.first().products.count() if hasattr(user, 'wishlist_set') and user.wishlist_set.exists() else 0
+    wishlist_count = get_wishlist_count(user.pk)
     review_count = user.review_set.count()
 
     context = {
@@ -621,26 +754,10 @@ def profile_update(request):
 @login_required
 def order_history(request):
     """Display user's order history"""
-    orders = request.user.order_set.all().order_by('-created_at')
-
-    # Add status to orders for display purposes
-    for order in orders:
-        if not hasattr(order, 'status'):
-            # Set a default status based on order age for demonstration
-            from django.utils import timezone
-            from datetime import timedelta
-            if timezone.now() - order.created_at > timedelta(days=7):
-                order.status = 'delivered'
-            elif timezone.now() - order.created_at > timedelta(days=2):
-                order.status = 'shipped'
-            else:
-                order.status = 'processing'
+    orders = request.user.order_set.all().order_by('-created_at', '-id')
 
     # Pagination
-    from django.core.paginator import Paginator
-    paginator = Paginator(orders, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate(request, orders, 10)
 
     context = {
         'page_obj': page_obj,
@@ -651,42 +768,30 @@ def order_history(request):
 @login_required
 def reorder(request, order_id):
     """Reorder items from a previous order"""
-    from django.http import JsonResponse
-    from .models import Cart, CartItem, Order
-
-    try:
-        order = Order.objects.get(id=order_id, user=request.user)
-        cart, created = Cart.objects.get_or_create(user=request.user)
-
-        # Add all items from the order to the cart
-        for order_item in order.orderitem_set.all():
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart,
-                product=order_item.product,
-                defaults={'quantity': order_item.quantity}
-            )
-            if not created:
-                cart_item.quantity += order_item.quantity
-                cart_item.save()
-
-        cart_count = cart.get_items_count()
-
-        return JsonResponse({
-            'success': True,
-            'message': 'Items added to cart successfully',
-            'cart_count': cart_count
-        })
-
-    except Order.DoesNotExist:
+    order = Order.objects.filter(id=order_id, user=request.user).first()
+    if order is None:
         return JsonResponse({
             'success': False,
             'message': 'Order not found'
         }, status=404)
 
+    skipped = reorder_to_cart(request.user, order)
+    message = 'Items added to cart successfully'
+    if skipped:
+        message = 'Some items are no longer available: ' + ', '.join(name for _, name in skipped)
+
+    return JsonResponse({
+        'success': True,
+        'message': message,
+        'skipped': [product_id for product_id, _ in skipped],
+        'cart_count': get_cart_summary(request.user.id)['count'],
+    })
+
 
 # Custom Password Reset Views with neumorphic styling context
 class CustomPasswordResetView(PasswordResetView):
     template_name = 'perfumelux/auth/password_reset.html'
+    form_class = QueuedPasswordResetForm
     email_template_name = 'perfumelux/auth/password_reset_email.html'
     subject_template_name = 'perfumelux/auth/password_reset_subject.txt'
     success_url = reverse_lazy('password_reset_done')
@@ -768,7 +873,11 @@ def delete_account(request):
     if request.method == 'POST':
         user = request.user
         logout(request)
-        user.delete()
+        # Deactivated now so the account can't be used; the delete, which
+        # cascades to orders, reviews and the rest, runs as a background job
+        user.is_active = False
+        user.save(update_fields=['is_active'])
+        enqueue(tasks.delete_user, user_id=user.pk)
         messages.success(request, 'Your account has been deleted successfully.')
         return redirect('home')
 
@@ -787,6 +896,11 @@ def toggle_newsletter(request):
 
     request.user.newsletter_subscribed = subscribed
     request.user.save()
+    # Campaigns are mailed to NewsletterSubscriber, so keep it in step
+    if subscribed:
+        subscribe(request.user.email)
+    else:
+        NewsletterSubscriber.objects.filter(email__iexact=request.user.email).update(is_active=False)
 
     return JsonResponse({
         'success': True,
@@ -795,21 +909,25 @@ def toggle_newsletter(request):
     })
 
 
+@cache_anonymous_page()
 def shipping_policy(request):
     """Shipping policy page"""
     return render(request, 'perfumelux/policies/shipping.html')
 
 
+@cache_anonymous_page()
 def returns_exchanges(request):
     """Returns and exchanges policy page"""
     return render(request, 'perfumelux/policies/returns.html')
 
 
+@cache_anonymous_page()
 def faq(request):
     """Frequently Asked Questions page"""
     return render(request, 'perfumelux/policies/faq.html')
 
 
+@cache_anonymous_page()
 def privacy_policy(request):
     """Privacy policy page"""
     return render(request, 'perfumelux/policies/privacy.html')
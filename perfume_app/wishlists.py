@@ -0,0 +1,47 @@
+# wishlists.py
+"""Per-user cache of wishlisted product ids
+
+Product grids mark wishlisted products and the header shows the count;
+both read this set, so neither costs a query on a cache hit. Any change
+to a wishlist drops the set; toggle_wishlist writes the new one back
+straight away.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Wishlist
+
+IDS_TIMEOUT = 60 * 60 * 24
+
+
+def _ids_key(user_id):
+    return f'wishlist:ids:{user_id}'
+
+
+def get_wishlisted_ids(user_id):
+    """frozenset of the ids of every product in the user's wishlists"""
+    key = _ids_key(user_id)
+    ids = cache.get(key)
+    if ids is None:
+        ids = frozenset(
+            Wishlist.products.through.objects.filter(wishlist__user_id=user_id).values_list('product_id', flat=True)
+        )
+        cache.set(key, ids, IDS_TIMEOUT)
+    return ids
+
+
+def remember_wishlisted_ids(user_id, ids):
+    cache.set(_ids_key(user_id), frozenset(ids), IDS_TIMEOUT)
+
+
+def get_wishlist_count(user_id):
+    return len(get_wishlisted_ids(user_id))
+
+
+def forget_wishlisted_ids(*user_ids):
+    cache.delete_many([_ids_key(user_id) for user_id in user_ids])
+
+
+def wishlist_changed(*user_ids):
+    forget_wishlisted_ids(*user_ids)
+    transaction.on_commit(lambda: forget_wishlisted_ids(*user_ids))
@@ -57,6 +57,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'perfume_app.context_processors.header_counts',
             ],
         },
     },
@@ -70,6 +71,20 @@ DATABASES = {
     )
 }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Take the write lock at BEGIN so concurrent transactions (e.g. two
+    # checkouts) queue on the busy timeout instead of failing mid-way.
+    # This applies to every atomic block on every request, not just
+    # checkout: each one holds the database's single write lock from
+    # its start, even if it turns out to only read
+    DATABASES['default'].setdefault('OPTIONS', {}).update({
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': 20,
+    })
+    # A file-backed test database, so tests can exercise that locking
+    # across threads (the in-memory one uses table-level locks)
+    DATABASES['default']['TEST'] = {'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -103,6 +118,27 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='perfumelux'),
+    }
+}
+
+# Full-page cache for anonymous catalog pages (seconds)
+PAGE_CACHE_TIMEOUT = config('PAGE_CACHE_TIMEOUT', default=600, cast=int)
+# How long an expired page may still be served while one worker rebuilds it
+PAGE_CACHE_STALE_TTL = config('PAGE_CACHE_STALE_TTL', default=300, cast=int)
+# Visitors with any of these set in their session always get a fresh render
+# (the header shows the guest cart)
+PAGE_CACHE_SKIP_SESSION_KEYS = ['cart']
+
+# Worker processes the run_workers command starts for background jobs
+JOB_WORKERS = config('JOB_WORKERS', default=2, cast=int)
+
+# Listing pagination: 'offset' (numbered pages) or 'cursor' (keyset pages)
+PAGINATION_MODE = config('PAGINATION_MODE', default='offset')
+
 # Custom user model
 AUTH_USER_MODEL = 'perfume_app.User'
 
@@ -121,6 +157,9 @@ EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 CONTACT_EMAIL = config('CONTACT_EMAIL', default=EMAIL_HOST_USER)
 
+# Base URL for links in emails sent outside a request (newsletters)
+SITE_URL = config('SITE_URL', default='http://localhost:8000')
+
 if not DEBUG:
     SECURE_BROWSER_XSS_FILTER = True
     SECURE_CONTENT_TYPE_NOSNIFF = True